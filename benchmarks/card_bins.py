@@ -0,0 +1,84 @@
+"""
+Microbenchmarks for card classification and validation in payment_service.
+
+* first digit: the original detect_card_type (one character comparison)
+* bin lookup:  BinTable.lookup, a bisect over the compiled BIN ranges
+* luhn:        luhn_valid on 16-digit numbers
+* validator:   PaymentRequest card_number validation (cleanup, Luhn, length by network)
+
+Usage:
+    python benchmarks/card_bins.py [--iterations 200000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "payment_service"))
+
+from card_bins import bin_table, luhn_valid  # noqa: E402
+from schemas import PaymentRequest  # noqa: E402
+
+# 16-digit numbers are valid for all of these (American Express is 15 digits)
+PREFIXES = ["4", "51", "2221", "6011", "622126", "62", "300", "3528", "2200", "6759", "99"]
+
+
+def with_check_digit(partial: str) -> str:
+    return next(partial + str(d) for d in range(10) if luhn_valid(partial + str(d)))
+
+
+def card_numbers(count: int):
+    numbers = []
+    for _ in range(count):
+        prefix = random.choice(PREFIXES)
+        body = prefix + "".join(random.choice("0123456789") for _ in range(15 - len(prefix)))
+        numbers.append(with_check_digit(body))
+    return numbers
+
+
+def first_digit(card_number: str) -> str:
+    first = card_number[0]
+    if first == '4':
+        return 'Visa'
+    elif first == '5':
+        return 'Mastercard'
+    elif first == '3':
+        return 'American Express'
+    return 'Unknown'
+
+
+def report(name: str, iterations: int, elapsed: float):
+    print(f"{name:<12} {iterations / elapsed:>12,.0f} ops/s {elapsed / iterations * 1e9:>10.0f} ns/op")
+
+
+def bench(name: str, fn, numbers, iterations: int):
+    count = len(numbers)
+    start = time.perf_counter()
+    for i in range(iterations):
+        fn(numbers[i % count])
+    report(name, iterations, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200000)
+    args = parser.parse_args()
+
+    numbers = card_numbers(1000)
+    print(f"{len(bin_table)} compiled BIN intervals")
+    bench("first digit", first_digit, numbers, args.iterations)
+    bench("bin lookup", bin_table.lookup, numbers, args.iterations)
+    bench("luhn", luhn_valid, numbers, args.iterations)
+
+    user_id = uuid.uuid4()
+
+    def validate(number: str):
+        PaymentRequest(user_id=user_id, amount=80.0, card_number=number, card_holder="Bench", expiry_date="12/30", cvv="123")
+
+    bench("validator", validate, numbers, args.iterations // 10)
+
+
+if __name__ == "__main__":
+    main()
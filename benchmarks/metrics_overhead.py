@@ -0,0 +1,122 @@
+"""
+Cost of shared.metrics on the request path.
+
+Calls a small FastAPI app as a plain ASGI callable, with no server or
+client in the way, once without and once with MetricsMiddleware and
+QueryProfilerMiddleware, and once with TracingMiddleware as well (memory
+exporter, every request sampled):
+
+* route:    GET /items/{item_id}, which returns a small JSON body
+* db route: the same route plus three SELECTs on an in-memory SQLite engine,
+            with and without watch_engine (two cursor events per query)
+
+Each case alternates between the apps for --rounds rounds and keeps
+the fastest round of each, which filters out noise from other processes.
+It prints microseconds per request and the difference that the metrics
+and the tracing make. It also prints the raw cost of Histogram.observe and how
+long rendering /metrics takes with --routes route templates of samples.
+
+Usage:
+    python benchmarks/metrics_overhead.py [--requests 5000] [--rounds 7] [--routes 50]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services"))
+
+from fastapi import FastAPI  # noqa: E402
+from sqlalchemy import create_engine, text  # noqa: E402
+
+from shared.metrics import Histogram, MetricsMiddleware, REQUEST_DURATION, REQUESTS, registry  # noqa: E402
+from shared.query_profiler import QueryProfilerMiddleware, watch_engine  # noqa: E402
+from shared.tracing import MemoryExporter, TracingMiddleware  # noqa: E402
+import shared.tracing  # noqa: E402
+
+
+def build_app(with_metrics: bool, with_tracing: bool = False) -> FastAPI:
+    app = FastAPI()
+    engine = create_engine("sqlite://")
+    if with_metrics:
+        app.add_middleware(QueryProfilerMiddleware, service="bench", enabled=True)
+        if with_tracing:
+            app.add_middleware(TracingMiddleware, service="bench", enabled=True, sample_rate=1.0)
+        app.add_middleware(MetricsMiddleware, enabled=True)
+        watch_engine(engine, "bench")
+
+    @app.get("/items/{item_id}")
+    async def get_item(item_id: int):
+        return {"id": item_id, "name": "item"}
+
+    @app.get("/db/{item_id}")
+    async def get_db_item(item_id: int):
+        with engine.connect() as connection:
+            for _ in range(3):
+                connection.execute(text("SELECT 1"))
+        return {"id": item_id}
+
+    return app
+
+
+async def drive(app, path: str, requests: int) -> float:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"",
+        "headers": [(b"host", b"bench")], "client": ("127.0.0.1", 1234), "server": ("bench", 80),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    started = time.perf_counter()
+    for _ in range(requests):
+        await app(dict(scope), receive, send)
+    return (time.perf_counter() - started) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000, help="requests per round")
+    parser.add_argument("--rounds", type=int, default=7)
+    parser.add_argument("--routes", type=int, default=50)
+    args = parser.parse_args()
+
+    shared.tracing.exporter = MemoryExporter()
+    plain, instrumented, traced = build_app(False), build_app(True), build_app(True, with_tracing=True)
+    for name, path in (("route", "/items/7"), ("db route", "/db/7")):
+        for app in (plain, instrumented, traced):
+            asyncio.run(drive(app, path, 200))
+        base = with_metrics = with_tracing = float("inf")
+        for _ in range(args.rounds):
+            base = min(base, asyncio.run(drive(plain, path, args.requests)))
+            with_metrics = min(with_metrics, asyncio.run(drive(instrumented, path, args.requests)))
+            with_tracing = min(with_tracing, asyncio.run(drive(traced, path, args.requests)))
+        for label, seconds in (("metrics", with_metrics), ("+tracing", with_tracing)):
+            print(
+                f"{name:<9} without {base * 1e6:7.1f} us  {label:<8} {seconds * 1e6:7.1f} us  "
+                f"overhead {(seconds - base) * 1e6:5.1f} us ({(seconds / base - 1) * 100:4.1f}%)"
+            )
+
+    histogram = Histogram("bench_seconds", "bench", ("method", "route", "status"))
+    labels = ("GET", "/items/{item_id}", "200")
+    started = time.perf_counter()
+    for i in range(args.requests * 10):
+        histogram.observe(labels, 0.0042)
+    print(f"observe   {(time.perf_counter() - started) / (args.requests * 10) * 1e9:7.0f} ns")
+
+    for i in range(args.routes):
+        for status in ("200", "201", "404", "500"):
+            REQUESTS.inc(("GET", f"/route/{i}", status))
+            REQUEST_DURATION.observe(("GET", f"/route/{i}", status), 0.01)
+    started = time.perf_counter()
+    body = registry.render()
+    print(f"render    {(time.perf_counter() - started) * 1000:7.2f} ms for {len(body.splitlines())} lines")
+
+
+if __name__ == "__main__":
+    main()
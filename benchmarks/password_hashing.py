@@ -0,0 +1,65 @@
+"""
+Measure bcrypt throughput through auth_service's PasswordHasher.
+
+Runs a fixed number of concurrent hash calls for each cost factor and
+executor kind and reports hashes per second overall and per worker, plus
+how many calls were rejected as busy when the queue is undersized.
+
+Usage:
+    python benchmarks/password_hashing.py [--rounds 10 12] [--workers 4] [--hashes 64]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "auth_service"))
+
+from password_hashing import PasswordHasher, PasswordHasherBusy  # noqa: E402
+
+
+async def run(hasher: PasswordHasher, hashes: int):
+    async def one(i):
+        try:
+            await hasher.hash(f"password-{i}")
+            return True
+        except PasswordHasherBusy:
+            return False
+
+    # Warm the executor so process start-up is not measured
+    await asyncio.gather(*(one(i) for i in range(hasher.workers)))
+    start = time.perf_counter()
+    results = await asyncio.gather(*(one(i) for i in range(hashes)))
+    return time.perf_counter() - start, results.count(True), results.count(False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, nargs="+", default=[10, 12])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--hashes", type=int, default=64)
+    args = parser.parse_args()
+
+    print(f"{'executor':<10} {'rounds':>6} {'workers':>7} {'hashes/s':>10} {'per worker':>10} {'rejected':>8}")
+    for rounds in args.rounds:
+        for use_processes in (False, True):
+            hasher = PasswordHasher(
+                rounds=rounds,
+                workers=args.workers,
+                max_pending=args.hashes,
+                queue_timeout=600,
+                use_processes=use_processes,
+            )
+            try:
+                elapsed, done, rejected = asyncio.run(run(hasher, args.hashes))
+            finally:
+                hasher.shutdown()
+            rate = done / elapsed
+            kind = "process" if use_processes else "thread"
+            print(f"{kind:<10} {rounds:>6} {args.workers:>7} {rate:>10.1f} {rate / args.workers:>10.1f} {rejected:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+-- Deny-list for signed access tokens (AUTH_TOKEN_MODE=signed).
+-- Rows are only relevant until expires_at; verifiers sync the live ones via GET /auth/revocations.
+
+CREATE TABLE IF NOT EXISTS auth_service.revoked_access_tokens (
+    jti VARCHAR(32) PRIMARY KEY,
+    user_id UUID NOT NULL,
+    expires_at TIMESTAMP NOT NULL,
+    revoked_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_revoked_access_tokens_expires_at ON auth_service.revoked_access_tokens(expires_at);
@@ -0,0 +1,11 @@
+-- Expiry for auth_tokens (opaque session tokens, or refresh tokens in signed mode).
+-- Existing rows get the default 7 day lifetime counted from creation; the auth service
+-- purges expired rows in batches using idx_auth_tokens_expires_at.
+
+ALTER TABLE auth_service.auth_tokens ADD COLUMN IF NOT EXISTS expires_at TIMESTAMP;
+UPDATE auth_service.auth_tokens SET expires_at = COALESCE(created_at, NOW()) + INTERVAL '7 days' WHERE expires_at IS NULL;
+ALTER TABLE auth_service.auth_tokens ALTER COLUMN expires_at SET NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_auth_tokens_expires_at ON auth_service.auth_tokens(expires_at);
+-- Newest-first per user, for AUTH_MAX_TOKENS_PER_USER trimming
+CREATE INDEX IF NOT EXISTS idx_auth_tokens_user_created ON auth_service.auth_tokens(user_id, created_at);
@@ -0,0 +1,16 @@
+-- Outbox for user profiles created at registration and delivered to user_service
+-- by the auth service's background dispatcher. Delivered rows are deleted;
+-- rows rejected by user_service stay with status 'failed' for inspection.
+
+CREATE TABLE IF NOT EXISTS auth_service.profile_outbox (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    user_id UUID NOT NULL,
+    payload JSON NOT NULL,
+    status VARCHAR(16) NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    last_error VARCHAR NULL,
+    created_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_profile_outbox_due ON auth_service.profile_outbox(next_attempt_at) WHERE status = 'pending';
@@ -0,0 +1,9 @@
+-- Login throttle counters shared by auth replicas (LOGIN_THROTTLE_BACKEND=postgres).
+-- UNLOGGED: losing the counters on a crash only resets the throttle.
+
+CREATE UNLOGGED TABLE IF NOT EXISTS auth_service.login_attempts (
+    key VARCHAR NOT NULL,
+    window_index BIGINT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (key, window_index)
+);
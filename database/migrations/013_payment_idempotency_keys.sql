@@ -0,0 +1,16 @@
+-- Idempotency-Key records for POST /payments/. A row is inserted and completed
+-- in the same transaction as the payment, so a committed row always carries the
+-- response to replay; a concurrent duplicate blocks on the uncommitted insert.
+-- Expired rows are deleted in batches by the payment service's purge thread.
+
+CREATE TABLE IF NOT EXISTS payment_service.idempotency_keys (
+    key VARCHAR(255) PRIMARY KEY,
+    fingerprint VARCHAR(64) NOT NULL,
+    payment_id UUID NULL,
+    response_status INTEGER NULL,
+    response_body JSON NULL,
+    created_at TIMESTAMP DEFAULT NOW(),
+    expires_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires_at ON payment_service.idempotency_keys(expires_at);
@@ -0,0 +1,5 @@
+-- PENDING payments form the queue drained by the payment workers
+-- (PAYMENT_PROCESSING_MODE=async). The partial index keeps claiming the
+-- oldest pending row cheap however many completed payments accumulate.
+
+CREATE INDEX IF NOT EXISTS idx_payments_pending ON payment_service.payments(created_at) WHERE status = 'PENDING';
@@ -0,0 +1,21 @@
+-- Per-user payment history is read newest first with keyset pagination
+-- on (created_at, id); spend totals come from a per-user, per-day rollup
+-- that payment_service updates in the transaction that completes a payment.
+
+CREATE INDEX IF NOT EXISTS idx_payments_user_created ON payment_service.payments(user_id, created_at DESC, id DESC);
+
+CREATE TABLE IF NOT EXISTS payment_service.user_daily_spend (
+    user_id UUID NOT NULL,
+    day DATE NOT NULL,
+    total_amount DOUBLE PRECISION NOT NULL DEFAULT 0,
+    payment_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, day)
+);
+
+-- Backfill from payments completed before the rollup existed
+INSERT INTO payment_service.user_daily_spend (user_id, day, total_amount, payment_count)
+SELECT user_id, (updated_at)::date, SUM(amount), COUNT(*)
+FROM payment_service.payments
+WHERE status = 'COMPLETED'
+GROUP BY user_id, (updated_at)::date
+ON CONFLICT (user_id, day) DO NOTHING;
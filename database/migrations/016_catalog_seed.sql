@@ -0,0 +1,33 @@
+-- Catalog seed data: the specialties and doctors the platform starts with.
+-- Re-runnable: rows that already exist (by id or name) are left as they are.
+
+INSERT INTO catalog_service.specialties (id, name, description) VALUES
+    ('b897c291-3ca0-44b6-a376-1fb13e2dda4c', 'Medicina General', 'Atención médica general'),
+    ('9d9dc434-a2bc-4a5a-9867-b9dc514c4e2d', 'Cardiología', 'Especialista en corazón y sistema cardiovascular'),
+    ('4d309499-1286-4869-ad20-a336f1eece37', 'Pediatría', 'Especialista en salud infantil'),
+    ('5955b0a7-1351-4991-84c1-04836a24da72', 'Dermatología', 'Especialista en piel y tejidos relacionados'),
+    ('2a73e4aa-21ca-4cd1-89f9-6de7bd0d851b', 'Ginecología', 'Especialista en salud femenina'),
+    ('6b73299b-0b43-44f8-9340-751aa8b0c089', 'Traumatología', 'Especialista en huesos, músculos y articulaciones'),
+    ('e94b5251-a759-4a48-bba5-5eaf777e4aac', 'Neurología', 'Especialista en sistema nervioso'),
+    ('c4e78714-f890-4e8d-890b-aff96ae39529', 'Oftalmología', 'Especialista en ojos y visión'),
+    ('6052bdea-3ddd-4512-afb9-e36b87238cbe', 'Psicología', 'Especialista en salud mental'),
+    ('80217568-4d6d-4021-90f3-20a951a3172d', 'Nutrición', 'Especialista en alimentación y dieta')
+ON CONFLICT DO NOTHING;
+
+-- Doctors whose specialty was not inserted (a different one already had its name) are skipped
+INSERT INTO catalog_service.doctors (id, name, specialty_id, rating, experience_years, price, photo_url)
+SELECT v.id::uuid, v.name, v.specialty_id::uuid, v.rating, v.experience_years, v.price, v.photo_url
+FROM (VALUES
+        ('e1a72605-6a58-47bc-9b6f-4770fc60f47e', 'Dra. María García López', 'b897c291-3ca0-44b6-a376-1fb13e2dda4c', 4.9, 15, 50.0, 'https://images.unsplash.com/photo-1559839734-2b71ea197ec2?w=200&h=200&fit=crop&crop=face'),
+        ('4d98d28a-7517-4560-8438-66db00244675', 'Dr. Carlos Rodríguez Sánchez', '9d9dc434-a2bc-4a5a-9867-b9dc514c4e2d', 4.8, 20, 80.0, 'https://images.unsplash.com/photo-1612349317150-e413f6a5b16d?w=200&h=200&fit=crop&crop=face'),
+        ('78235213-9a3b-4819-863d-498c1cd81711', 'Dra. Ana Martínez Ruiz', '4d309499-1286-4869-ad20-a336f1eece37', 4.95, 12, 60.0, 'https://images.unsplash.com/photo-1594824476967-48c8b964273f?w=200&h=200&fit=crop&crop=face'),
+        ('b863a3c9-0261-41bd-8c76-50851f5e27fb', 'Dr. Luis Fernández Torres', '5955b0a7-1351-4991-84c1-04836a24da72', 4.7, 8, 70.0, 'https://images.unsplash.com/photo-1622253692010-333f2da6031d?w=200&h=200&fit=crop&crop=face'),
+        ('f8a0322c-5690-4d57-8fb6-829d660e5b0b', 'Dra. Patricia Gómez Vega', '2a73e4aa-21ca-4cd1-89f9-6de7bd0d851b', 4.85, 18, 75.0, 'https://images.unsplash.com/photo-1651008376811-b90baee60c1f?w=200&h=200&fit=crop&crop=face'),
+        ('2c8a705e-a89f-43b9-a417-2fb078b54203', 'Dr. Roberto Díaz Mendoza', '6b73299b-0b43-44f8-9340-751aa8b0c089', 4.6, 22, 85.0, 'https://images.unsplash.com/photo-1537368910025-700350fe46c7?w=200&h=200&fit=crop&crop=face'),
+        ('e0c5c678-5db6-4299-9730-1be66fbab6f2', 'Dra. Elena Castro Navarro', 'e94b5251-a759-4a48-bba5-5eaf777e4aac', 4.9, 16, 90.0, 'https://images.unsplash.com/photo-1527613426441-4da17471b66d?w=200&h=200&fit=crop&crop=face'),
+        ('11c42f02-cd6e-44dc-9d8d-bb35d21c3b1e', 'Dr. Miguel Herrera Blanco', 'c4e78714-f890-4e8d-890b-aff96ae39529', 4.75, 14, 65.0, 'https://images.unsplash.com/photo-1582750433449-648ed127bb54?w=200&h=200&fit=crop&crop=face'),
+        ('c369fc6a-2f47-49a3-9a8c-9c98bc0eeb13', 'Dra. Laura Jiménez Ortega', '6052bdea-3ddd-4512-afb9-e36b87238cbe', 4.92, 10, 55.0, 'https://images.unsplash.com/photo-1573496359142-b8d87734a5a2?w=200&h=200&fit=crop&crop=face'),
+        ('9f05e263-ea7c-4ab4-9721-3fc75fbfa9c7', 'Dr. Antonio Morales Prieto', '80217568-4d6d-4021-90f3-20a951a3172d', 4.8, 7, 45.0, 'https://images.unsplash.com/photo-1612531386530-97286d97c2d2?w=200&h=200&fit=crop&crop=face')
+) AS v(id, name, specialty_id, rating, experience_years, price, photo_url)
+WHERE EXISTS (SELECT 1 FROM catalog_service.specialties s WHERE s.id = v.specialty_id::uuid)
+ON CONFLICT DO NOTHING;
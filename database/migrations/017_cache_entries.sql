@@ -0,0 +1,13 @@
+-- Shared cache store (CACHE_BACKEND=postgres|near, services/shared/cache.py).
+-- UNLOGGED: every entry can be loaded again, so losing them on a crash is fine.
+
+CREATE UNLOGGED TABLE IF NOT EXISTS public.cache_entries (
+    key VARCHAR NOT NULL PRIMARY KEY,
+    value BYTEA NOT NULL,
+    expires_at DOUBLE PRECISION NOT NULL,
+    load_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+    tags TEXT[] NOT NULL DEFAULT '{}'
+);
+
+CREATE INDEX IF NOT EXISTS idx_cache_entries_tags ON public.cache_entries USING GIN (tags);
+CREATE INDEX IF NOT EXISTS idx_cache_entries_expires_at ON public.cache_entries (expires_at);
@@ -0,0 +1,6 @@
+-- Queued payments whose gateway call gave no decision stay PENDING and are
+-- retried with backoff: attempts counts the calls without a decision and
+-- next_attempt_at holds the payment back until its backoff has passed.
+
+ALTER TABLE payment_service.payments ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE payment_service.payments ADD COLUMN IF NOT EXISTS next_attempt_at TIMESTAMP NULL;
@@ -0,0 +1,11 @@
+-- Logout-all for signed access tokens: every token of the user issued before
+-- revoked_before is rejected. Rows are only relevant until expires_at (the
+-- cutoff plus one access token lifetime); verifiers sync them via GET /auth/revocations.
+
+CREATE TABLE IF NOT EXISTS auth_service.user_revocations (
+    user_id UUID PRIMARY KEY,
+    revoked_before TIMESTAMP NOT NULL,
+    expires_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_user_revocations_expires_at ON auth_service.user_revocations(expires_at);
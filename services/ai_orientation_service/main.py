@@ -1,7 +1,12 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from routers import ai_router
-from database import create_tables
+from routers import ai_router, orientation_cache
+from database import dispose_engines, pool_monitor, warm_pool
+from shared.admission import AdmissionMiddleware, RouteLimit
+from shared.health import health_router, readiness
+from shared.metrics import MetricsMiddleware
+from shared.query_profiler import QueryProfilerMiddleware
+from shared.tracing import TracingMiddleware, tracing_router
 
 app = FastAPI(
     title="SaludYa AI Orientation Service",
@@ -10,6 +15,10 @@ app = FastAPI(
     root_path="/api/ai"
 )
 
+app.add_middleware(
+    AdmissionMiddleware, service="ai_orientation_service", routes=app.routes,
+    limits={"POST /orient": RouteLimit(concurrency=16, queue=16)},
+)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -17,12 +26,33 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(QueryProfilerMiddleware, service="ai_orientation_service")
+app.add_middleware(TracingMiddleware, service="ai_orientation_service")
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(ai_router, tags=["AI Orientation"])
+app.include_router(health_router)
+app.include_router(tracing_router)
 
 @app.on_event("startup")
 async def startup():
-    create_tables()
+    pool_monitor.check_budget()
+    await warm_pool()
+    orientation_cache.start()
+    readiness.set_ready()
+
+@app.on_event("shutdown")
+async def shutdown():
+    readiness.set_not_ready()
+    orientation_cache.stop()
+    await dispose_engines()
+
+@app.get("/db/pool/stats")
+def db_pool_stats(cluster: bool = False):
+    stats = pool_monitor.stats()
+    if cluster:
+        stats["cluster"] = pool_monitor.cluster_budget()
+    return stats
 
 @app.get("/")
 def read_root():
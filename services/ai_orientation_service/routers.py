@@ -1,19 +1,29 @@
 from fastapi import APIRouter, Depends, status
+from typing import Sequence
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from database import get_db
+from database import DbSession, engine, get_db, run_db
 from models import OrientationQuery
 from schemas import OrientationRequest, OrientationResponse
 import re
 import os
 import json
+import hashlib
 import requests
 from dotenv import load_dotenv
+from shared.cache import Cache, build_backend
+from shared.metrics import track_outbound
 
 # load environment variables (GROQ_API_KEY, etc.)
 load_dotenv()
 
 ai_router = APIRouter()
 
+# Groq classifies the same symptoms the same way (temperature 0), so its answers
+# are reused; `python -m shared.cache --tag orientation` drops them after a prompt change
+ORIENTATION_CACHE_TTL_SECONDS = float(os.getenv("ORIENTATION_CACHE_TTL_SECONDS", "3600"))
+orientation_cache = Cache("orientation", build_backend(engine), ttl=ORIENTATION_CACHE_TTL_SECONDS)
+
 SPECIALTIES = {
     'Cardiología': 'Enfermedades del corazón y sistema circulatorio',
     'Pediatría': 'Atención médica de bebés y niños',
@@ -70,15 +80,8 @@ SYMPTOM_KEYWORDS = {
 }
 
 
-# helper to call the Groq inference API and ask llama model to classify
-def classify_with_groq(symptoms: str) -> str:
-    api_key = os.getenv("GROQ_API_KEY")
-    if not api_key:
-        raise RuntimeError("GROQ_API_KEY is not set in the environment")
-
-    # endpoint may be configurable
-    url = os.getenv("GROQ_API_URL", "https://api.groq.com/openai/v1/chat/completions")
-
+# chat completion request asking the llama model to classify the symptoms
+def build_groq_payload(symptoms: str) -> dict:
     # instruct the model to return a JSON object containing specialty and a short comment
     system_msg = (
         "You are a helpful doctor assistant that must choose the most appropriate medical specialty "
@@ -103,13 +106,25 @@ def classify_with_groq(symptoms: str) -> str:
         "temperature": 0.0,
         "max_completion_tokens": 60,
     }
+    return payload
+
+# helper to call the Groq inference API and ask llama model to classify
+def classify_with_groq(symptoms: str) -> str:
+    api_key = os.getenv("GROQ_API_KEY")
+    if not api_key:
+        raise RuntimeError("GROQ_API_KEY is not set in the environment")
+
+    # endpoint may be configurable
+    url = os.getenv("GROQ_API_URL", "https://api.groq.com/openai/v1/chat/completions")
+    payload = build_groq_payload(symptoms)
 
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json",
     }
 
-    resp = requests.post(url, headers=headers, json=payload)
+    with track_outbound("groq"):
+        resp = requests.post(url, headers=headers, json=payload)
     
     resp.raise_for_status()
     data = resp.json()
@@ -127,7 +142,7 @@ def analyze_symptoms(symptoms: str) -> tuple:
     except Exception as err:
         raw = None
 
-    if raw != {} or raw is not None:
+    if raw:
         # try to interpret the model output as JSON
         try:
             if isinstance(raw, str):
@@ -161,6 +176,9 @@ def analyze_symptoms(symptoms: str) -> tuple:
         )
 
     # fallback to keyword scoring if the API call failed or returned nothing
+    return score_symptoms(symptoms)
+
+def score_symptoms(symptoms: str) -> tuple:
     symptoms_lower = symptoms.lower()
     specialty_scores = {}
 
@@ -190,9 +208,29 @@ def analyze_symptoms(symptoms: str) -> tuple:
 
     return recommended_specialty, confidence, explanation, "logic", ""
 
+def symptoms_key(symptoms: str) -> str:
+    """Same key for symptoms that differ only in case and spacing."""
+    return hashlib.sha256(" ".join(symptoms.lower().split()).encode("utf-8")).hexdigest()
+
+@ai_router.get("/cache/stats")
+def orientation_cache_stats():
+    """Hits, misses and coalesced loads of this replica's orientation cache."""
+    return orientation_cache.stats()
+
 @ai_router.post("/orient", response_model=OrientationResponse, status_code=status.HTTP_200_OK)
-def get_orientation(request: OrientationRequest, db: Session = Depends(get_db)):
-    specialty, confidence, explanation, inference_method, comment = analyze_symptoms(request.symptoms)
+async def get_orientation(request: OrientationRequest, db: DbSession = Depends(get_db)):
+    # The Groq call uses blocking requests, so it stays on the threadpool in either DATABASE_MODE.
+    # Only the model's answers are cached: a keyword fallback means Groq failed and should be asked again.
+    analysis = await orientation_cache.aget_or_load(
+        symptoms_key(request.symptoms),
+        lambda: run_in_threadpool(analyze_symptoms, request.symptoms),
+        tags=("orientation",),
+        cacheable=lambda result: result[3] == "ai",
+    )
+    return await run_db(db, _save_orientation, request, analysis)
+
+def _save_orientation(db: Session, request: OrientationRequest, analysis: Sequence[str]) -> OrientationResponse:
+    specialty, confidence, explanation, inference_method, comment = analysis
 
     new_query = OrientationQuery(
         user_id=request.user_id,
@@ -1,23 +1,81 @@
+import asyncio
+
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from typing import Union
 import os
 from dotenv import load_dotenv
+from shared.db_pool import PoolMonitor
+from shared.query_profiler import watch_engine
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+# "sync": request handlers get a psycopg2 Session and run their queries on the
+# threadpool. "async": they get an asyncpg AsyncSession and run on the event
+# loop without holding a thread. Background threads always use SessionLocal.
+DATABASE_MODE = os.getenv("DATABASE_MODE", "sync")
 
-engine = create_engine(DATABASE_URL)
+pool_monitor = PoolMonitor("appointment_service", engines=2 if DATABASE_MODE == "async" else 1)
+engine = create_engine(DATABASE_URL, **pool_monitor.engine_options())
+pool_monitor.watch(engine)
+watch_engine(engine, pool_monitor.service)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
-def get_db():
+async_engine = None
+AsyncSessionLocal = None
+if DATABASE_MODE == "async":
+    async_engine = create_async_engine(
+        make_url(DATABASE_URL).set(drivername="postgresql+asyncpg"), **pool_monitor.engine_options(asyncio=True)
+    )
+    pool_monitor.watch(async_engine.sync_engine, "async")
+    watch_engine(async_engine.sync_engine, pool_monitor.service)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False)
+
+DbSession = Union[Session, AsyncSession]
+
+async def get_sync_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
+        # Close (and return the connection) on the loop's executor, not the
+        # request threadpool: once every threadpool worker is waiting for a
+        # pooled connection, a close queued behind them would never run.
+        await asyncio.get_running_loop().run_in_executor(None, db.close)
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+get_db = get_async_db if DATABASE_MODE == "async" else get_sync_db
+
+async def run_db(db: DbSession, fn, *args, **kwargs):
+    """Call ``fn(session, *args, **kwargs)`` with the request's session.
+
+    fn is ordinary Session code. With an AsyncSession it runs through
+    run_sync, so every query awaits asyncpg on the event loop; with a Session
+    it runs on the threadpool, as a sync route handler would.
+    """
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(fn, *args, **kwargs)
+    return await run_in_threadpool(fn, db, *args, **kwargs)
+
+async def dispose_engines():
+    if async_engine is not None:
+        await async_engine.dispose()
+
+async def warm_pool():
+    """Open the connections request handlers use, before the service reports ready.
 
-def create_tables():
-    Base.metadata.create_all(bind=engine)
+    The schema is created by ``python -m shared.migrate``, not here.
+    """
+    if async_engine is not None:
+        await pool_monitor.warm_async(async_engine)
+    else:
+        await run_in_threadpool(pool_monitor.warm, engine)
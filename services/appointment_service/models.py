@@ -22,7 +22,8 @@ class Appointment(Base):
     specialty_name = Column(String, nullable=False)
     appointment_date = Column(DateTime, nullable=False)
     price = Column(Float, nullable=False)
-    status = Column(SQLEnum(AppointmentStatus), default=AppointmentStatus.PENDING)
+    # The column is VARCHAR(50) (005_appointment_service.sql), not a PostgreSQL enum type
+    status = Column(SQLEnum(AppointmentStatus, native_enum=False, length=50), default=AppointmentStatus.PENDING)
     payment_id = Column(UUID(as_uuid=True), nullable=True)
     notes = Column(String, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
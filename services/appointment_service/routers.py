@@ -1,48 +1,83 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
-from database import get_db
+from database import DbSession, get_db, run_db
 from models import Appointment, AppointmentStatus
 from schemas import AppointmentCreate, AppointmentResponse
 from typing import List
 from uuid import UUID
 from datetime import datetime
-from service_clients import UserServiceClient, CatalogServiceClient
+import asyncio
+from shared.http_client import ServiceError, all_client_stats
+from shared.service_clients import CatalogServiceClient, UserServiceClient, upstream_error
+from shared.tokens import TokenVerifier
 
-appointment_router = APIRouter()
+# Verifies signed access tokens locally, without calling Auth Service
+token_verifier = TokenVerifier.from_env()
+
+appointment_router = APIRouter(dependencies=[Depends(token_verifier.dependency)])
+
+
+user_client = UserServiceClient()
+catalog_client = CatalogServiceClient()
 
 
 def get_user_client() -> UserServiceClient:
-    return UserServiceClient()
+    return user_client
 
 
 def get_catalog_client() -> CatalogServiceClient:
-    return CatalogServiceClient()
+    return catalog_client
+
 
+def _appointment_response(appointment: Appointment) -> AppointmentResponse:
+    return AppointmentResponse(
+        id=appointment.id,
+        user_id=appointment.user_id,
+        doctor_id=appointment.doctor_id,
+        doctor_name=appointment.doctor_name,
+        specialty_name=appointment.specialty_name,
+        appointment_date=appointment.appointment_date,
+        price=appointment.price,
+        status=appointment.status.value,
+        payment_id=appointment.payment_id,
+        notes=appointment.notes,
+        created_at=appointment.created_at,
+        updated_at=appointment.updated_at
+    )
 
 @appointment_router.post("/", response_model=AppointmentResponse, status_code=status.HTTP_201_CREATED)
-def create_appointment(
+async def create_appointment(
     appointment: AppointmentCreate,
-    db: Session = Depends(get_db),
+    db: DbSession = Depends(get_db),
     user_client: UserServiceClient = Depends(get_user_client),
     catalog_client: CatalogServiceClient = Depends(get_catalog_client)
 ):
-    # Validate user exists via User Service API
-    if not user_client.user_exists(appointment.user_id):
+    # Validate user and doctor via User and Catalog Service APIs, both at
+    # once; the doctor lookup also gives the details denormalized below. An
+    # unreachable service is a 503, not "not found".
+    try:
+        user_found, doctor = await asyncio.gather(
+            user_client.auser_exists(appointment.user_id),
+            catalog_client.aget_doctor(appointment.doctor_id),
+        )
+    except ServiceError as e:
+        raise upstream_error(e)
+
+    if not user_found:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="User not found. Please provide a valid user ID."
         )
 
-    # Validate doctor exists via Catalog Service API
-    if not catalog_client.doctor_exists(appointment.doctor_id):
+    if doctor is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Doctor not found. Please provide a valid doctor ID."
         )
 
-    # Get doctor details for denormalized data
-    doctor = catalog_client.get_doctor(appointment.doctor_id)
+    return await run_db(db, _create_appointment, appointment, doctor)
 
+def _create_appointment(db: Session, appointment: AppointmentCreate, doctor: dict) -> AppointmentResponse:
     new_appointment = Appointment(
         user_id=appointment.user_id,
         doctor_id=appointment.doctor_id,
@@ -59,51 +94,29 @@ def create_appointment(
     db.commit()
     db.refresh(new_appointment)
 
-    response_dict = {
-        "id": new_appointment.id,
-        "user_id": new_appointment.user_id,
-        "doctor_id": new_appointment.doctor_id,
-        "doctor_name": new_appointment.doctor_name,
-        "specialty_name": new_appointment.specialty_name,
-        "appointment_date": new_appointment.appointment_date,
-        "price": new_appointment.price,
-        "status": new_appointment.status.value,
-        "payment_id": new_appointment.payment_id,
-        "notes": new_appointment.notes,
-        "created_at": new_appointment.created_at,
-        "updated_at": new_appointment.updated_at
-    }
-
-    return AppointmentResponse(**response_dict)
+    return _appointment_response(new_appointment)
 
 @appointment_router.get("/user/{user_id}", response_model=List[AppointmentResponse])
-def get_user_appointments(user_id: UUID, db: Session = Depends(get_db)):
+async def get_user_appointments(user_id: UUID, db: DbSession = Depends(get_db)):
+    return await run_db(db, _get_user_appointments, user_id)
+
+def _get_user_appointments(db: Session, user_id: UUID) -> List[AppointmentResponse]:
     appointments = db.query(Appointment).filter(
         Appointment.user_id == user_id
     ).order_by(Appointment.appointment_date.desc()).all()
 
-    result = []
-    for appointment in appointments:
-        response_dict = {
-            "id": appointment.id,
-            "user_id": appointment.user_id,
-            "doctor_id": appointment.doctor_id,
-            "doctor_name": appointment.doctor_name,
-            "specialty_name": appointment.specialty_name,
-            "appointment_date": appointment.appointment_date,
-            "price": appointment.price,
-            "status": appointment.status.value,
-            "payment_id": appointment.payment_id,
-            "notes": appointment.notes,
-            "created_at": appointment.created_at,
-            "updated_at": appointment.updated_at
-        }
-        result.append(AppointmentResponse(**response_dict))
-
-    return result
+    return [_appointment_response(appointment) for appointment in appointments]
+
+@appointment_router.get("/clients/stats")
+def service_client_stats():
+    """Latency, retries, hedges and circuit state of the calls to other services."""
+    return all_client_stats()
 
 @appointment_router.get("/{appointment_id}", response_model=AppointmentResponse)
-def get_appointment(appointment_id: UUID, db: Session = Depends(get_db)):
+async def get_appointment(appointment_id: UUID, db: DbSession = Depends(get_db)):
+    return await run_db(db, _get_appointment, appointment_id)
+
+def _get_appointment(db: Session, appointment_id: UUID) -> AppointmentResponse:
     appointment = db.query(Appointment).filter(Appointment.id == appointment_id).first()
 
     if not appointment:
@@ -112,25 +125,13 @@ def get_appointment(appointment_id: UUID, db: Session = Depends(get_db)):
             detail="Appointment not found"
         )
 
-    response_dict = {
-        "id": appointment.id,
-        "user_id": appointment.user_id,
-        "doctor_id": appointment.doctor_id,
-        "doctor_name": appointment.doctor_name,
-        "specialty_name": appointment.specialty_name,
-        "appointment_date": appointment.appointment_date,
-        "price": appointment.price,
-        "status": appointment.status.value,
-        "payment_id": appointment.payment_id,
-        "notes": appointment.notes,
-        "created_at": appointment.created_at,
-        "updated_at": appointment.updated_at
-    }
-
-    return AppointmentResponse(**response_dict)
+    return _appointment_response(appointment)
 
 @appointment_router.put("/{appointment_id}/cancel", response_model=AppointmentResponse)
-def cancel_appointment(appointment_id: UUID, db: Session = Depends(get_db)):
+async def cancel_appointment(appointment_id: UUID, db: DbSession = Depends(get_db)):
+    return await run_db(db, _cancel_appointment, appointment_id)
+
+def _cancel_appointment(db: Session, appointment_id: UUID) -> AppointmentResponse:
     appointment = db.query(Appointment).filter(Appointment.id == appointment_id).first()
 
     if not appointment:
@@ -156,19 +157,4 @@ def cancel_appointment(appointment_id: UUID, db: Session = Depends(get_db)):
     db.commit()
     db.refresh(appointment)
 
-    response_dict = {
-        "id": appointment.id,
-        "user_id": appointment.user_id,
-        "doctor_id": appointment.doctor_id,
-        "doctor_name": appointment.doctor_name,
-        "specialty_name": appointment.specialty_name,
-        "appointment_date": appointment.appointment_date,
-        "price": appointment.price,
-        "status": appointment.status.value,
-        "payment_id": appointment.payment_id,
-        "notes": appointment.notes,
-        "created_at": appointment.created_at,
-        "updated_at": appointment.updated_at
-    }
-
-    return AppointmentResponse(**response_dict)
+    return _appointment_response(appointment)
@@ -0,0 +1,161 @@
+"""
+Login admission control.
+
+Every POST /login attempt is counted per email and per client IP in a
+sliding window before any database or bcrypt work happens. Once either
+counter is over its limit the attempt is rejected with 429 and Retry-After.
+
+Counters use the sliding window approximation: the previous fixed window's
+count, weighted by how much of it still overlaps the sliding window, plus the
+current window's count. The default backend keeps them in memory, sharded by
+key with one lock per shard. LOGIN_THROTTLE_BACKEND=postgres shares them
+between replicas through an UNLOGGED table, at the cost of one round trip.
+"""
+import math
+import os
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import text
+
+LOGIN_THROTTLE_BACKEND = os.getenv("LOGIN_THROTTLE_BACKEND", "memory")  # memory | postgres | off
+LOGIN_THROTTLE_WINDOW_SECONDS = float(os.getenv("LOGIN_THROTTLE_WINDOW_SECONDS", "60"))
+LOGIN_MAX_ATTEMPTS_PER_EMAIL = int(os.getenv("LOGIN_MAX_ATTEMPTS_PER_EMAIL", "10"))
+LOGIN_MAX_ATTEMPTS_PER_IP = int(os.getenv("LOGIN_MAX_ATTEMPTS_PER_IP", "100"))
+LOGIN_THROTTLE_SHARDS = int(os.getenv("LOGIN_THROTTLE_SHARDS", "64"))
+# nginx sets X-Real-IP; only trust it when the service is reachable through the proxy alone
+LOGIN_TRUST_PROXY_HEADERS = os.getenv("LOGIN_TRUST_PROXY_HEADERS", "true").lower() == "true"
+
+
+def sliding_estimate(previous: int, current: int, elapsed: float, window: float) -> float:
+    return previous * (1 - elapsed / window) + current
+
+
+class MemoryCounterBackend:
+    """Per-process counters, split over shards so concurrent logins rarely share a lock."""
+
+    blocking = False
+
+    def __init__(self, shards: int = LOGIN_THROTTLE_SHARDS, max_keys_per_shard: int = 10000):
+        self.max_keys_per_shard = max_keys_per_shard
+        self._locks = [threading.Lock() for _ in range(shards)]
+        # key -> [window index, count in that window, count in the window before]
+        self._shards: List[Dict[str, List[int]]] = [{} for _ in range(shards)]
+
+    def _shard(self, key: str) -> int:
+        return zlib.crc32(key.encode("utf-8")) % len(self._shards)
+
+    def hit(self, key: str, window: float, now: float) -> Tuple[int, int]:
+        """Count one attempt; returns (previous window count, current window count)."""
+        index = int(now // window)
+        shard_no = self._shard(key)
+        shard = self._shards[shard_no]
+        with self._locks[shard_no]:
+            entry = shard.get(key)
+            if entry is None:
+                if len(shard) >= self.max_keys_per_shard:
+                    self._evict(shard, index)
+                entry = shard[key] = [index, 0, 0]
+            elif entry[0] != index:
+                entry[2] = entry[1] if entry[0] == index - 1 else 0
+                entry[0], entry[1] = index, 0
+            entry[1] += 1
+            return entry[2], entry[1]
+
+    @staticmethod
+    def _evict(shard: Dict[str, List[int]], index: int):
+        # Keys untouched for two windows no longer affect any estimate
+        for key in [k for k, entry in shard.items() if entry[0] < index - 1]:
+            del shard[key]
+
+
+class PostgresCounterBackend:
+    """Counters shared by every replica, one upsert per key and attempt."""
+
+    blocking = True
+
+    HIT = text("""
+        INSERT INTO auth_service.login_attempts (key, window_index, count)
+        VALUES (:key, :window_index, 1)
+        ON CONFLICT (key, window_index) DO UPDATE SET count = login_attempts.count + 1
+        RETURNING count, (
+            SELECT count FROM auth_service.login_attempts WHERE key = :key AND window_index = :window_index - 1
+        )
+    """)
+    PURGE = text("DELETE FROM auth_service.login_attempts WHERE window_index < :window_index - 1")
+
+    def __init__(self, engine, purge_every: float = 60.0):
+        self.engine = engine
+        self.purge_every = purge_every
+        self._last_purge = 0.0
+
+    def hit(self, key: str, window: float, now: float) -> Tuple[int, int]:
+        index = int(now // window)
+        with self.engine.begin() as conn:
+            current, previous = conn.execute(self.HIT, {"key": key, "window_index": index}).one()
+            if now - self._last_purge > self.purge_every:
+                self._last_purge = now
+                conn.execute(self.PURGE, {"window_index": index})
+        return previous or 0, current
+
+
+class LoginThrottle:
+    def __init__(
+        self,
+        backend,
+        window: float = LOGIN_THROTTLE_WINDOW_SECONDS,
+        max_per_email: int = LOGIN_MAX_ATTEMPTS_PER_EMAIL,
+        max_per_ip: int = LOGIN_MAX_ATTEMPTS_PER_IP,
+    ):
+        self.backend = backend
+        self.window = window
+        self.max_per_email = max_per_email
+        self.max_per_ip = max_per_ip
+
+    def _retry_after(self, key: str, limit: int, now: float) -> Optional[int]:
+        previous, current = self.backend.hit(key, self.window, now)
+        elapsed = now % self.window
+        if sliding_estimate(previous, current, elapsed, self.window) <= limit:
+            return None
+        if current > limit:
+            # Over the limit within this window alone: wait for the next one
+            return max(1, math.ceil(self.window - elapsed))
+        # The previous window's weight decays linearly; wait until it has faded enough
+        return max(1, math.ceil(self.window * (1 - (limit - current) / previous) - elapsed))
+
+    def check(self, email: str, client_ip: Optional[str], now: Optional[float] = None) -> Optional[int]:
+        """Count an attempt; returns the Retry-After seconds if it must be rejected."""
+        now = now if now is not None else time.time()
+        waits = [self._retry_after(f"email:{email.lower()}", self.max_per_email, now)]
+        if client_ip:
+            waits.append(self._retry_after(f"ip:{client_ip}", self.max_per_ip, now))
+        waits = [w for w in waits if w is not None]
+        return max(waits) if waits else None
+
+    async def check_async(self, email: str, client_ip: Optional[str]) -> Optional[int]:
+        if self.backend.blocking:
+            return await run_in_threadpool(self.check, email, client_ip)
+        return self.check(email, client_ip)
+
+
+def client_ip(request) -> Optional[str]:
+    if LOGIN_TRUST_PROXY_HEADERS:
+        forwarded = request.headers.get("x-real-ip")
+        if forwarded:
+            return forwarded
+    return request.client.host if request.client else None
+
+
+def build_login_throttle() -> Optional[LoginThrottle]:
+    if LOGIN_THROTTLE_BACKEND == "off":
+        return None
+    if LOGIN_THROTTLE_BACKEND == "postgres":
+        from database import engine
+        return LoginThrottle(PostgresCounterBackend(engine))
+    return LoginThrottle(MemoryCounterBackend())
+
+
+login_throttle = build_login_throttle()
@@ -1,7 +1,16 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from routers import auth_router
-from database import create_tables
+from database import dispose_engines, pool_monitor, warm_pool
+from password_hashing import password_hasher
+from token_purge import token_purger
+from profile_outbox import outbox_dispatcher
+from shared.http_client import DeadlineMiddleware, close_clients
+from shared.admission import AdmissionMiddleware, RouteLimit
+from shared.health import health_router, readiness
+from shared.metrics import MetricsMiddleware
+from shared.query_profiler import QueryProfilerMiddleware
+from shared.tracing import TracingMiddleware, tracing_router
 
 app = FastAPI(
     title="SaludYa Auth Service",
@@ -10,6 +19,13 @@ app = FastAPI(
     root_path="/api/auth"
 )
 
+app.add_middleware(
+    AdmissionMiddleware, service="auth_service", routes=app.routes,
+    limits={
+        "POST /login": RouteLimit(concurrency=16, queue=32),
+        "POST /register": RouteLimit(concurrency=8, queue=16),
+    },
+)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -17,12 +33,39 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(DeadlineMiddleware)
+app.add_middleware(QueryProfilerMiddleware, service="auth_service")
+app.add_middleware(TracingMiddleware, service="auth_service")
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(auth_router, tags=["Authentication"])
+app.include_router(health_router)
+app.include_router(tracing_router)
 
 @app.on_event("startup")
 async def startup():
-    create_tables()
+    pool_monitor.check_budget()
+    await warm_pool()
+    await password_hasher.calibrate()
+    token_purger.start()
+    outbox_dispatcher.start()
+    readiness.set_ready()
+
+@app.on_event("shutdown")
+async def shutdown():
+    readiness.set_not_ready()
+    password_hasher.shutdown()
+    token_purger.stop()
+    outbox_dispatcher.stop()
+    close_clients()
+    await dispose_engines()
+
+@app.get("/db/pool/stats")
+def db_pool_stats(cluster: bool = False):
+    stats = pool_monitor.stats()
+    if cluster:
+        stats["cluster"] = pool_monitor.cluster_budget()
+    return stats
 
 @app.get("/")
 def read_root():
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, DateTime, ForeignKey
+from sqlalchemy import BigInteger, Column, String, DateTime, ForeignKey, Index, Integer, JSON
 from sqlalchemy.dialects.postgresql import UUID
 from database import Base
 import uuid
@@ -17,9 +17,58 @@ class AuthUser(Base):
 
 class AuthToken(Base):
     __tablename__ = "auth_tokens"
-    __table_args__ = {'schema': 'auth_service'}
+    __table_args__ = (
+        Index('idx_auth_tokens_user_created', 'user_id', 'created_at'),
+        {'schema': 'auth_service'},
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     token = Column(String(64), unique=True, nullable=False, index=True)
     user_id = Column(UUID(as_uuid=True), ForeignKey("auth_service.auth_users.id", ondelete="CASCADE"), nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+class RevokedAccessToken(Base):
+    __tablename__ = "revoked_access_tokens"
+    __table_args__ = {'schema': 'auth_service'}
+
+    jti = Column(String(32), primary_key=True)
+    user_id = Column(UUID(as_uuid=True), nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+    revoked_at = Column(DateTime, default=datetime.utcnow)
+
+
+class UserRevocation(Base):
+    """Logout-all cutoff: signed access tokens of the user issued before revoked_before are rejected."""
+    __tablename__ = "user_revocations"
+    __table_args__ = {'schema': 'auth_service'}
+
+    user_id = Column(UUID(as_uuid=True), primary_key=True)
+    revoked_before = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+class ProfileOutbox(Base):
+    """User profiles waiting to be created in User Service (see profile_outbox.py)."""
+    __tablename__ = "profile_outbox"
+    __table_args__ = {'schema': 'auth_service'}
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    user_id = Column(UUID(as_uuid=True), nullable=False)
+    payload = Column(JSON, nullable=False)
+    status = Column(String(16), nullable=False, default="pending")  # pending | failed
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class LoginAttempt(Base):
+    """Shared login throttle counters (LOGIN_THROTTLE_BACKEND=postgres)."""
+    __tablename__ = "login_attempts"
+    __table_args__ = {'schema': 'auth_service', 'prefixes': ['UNLOGGED']}
+
+    key = Column(String, primary_key=True)
+    window_index = Column(BigInteger, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,168 @@
+"""
+Password hashing off the request threadpool.
+
+bcrypt runs on a dedicated, size-limited executor (threads by default, or
+processes with PASSWORD_HASH_EXECUTOR=process). Callers wait for a free slot
+for at most PASSWORD_HASH_QUEUE_TIMEOUT seconds, and at most
+PASSWORD_HASH_MAX_PENDING callers may wait at once; beyond that
+PasswordHasherBusy is raised so the handler can answer 503 immediately.
+
+For unknown emails, login calls PasswordHasher.equalize() instead of
+verifying against a dummy hash: it takes a hashing slot under the same
+limits as a verify and holds it as long as a recent real verify took, so
+neither response time nor a 503 reveals whether an account exists, yet no
+CPU is spent. The estimate is seeded by calibrate() at startup; if that has
+not happened, equalize() holds the slot for the nominal cost of a verify at
+BCRYPT_ROUNDS (PASSWORD_VERIFY_SECONDS).
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+
+import bcrypt
+
+from shared.metrics import observe_component, registry
+from shared.tracing import record_span
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "thread")
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "32"))
+PASSWORD_HASH_QUEUE_TIMEOUT = float(os.getenv("PASSWORD_HASH_QUEUE_TIMEOUT", "2.0"))
+# Fallback for equalize() before calibrate() ran; about 0.25s at cost 12, doubling per round
+PASSWORD_VERIFY_SECONDS = float(os.getenv("PASSWORD_VERIFY_SECONDS", str(0.25 * 2 ** (BCRYPT_ROUNDS - 12))))
+
+PASSWORD_HASH_DURATION = registry.histogram(
+    "password_hash_duration_seconds", "bcrypt hash and verify, including the wait for a free slot.", ("operation",))
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when no hashing slot frees up in time."""
+
+
+def hash_password(password: str, rounds: int = BCRYPT_ROUNDS) -> str:
+    salt = bcrypt.gensalt(rounds=rounds)
+    return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+
+
+def verify_password(password: str, hashed: str) -> bool:
+    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+
+def hash_rounds(hashed: str) -> Optional[int]:
+    """Cost factor of a stored bcrypt hash ("$2b$12$..." -> 12)."""
+    try:
+        return int(hashed.split("$")[2])
+    except (IndexError, ValueError):
+        return None
+
+
+class PasswordHasher:
+    def __init__(
+        self,
+        rounds: int = BCRYPT_ROUNDS,
+        workers: int = PASSWORD_HASH_WORKERS,
+        max_pending: int = PASSWORD_HASH_MAX_PENDING,
+        queue_timeout: float = PASSWORD_HASH_QUEUE_TIMEOUT,
+        use_processes: bool = PASSWORD_HASH_EXECUTOR == "process",
+        default_verify_seconds: float = PASSWORD_VERIFY_SECONDS,
+    ):
+        self.rounds = rounds
+        self.workers = workers
+        self.max_pending = max_pending
+        self.queue_timeout = queue_timeout
+        self.use_processes = use_processes
+        self.default_verify_seconds = default_verify_seconds
+        self._executor: Optional[Executor] = None
+        # Created on first use so it binds to the server's event loop
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._waiting = 0
+        # Moving average of verify duration, seeded by calibrate()
+        self._verify_seconds: Optional[float] = None
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.use_processes:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        return self._executor
+
+    async def _run(self, fn, *args):
+        started = time.perf_counter()
+        try:
+            return await self._run_in_slot(fn, *args)
+        finally:
+            elapsed = time.perf_counter() - started
+            PASSWORD_HASH_DURATION.observe((fn.__name__,), elapsed)
+            observe_component("password_hash", elapsed)
+            record_span(f"bcrypt {fn.__name__}", elapsed)
+
+    async def _run_in_slot(self, fn, *args):
+        await self._acquire_slot()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self._slots.release()
+
+    async def _acquire_slot(self):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+        if self._slots.locked():
+            if self._waiting >= self.max_pending:
+                raise PasswordHasherBusy()
+            self._waiting += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                raise PasswordHasherBusy()
+            finally:
+                self._waiting -= 1
+        else:
+            await self._slots.acquire()
+
+    async def hash(self, password: str) -> str:
+        return await self._run(hash_password, password, self.rounds)
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        started = time.perf_counter()
+        result = await self._run(verify_password, password, hashed)
+        elapsed = time.perf_counter() - started
+        if self._verify_seconds is None:
+            self._verify_seconds = elapsed
+        else:
+            self._verify_seconds += 0.1 * (elapsed - self._verify_seconds)
+        return result
+
+    async def calibrate(self):
+        """Time one real verify so equalize() has an estimate before the first login."""
+        hashed = await asyncio.get_running_loop().run_in_executor(
+            self._get_executor(), hash_password, "calibration", self.rounds)
+        try:
+            await self.verify("calibration", hashed)
+        except PasswordHasherBusy:
+            pass
+
+    async def equalize(self):
+        """Queue and take as long as a verify would, without doing one (for unknown users).
+
+        Raises PasswordHasherBusy exactly when a verify would.
+        """
+        await self._acquire_slot()
+        try:
+            await asyncio.sleep(self._verify_seconds if self._verify_seconds is not None else self.default_verify_seconds)
+        finally:
+            self._slots.release()
+
+    def needs_rehash(self, hashed: str) -> bool:
+        return hash_rounds(hashed) != self.rounds
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+password_hasher = PasswordHasher()
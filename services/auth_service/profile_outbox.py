@@ -0,0 +1,280 @@
+"""
+Delivery of user profiles from registration to User Service.
+
+Registration writes the auth user, its token and a ProfileOutbox row in one
+transaction. OutboxDispatcher then POSTs each pending profile to User Service
+from a background thread, retrying with exponential backoff. Every attempt
+carries the auth user id as Idempotency-Key, so a retry after a lost response
+returns the existing profile instead of failing as a duplicate.
+
+Before that transaction commits, register asks User Service's POST /validate,
+which runs alongside the DB work and is given at most
+PROFILE_CALL_BUDGET_SECONDS. A profile it rejects ("DNI already registered")
+is a 400 for the client and nothing is committed. If User Service does not
+answer in time, the registration is committed anyway and the dispatcher
+delivers the profile later.
+
+With PROFILE_DELIVERY_MODE=concurrent, register posts the profile itself
+instead of validating it, under the same budget. If no answer arrives
+within the budget, the outbox row is written and the dispatcher takes over.
+
+What is left to undo:
+
+* outbox: the dispatcher can still be rejected when validation was skipped
+  or a concurrent registration took the DNI in between. It then deletes the
+  auth user and its tokens in the transaction that marks the row failed.
+* concurrent: when the auth insert or commit fails after the profile was
+  posted, register deletes the profile again (delete_profile) through User
+  Service's internal DELETE route, which needs SERVICE_TOKEN.
+
+The dispatcher claims a row by pushing its next_attempt_at out by a lease of
+PROFILE_OUTBOX_LEASE_SECONDS and committing, then makes the HTTP call with no
+transaction open and no connection checked out, and records the outcome in a
+second short transaction. A replica that crashes mid-call leaves the row to
+be retried once the lease runs out.
+
+All paths go through the shared User Service client (shared.service_clients),
+which calls User Service directly rather than through the proxy.
+"""
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional
+
+import httpx
+
+from database import SessionLocal
+from models import AuthUser, ProfileOutbox
+from shared.http_client import ServiceError, deadline
+from shared.service_clients import USER_SERVICE_URL, UserServiceClient
+from shared.tokens import ServiceCredential
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DELIVERY_MODE = os.getenv("PROFILE_DELIVERY_MODE", "outbox")  # outbox | concurrent
+PROFILE_CALL_BUDGET_SECONDS = float(os.getenv("PROFILE_CALL_BUDGET_SECONDS", "1.0"))
+PROFILE_OUTBOX_POLL_SECONDS = float(os.getenv("PROFILE_OUTBOX_POLL_SECONDS", "5"))
+PROFILE_OUTBOX_MAX_ATTEMPTS = int(os.getenv("PROFILE_OUTBOX_MAX_ATTEMPTS", "10"))
+PROFILE_OUTBOX_MAX_BACKOFF_SECONDS = float(os.getenv("PROFILE_OUTBOX_MAX_BACKOFF_SECONDS", "300"))
+PROFILE_OUTBOX_TIMEOUT_SECONDS = float(os.getenv("PROFILE_OUTBOX_TIMEOUT_SECONDS", "10"))
+# How long a claimed row is hidden from other dispatchers while its delivery is in flight
+PROFILE_OUTBOX_LEASE_SECONDS = float(os.getenv("PROFILE_OUTBOX_LEASE_SECONDS", str(3 * PROFILE_OUTBOX_TIMEOUT_SECONDS)))
+
+DELIVERED = "delivered"
+ACCEPTABLE = "acceptable"  # validated, not created yet
+REJECTED = "rejected"
+RETRY = "retry"
+
+
+class DeliveryResult(NamedTuple):
+    outcome: str  # delivered | acceptable | rejected | retry
+    detail: Optional[str] = None
+
+
+def profile_payload(user_id, email: str, request) -> dict:
+    return {
+        "id": str(user_id),
+        "email": email,
+        "first_name": request.first_name,
+        "last_name": request.last_name,
+        "dni": request.dni,
+        "phone": request.phone,
+        "birth_date": request.birth_date.isoformat() if request.birth_date else None,
+    }
+
+
+def error_detail(response: httpx.Response) -> str:
+    try:
+        detail = response.json().get("detail", response.text)
+    except Exception:
+        detail = response.text
+    if isinstance(detail, list) and detail:
+        detail = detail[0].get("msg", str(detail[0]))
+    if not isinstance(detail, str):
+        detail = "User service error"
+    return detail
+
+
+def classify_response(response: httpx.Response) -> DeliveryResult:
+    if response.status_code < 400:
+        return DeliveryResult(DELIVERED)
+    # Timeouts, throttling and server errors are worth retrying; other 4xx never succeed
+    if response.status_code in (408, 429) or response.status_code >= 500:
+        return DeliveryResult(RETRY, f"HTTP {response.status_code}")
+    return DeliveryResult(REJECTED, error_detail(response))
+
+
+def _headers(payload: dict) -> dict:
+    return {"Idempotency-Key": payload["id"]}
+
+
+# The Idempotency-Key makes the POST safe for the client to retry
+user_service = UserServiceClient(
+    USER_SERVICE_URL, timeout=PROFILE_OUTBOX_TIMEOUT_SECONDS, default_deadline=PROFILE_OUTBOX_TIMEOUT_SECONDS
+)
+service_credential = ServiceCredential.from_env()
+
+
+async def validate_profile(payload: dict, budget: float = PROFILE_CALL_BUDGET_SECONDS) -> DeliveryResult:
+    """Ask User Service whether it would create the profile (ACCEPTABLE), giving up (RETRY) after ``budget``."""
+    try:
+        with deadline(budget):
+            response = await user_service.arequest("POST", "/validate", json=payload, idempotent=True)
+    except ServiceError as e:
+        return DeliveryResult(RETRY, e.reason)
+    result = classify_response(response)
+    return DeliveryResult(ACCEPTABLE) if result.outcome == DELIVERED else result
+
+
+async def post_profile(payload: dict, budget: float = PROFILE_CALL_BUDGET_SECONDS) -> DeliveryResult:
+    """Create the profile directly, giving up (RETRY) once ``budget`` seconds have passed."""
+    try:
+        with deadline(budget):
+            response = await user_service.arequest("POST", "/", json=payload, headers=_headers(payload))
+    except ServiceError as e:
+        return DeliveryResult(RETRY, e.reason)
+    return classify_response(response)
+
+
+async def delete_profile(user_id) -> bool:
+    """Remove a profile whose account was never committed; False if it could not be removed."""
+    if not service_credential.enabled:
+        logger.error("Orphan profile %s not deleted: SERVICE_TOKEN is not set", user_id)
+        return False
+    try:
+        response = await user_service.arequest("DELETE", f"/{user_id}", headers=service_credential.headers())
+    except ServiceError as e:
+        logger.error("Orphan profile %s not deleted: %s", user_id, e.reason)
+        return False
+    if response.status_code not in (204, 404):
+        logger.error("Orphan profile %s not deleted: HTTP %s", user_id, response.status_code)
+        return False
+    return True
+
+
+class _Claim(NamedTuple):
+    id: object
+    user_id: object
+    payload: dict
+
+
+class OutboxDispatcher:
+    def __init__(
+        self,
+        poll_interval: float = PROFILE_OUTBOX_POLL_SECONDS,
+        max_attempts: int = PROFILE_OUTBOX_MAX_ATTEMPTS,
+        max_backoff: float = PROFILE_OUTBOX_MAX_BACKOFF_SECONDS,
+        lease: float = PROFILE_OUTBOX_LEASE_SECONDS,
+        client: UserServiceClient = user_service,
+        session_factory=SessionLocal,
+    ):
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.max_backoff = max_backoff
+        self.lease = lease
+        self.client = client
+        self.session_factory = session_factory
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def deliver(self, payload: dict) -> DeliveryResult:
+        try:
+            response = self.client.request("POST", "/", json=payload, headers=_headers(payload))
+        except ServiceError as e:
+            return DeliveryResult(RETRY, e.reason)
+        return classify_response(response)
+
+    def _backoff(self, attempts: int) -> timedelta:
+        return timedelta(seconds=min(self.max_backoff, 2 ** attempts))
+
+    def _claim(self) -> Optional[_Claim]:
+        """Take the next due row by moving it out of reach for one lease, then commit."""
+        with self.session_factory() as db:
+            row = (
+                db.query(ProfileOutbox)
+                .filter(ProfileOutbox.status == "pending", ProfileOutbox.next_attempt_at <= datetime.utcnow())
+                .order_by(ProfileOutbox.next_attempt_at)
+                .with_for_update(skip_locked=True)
+                .first()
+            )
+            if row is None:
+                db.rollback()
+                return None
+            claim = _Claim(row.id, row.user_id, row.payload)
+            row.next_attempt_at = datetime.utcnow() + timedelta(seconds=self.lease)
+            db.commit()
+            return claim
+
+    def _settle(self, claim: _Claim, result: DeliveryResult):
+        with self.session_factory() as db:
+            row = db.query(ProfileOutbox).filter(ProfileOutbox.id == claim.id).with_for_update().first()
+            if row is None:
+                # Delivered by another dispatcher after our lease ran out
+                db.rollback()
+                return
+            if result.outcome == DELIVERED:
+                db.delete(row)
+            else:
+                row.attempts += 1
+                row.last_error = result.detail
+                if result.outcome == REJECTED:
+                    # The profile can never be created; drop the account that has none
+                    row.status = "failed"
+                    db.query(AuthUser).filter(AuthUser.id == row.user_id).delete(synchronize_session=False)
+                    logger.error("Profile for user %s rejected, account deleted: %s", row.user_id, result.detail)
+                elif row.attempts >= self.max_attempts:
+                    row.status = "failed"
+                    logger.error("Profile for user %s not delivered: %s", row.user_id, result.detail)
+                else:
+                    row.next_attempt_at = datetime.utcnow() + self._backoff(row.attempts)
+            db.commit()
+
+    def run_once(self) -> int:
+        """Deliver every due outbox row; returns how many were delivered.
+
+        Rows are claimed with FOR UPDATE SKIP LOCKED and a lease, so several
+        replicas can drain the outbox without delivering a row twice at once.
+        No transaction is open while User Service is being called.
+        """
+        delivered = 0
+        while not self._stop.is_set():
+            claim = self._claim()
+            if claim is None:
+                break
+            result = self.deliver(claim.payload)
+            self._settle(claim, result)
+            if result.outcome == DELIVERED:
+                delivered += 1
+        return delivered
+
+    def notify(self):
+        """Wake the dispatcher after a new outbox row was committed."""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("Profile outbox dispatch failed")
+            self._wake.wait(self.poll_interval)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="profile-outbox", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=PROFILE_OUTBOX_TIMEOUT_SECONDS)
+            self._thread = None
+
+
+outbox_dispatcher = OutboxDispatcher()
@@ -1,50 +1,147 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlalchemy import exists
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from database import get_db
-from models import AuthUser, AuthToken
-from schemas import RegisterRequest, LoginRequest, AuthResponse, LoginResponse, MeResponse
-import bcrypt
+from database import DbSession, get_db, run_db
+from models import AuthUser, AuthToken, RevokedAccessToken, UserRevocation, ProfileOutbox
+from schemas import (
+    RegisterRequest, LoginRequest, AuthResponse, LoginResponse, MeResponse,
+    RefreshRequest, LogoutRequest, TokenResponse, RevocationEntry, RevocationListResponse, UserRevocationEntry,
+)
+from shared.tokens import AccessClaims, TokenVerifier, InvalidToken, issue_access_token, is_signed_token
+from password_hashing import password_hasher, PasswordHasherBusy
+from login_throttle import login_throttle, client_ip
+from profile_outbox import (
+    DELIVERED, PROFILE_DELIVERY_MODE, REJECTED, RETRY, DeliveryResult, delete_profile, outbox_dispatcher,
+    post_profile, profile_payload, validate_profile,
+)
+import asyncio
 import secrets
 import os
-import httpx
+import time
+import uuid
 from typing import Optional
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 
-# Route through proxy for production compatibility; internal Docker can override via compose env
-# Keep trailing slash to match nginx location pattern
-USER_SERVICE_URL = os.getenv("USER_SERVICE_URL", "http://proxy/api/users/").rstrip("/") + "/"
+# "opaque" issues random tokens looked up in auth_tokens on every request.
+# "signed" issues short-lived HMAC access tokens that other services verify locally,
+# plus an opaque refresh token stored in auth_tokens.
+AUTH_TOKEN_MODE = os.getenv("AUTH_TOKEN_MODE", "opaque")
+ACCESS_TOKEN_TTL_SECONDS = int(os.getenv("ACCESS_TOKEN_TTL_SECONDS", "900"))
+# Lifetime of rows in auth_tokens (session tokens, or refresh tokens in signed mode)
+AUTH_TOKEN_TTL_SECONDS = int(os.getenv("AUTH_TOKEN_TTL_SECONDS", str(7 * 24 * 3600)))
+# Oldest sessions beyond this many per user are dropped at login; 0 means unlimited
+AUTH_MAX_TOKENS_PER_USER = int(os.getenv("AUTH_MAX_TOKENS_PER_USER", "0"))
+
+token_verifier = TokenVerifier(os.getenv("AUTH_TOKEN_SECRET"))
+if AUTH_TOKEN_MODE == "signed" and not token_verifier.enabled:
+    raise RuntimeError("AUTH_TOKEN_MODE=signed requires AUTH_TOKEN_SECRET")
 
 auth_router = APIRouter()
 security = HTTPBearer(auto_error=False)
 
-def hash_password(password: str) -> str:
-    salt = bcrypt.gensalt()
-    return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
-
-def verify_password(password: str, hashed: str) -> bool:
-    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
-
 def generate_token() -> str:
     return secrets.token_urlsafe(32)
 
+def issue_tokens(db: Session, user_id) -> tuple:
+    """Add the token row for a new session and return (token, refresh_token, expires_in).
+
+    The caller commits. In opaque mode the stored token is the bearer token itself;
+    in signed mode it is the refresh token and the bearer token is never stored.
+    """
+    if AUTH_MAX_TOKENS_PER_USER > 0:
+        oldest = (
+            db.query(AuthToken.id)
+            .filter(AuthToken.user_id == user_id)
+            .order_by(AuthToken.created_at.desc())
+            .offset(AUTH_MAX_TOKENS_PER_USER - 1)
+        )
+        db.query(AuthToken).filter(AuthToken.id.in_(oldest.scalar_subquery())).delete(synchronize_session=False)
+    stored = generate_token()
+    db.add(AuthToken(
+        token=stored,
+        user_id=user_id,
+        expires_at=datetime.utcnow() + timedelta(seconds=AUTH_TOKEN_TTL_SECONDS),
+    ))
+    if AUTH_TOKEN_MODE != "signed":
+        return stored, None, None
+    access_token, _ = issue_access_token(user_id, token_verifier.secret, ACCESS_TOKEN_TTL_SECONDS)
+    return access_token, stored, ACCESS_TOKEN_TTL_SECONDS
+
+def _hasher_busy() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many authentication requests. Please try again.",
+        headers={"Retry-After": "1"},
+    )
+
+def _find_user(db: Session, email: str) -> Optional[AuthUser]:
+    return db.query(AuthUser).filter(AuthUser.email == email).first()
 
-def get_current_user(
+def _revoke_access_token(db: Session, token: str):
+    claims = token_verifier.verify(token)
+    db.merge(RevokedAccessToken(
+        jti=claims.jti,
+        user_id=claims.user_id,
+        expires_at=_utc_datetime(claims.expires_at),
+    ))
+
+def _is_revoked(db: Session, claims: AccessClaims) -> bool:
+    """Revoked by logout (its jti) or by a logout-all of its user after it was issued; one query."""
+    return db.query(
+        exists().where(RevokedAccessToken.jti == claims.jti)
+        | exists().where(
+            UserRevocation.user_id == claims.user_id,
+            UserRevocation.revoked_before > _utc_datetime(claims.issued_at),
+        )
+    ).scalar()
+
+def _utc_datetime(timestamp: int) -> datetime:
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).replace(tzinfo=None)
+
+def _timestamp(value: datetime) -> int:
+    return int(value.replace(tzinfo=timezone.utc).timestamp())
+
+
+async def get_current_user(
     credentials: Optional[HTTPAuthorizationCredentials] = Depends(security),
-    db: Session = Depends(get_db),
+    db: DbSession = Depends(get_db),
 ) -> AuthUser:
     if not credentials:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Missing or invalid token",
         )
-    token_row = db.query(AuthToken).filter(AuthToken.token == credentials.credentials).first()
-    if not token_row:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid or expired token",
-        )
-    user = db.query(AuthUser).filter(AuthUser.id == token_row.user_id).first()
+    return await run_db(db, _authenticate, credentials.credentials)
+
+def _authenticate(db: Session, token: str) -> AuthUser:
+    if is_signed_token(token):
+        try:
+            claims = token_verifier.verify(token)
+        except InvalidToken:
+            claims = None
+        if not claims or _is_revoked(db, claims):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid or expired token",
+            )
+        user_id = claims.user_id
+    else:
+        # In signed mode auth_tokens only holds refresh tokens, which are not bearer tokens
+        token_row = None
+        if AUTH_TOKEN_MODE != "signed":
+            token_row = db.query(AuthToken).filter(
+                AuthToken.token == token,
+                AuthToken.expires_at > datetime.utcnow(),
+            ).first()
+        if not token_row:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid or expired token",
+            )
+        user_id = token_row.user_id
+    user = db.query(AuthUser).filter(AuthUser.id == user_id).first()
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -53,110 +150,258 @@ def get_current_user(
     return user
 
 @auth_router.post("/register", response_model=AuthResponse, status_code=status.HTTP_201_CREATED)
-def register(request: RegisterRequest, db: Session = Depends(get_db)):
-    existing_user = db.query(AuthUser).filter(AuthUser.email == request.email).first()
+async def register(request: RegisterRequest, db: DbSession = Depends(get_db)):
+    # bcrypt runs on the password hasher's executor; DB work goes through run_db
+    existing_user = await run_db(db, _find_user, request.email)
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered"
         )
-    hashed_password = hash_password(request.password)
+    try:
+        hashed_password = await password_hasher.hash(request.password)
+    except PasswordHasherBusy:
+        raise _hasher_busy()
+
+    # One transaction for the user, its token and the outbox row; User Service is
+    # never awaited past PROFILE_CALL_BUDGET_SECONDS (see profile_outbox.py)
+    user_id = uuid.uuid4()
+    payload = profile_payload(user_id, request.email, request)
+    concurrent = PROFILE_DELIVERY_MODE == "concurrent"
+    staged, delivery = await asyncio.gather(
+        run_db(db, _stage_account, user_id, request.email, hashed_password),
+        post_profile(payload) if concurrent else validate_profile(payload),
+        return_exceptions=True,
+    )
+    if isinstance(delivery, Exception):
+        delivery = DeliveryResult(RETRY, str(delivery))
+    try:
+        if isinstance(staged, Exception):
+            raise staged
+        queued, response = await run_db(db, _finish_account, *staged, payload, delivery)
+    except Exception:
+        # A posted profile may already exist; without the account it would be an orphan
+        if concurrent and delivery.outcome != REJECTED:
+            await delete_profile(user_id)
+        raise
+    if queued:
+        outbox_dispatcher.notify()
+    return response
+
+def _stage_account(db: Session, user_id: uuid.UUID, email: str, hashed_password: str):
     new_user = AuthUser(
-        email=request.email,
+        id=user_id,
+        email=email,
         password_hash=hashed_password
     )
-
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
-    token = generate_token()
-    db.add(AuthToken(token=token, user_id=new_user.id))
-    db.commit()
-    # Create user profile in user service (same id as auth user)
-    user_service_payload = {
-        "id": str(new_user.id),
-        "email": new_user.email,
-        "first_name": request.first_name,
-        "last_name": request.last_name,
-        "dni": request.dni,
-        "phone": request.phone,
-        "birth_date": request.birth_date.isoformat() if request.birth_date else None,
-    }
     try:
-        with httpx.Client(timeout=10.0) as client:
-            r = client.post(
-                USER_SERVICE_URL,
-                json=user_service_payload,
-            )
-            if r.status_code >= 400:
-                try:
-                    detail = r.json().get("detail", r.text)
-                except Exception:
-                    detail = r.text
-                if isinstance(detail, list) and detail:
-                    detail = detail[0].get("msg", str(detail[0]))
-                if not isinstance(detail, str):
-                    detail = "User service error"
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=detail,
-                )
-    except HTTPException:
-        token_row = db.query(AuthToken).filter(AuthToken.token == token).first()
-        if token_row:
-            db.delete(token_row)
-        db.delete(new_user)
-        db.commit()
-        raise
-    except Exception as e:
-        token_row = db.query(AuthToken).filter(AuthToken.token == token).first()
-        if token_row:
-            db.delete(token_row)
-        db.delete(new_user)
-        db.commit()
+        db.flush()  # auth_tokens references auth_users, and there is no relationship to order the inserts
+    except IntegrityError:
+        # Lost a race with another registration for the same email
+        db.rollback()
         raise HTTPException(
-            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            detail="User service unavailable. Please try again.",
-        ) from e
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Email already registered"
+        )
+    tokens = issue_tokens(db, new_user.id)
+    db.flush()
+    return new_user, tokens
 
-    return AuthResponse(
+def _finish_account(db: Session, new_user: AuthUser, tokens: tuple, payload: dict, delivery: DeliveryResult):
+    """Commit the staged account; returns (outbox row written, response)."""
+    if delivery.outcome == REJECTED:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=delivery.detail,
+        )
+    queued = delivery.outcome != DELIVERED
+    if queued:
+        db.add(ProfileOutbox(user_id=new_user.id, payload=payload))
+    token, refresh_token, expires_in = tokens
+    response = AuthResponse(
         id=new_user.id,
         email=new_user.email,
         token=token,
-        created_at=new_user.created_at
+        created_at=new_user.created_at,
+        refresh_token=refresh_token,
+        expires_in=expires_in
     )
+    db.commit()
+    return queued, response
+
+async def admit_login(request: LoginRequest, http_request: Request):
+    """Reject throttled attempts before the DB session or bcrypt are touched."""
+    if login_throttle is None:
+        return
+    retry_after = await login_throttle.check_async(request.email, client_ip(http_request))
+    if retry_after:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many login attempts. Please try again later.",
+            headers={"Retry-After": str(retry_after)},
+        )
 
 @auth_router.post("/login", response_model=LoginResponse)
-def login(request: LoginRequest, db: Session = Depends(get_db)):
-    user = db.query(AuthUser).filter(AuthUser.email == request.email).first()
+async def login(
+    request: LoginRequest,
+    _admitted: None = Depends(admit_login),
+    db: DbSession = Depends(get_db),
+):
+    user = await run_db(db, _find_user, request.email)
 
     if not user:
+        # Same slot and the same 503 as a verify, so a busy answer says nothing about the email
+        try:
+            await password_hasher.equalize()
+        except PasswordHasherBusy:
+            raise _hasher_busy()
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid credentials"
         )
 
-    if not verify_password(request.password, user.password_hash):
+    try:
+        valid = await password_hasher.verify(request.password, user.password_hash)
+    except PasswordHasherBusy:
+        raise _hasher_busy()
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid credentials"
         )
 
-    user.last_login = datetime.utcnow()
-    db.commit()
+    # Upgrade hashes stored with a different cost factor while we have the plaintext
+    new_hash = None
+    if password_hasher.needs_rehash(user.password_hash):
+        try:
+            new_hash = await password_hasher.hash(request.password)
+        except PasswordHasherBusy:
+            pass  # retried on a later login
 
-    token = generate_token()
-    db.add(AuthToken(token=token, user_id=user.id))
+    return await run_db(db, _complete_login, user, new_hash)
+
+def _complete_login(db: Session, user: AuthUser, new_hash: Optional[str]) -> LoginResponse:
+    user.last_login = datetime.utcnow()
+    if new_hash:
+        user.password_hash = new_hash
+    # One commit, and the response built from values read before it: committing expires
+    # the user, and reading it again would reload the row
+    user_id, email = user.id, user.email
+    token, refresh_token, expires_in = issue_tokens(db, user_id)
     db.commit()
 
     return LoginResponse(
-        id=user.id,
-        email=user.email,
+        id=user_id,
+        email=email,
         token=token,
-        message="Login successful"
+        message="Login successful",
+        refresh_token=refresh_token,
+        expires_in=expires_in
     )
 
 
 @auth_router.get("/me", response_model=MeResponse)
-def me(current_user: AuthUser = Depends(get_current_user)):
+async def me(current_user: AuthUser = Depends(get_current_user)):
     return MeResponse(id=current_user.id, email=current_user.email)
+
+
+@auth_router.post("/refresh", response_model=TokenResponse)
+async def refresh(request: RefreshRequest, db: DbSession = Depends(get_db)):
+    if AUTH_TOKEN_MODE != "signed":
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Token refresh is only available in signed token mode"
+        )
+    return await run_db(db, _refresh, request.refresh_token)
+
+def _refresh(db: Session, refresh_token: str) -> TokenResponse:
+    token_row = db.query(AuthToken).filter(
+        AuthToken.token == refresh_token,
+        AuthToken.expires_at > datetime.utcnow(),
+    ).first()
+    if not token_row:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired token",
+        )
+    access_token, _ = issue_access_token(token_row.user_id, token_verifier.secret, ACCESS_TOKEN_TTL_SECONDS)
+    return TokenResponse(
+        token=access_token,
+        refresh_token=token_row.token,
+        expires_in=ACCESS_TOKEN_TTL_SECONDS
+    )
+
+
+@auth_router.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+async def logout(
+    request: Optional[LogoutRequest] = None,
+    current_user: AuthUser = Depends(get_current_user),
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: DbSession = Depends(get_db),
+):
+    refresh_token = request.refresh_token if request else None
+    await run_db(db, _logout, current_user.id, credentials.credentials, refresh_token)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+def _logout(db: Session, user_id: uuid.UUID, token: str, refresh_token: Optional[str]):
+    if is_signed_token(token):
+        _revoke_access_token(db, token)
+        if refresh_token:
+            db.query(AuthToken).filter(
+                AuthToken.token == refresh_token,
+                AuthToken.user_id == user_id,
+            ).delete()
+    else:
+        db.query(AuthToken).filter(AuthToken.token == token).delete()
+    db.commit()
+
+
+@auth_router.post("/logout-all", status_code=status.HTTP_204_NO_CONTENT)
+async def logout_all(
+    current_user: AuthUser = Depends(get_current_user),
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: DbSession = Depends(get_db),
+):
+    """Revoke every session of the current user.
+
+    With signed tokens this drops all refresh tokens and records a cutoff that
+    rejects every access token of the user issued up to now, here and in the
+    services that sync /revocations.
+    """
+    await run_db(db, _logout_all, current_user.id, credentials.credentials)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+def _logout_all(db: Session, user_id: uuid.UUID, token: str):
+    if token_verifier.enabled:
+        # iat has whole seconds: tokens issued within the current second are revoked too
+        revoked_before = int(time.time()) + 1
+        db.merge(UserRevocation(
+            user_id=user_id,
+            revoked_before=_utc_datetime(revoked_before),
+            expires_at=_utc_datetime(revoked_before + ACCESS_TOKEN_TTL_SECONDS),
+        ))
+    db.query(AuthToken).filter(AuthToken.user_id == user_id).delete()
+    db.commit()
+
+
+@auth_router.get("/revocations", response_model=RevocationListResponse)
+async def get_revocations(db: DbSession = Depends(get_db)):
+    """Revoked access tokens and logout-all cutoffs that still matter, synced by the other services."""
+    return await run_db(db, _get_revocations)
+
+def _get_revocations(db: Session) -> RevocationListResponse:
+    now = datetime.utcnow()
+    rows = db.query(RevokedAccessToken.jti, RevokedAccessToken.expires_at).filter(
+        RevokedAccessToken.expires_at > now
+    ).all()
+    users = db.query(UserRevocation).filter(UserRevocation.expires_at > now).all()
+    return RevocationListResponse(
+        revocations=[RevocationEntry(jti=jti, exp=_timestamp(expires_at)) for jti, expires_at in rows],
+        users=[
+            UserRevocationEntry(
+                user_id=row.user_id, revoked_before=_timestamp(row.revoked_before), exp=_timestamp(row.expires_at))
+            for row in users
+        ],
+    )
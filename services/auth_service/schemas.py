@@ -1,7 +1,7 @@
 from pydantic import BaseModel, EmailStr
 from datetime import datetime, date
 from uuid import UUID
-from typing import Optional
+from typing import List, Optional
 
 class RegisterRequest(BaseModel):
     email: EmailStr
@@ -21,6 +21,8 @@ class AuthResponse(BaseModel):
     email: str
     token: str
     created_at: datetime
+    refresh_token: Optional[str] = None  # Only in signed token mode
+    expires_in: Optional[int] = None
 
     class Config:
         from_attributes = True
@@ -30,6 +32,8 @@ class LoginResponse(BaseModel):
     email: str
     token: str
     message: str
+    refresh_token: Optional[str] = None  # Only in signed token mode
+    expires_in: Optional[int] = None
 
     class Config:
         from_attributes = True
@@ -40,3 +44,27 @@ class MeResponse(BaseModel):
 
     class Config:
         from_attributes = True
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+class LogoutRequest(BaseModel):
+    refresh_token: Optional[str] = None
+
+class TokenResponse(BaseModel):
+    token: str
+    refresh_token: str
+    expires_in: int
+
+class RevocationEntry(BaseModel):
+    jti: str
+    exp: int
+
+class UserRevocationEntry(BaseModel):
+    user_id: UUID
+    revoked_before: int
+    exp: int
+
+class RevocationListResponse(BaseModel):
+    revocations: List[RevocationEntry]
+    users: List[UserRevocationEntry] = []
@@ -0,0 +1,99 @@
+"""
+Background purge of expired auth tokens.
+
+Deletes expired rows from auth_tokens, revoked_access_tokens and
+user_revocations in small batches driven by their expires_at index, so each
+DELETE holds locks only briefly. Claimed rows use SKIP LOCKED, letting several replicas purge at
+the same time without blocking each other.
+"""
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import delete, select
+
+from database import SessionLocal
+from models import AuthToken, RevokedAccessToken, UserRevocation
+
+logger = logging.getLogger(__name__)
+
+AUTH_TOKEN_PURGE_INTERVAL_SECONDS = float(os.getenv("AUTH_TOKEN_PURGE_INTERVAL_SECONDS", "300"))
+AUTH_TOKEN_PURGE_BATCH_SIZE = int(os.getenv("AUTH_TOKEN_PURGE_BATCH_SIZE", "1000"))
+# Pause between batches so the purge never monopolises the table
+AUTH_TOKEN_PURGE_BATCH_PAUSE_SECONDS = float(os.getenv("AUTH_TOKEN_PURGE_BATCH_PAUSE_SECONDS", "0.05"))
+
+
+def purge_expired_batch(db, model, key, batch_size: int, now: datetime) -> int:
+    """Delete up to ``batch_size`` expired rows of ``model`` and return how many went."""
+    expired = (
+        select(key)
+        .where(model.expires_at < now)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    result = db.execute(delete(model).where(key.in_(expired)))
+    db.commit()
+    return result.rowcount
+
+
+class TokenPurger:
+    def __init__(
+        self,
+        interval: float = AUTH_TOKEN_PURGE_INTERVAL_SECONDS,
+        batch_size: int = AUTH_TOKEN_PURGE_BATCH_SIZE,
+        batch_pause: float = AUTH_TOKEN_PURGE_BATCH_PAUSE_SECONDS,
+    ):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def purge(self) -> int:
+        """Run batches until no expired rows are left; returns the number deleted."""
+        total = 0
+        now = datetime.utcnow()
+        db = SessionLocal()
+        try:
+            for model, key in (
+                (AuthToken, AuthToken.id),
+                (RevokedAccessToken, RevokedAccessToken.jti),
+                (UserRevocation, UserRevocation.user_id),
+            ):
+                while not self._stop.is_set():
+                    deleted = purge_expired_batch(db, model, key, self.batch_size, now)
+                    total += deleted
+                    if deleted < self.batch_size:
+                        break
+                    self._stop.wait(self.batch_pause)
+        finally:
+            db.close()
+        return total
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                deleted = self.purge()
+                if deleted:
+                    logger.info("Purged %d expired auth tokens", deleted)
+            except Exception:
+                logger.exception("Auth token purge failed")
+
+    def start(self):
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="auth-token-purge", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+token_purger = TokenPurger()
@@ -1,50 +1,84 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from sqlalchemy.orm import Session
-from database import get_db
+import os
+from fastapi import APIRouter, Depends, HTTPException, Response, status, Query
+from pydantic import TypeAdapter
+from sqlalchemy.orm import Session, joinedload
+from database import DbSession, engine, get_db, run_db
 from models import Specialty, Doctor
 from schemas import SpecialtyResponse, DoctorResponse
 from typing import List, Optional
 from uuid import UUID
+from shared.cache import Cache, build_backend
 
 catalog_router = APIRouter()
 
+# The catalog changes only through migrations or by hand, so its responses are
+# cached as JSON bodies; `python -m shared.cache --tag catalog` drops them all
+CATALOG_CACHE_TTL_SECONDS = float(os.getenv("CATALOG_CACHE_TTL_SECONDS", "300"))
+CATALOG_TAGS = ("catalog",)
+catalog_cache = Cache("catalog", build_backend(engine), ttl=CATALOG_CACHE_TTL_SECONDS)
+
+SPECIALTIES_JSON = TypeAdapter(List[SpecialtyResponse])
+DOCTORS_JSON = TypeAdapter(List[DoctorResponse])
+
+def _json_response(body: bytes) -> Response:
+    return Response(content=body, media_type="application/json")
+
+@catalog_router.get("/cache/stats")
+def catalog_cache_stats():
+    """Hits, misses and coalesced loads of this replica's catalog cache."""
+    return catalog_cache.stats()
+
 @catalog_router.get("/specialties", response_model=List[SpecialtyResponse])
-def get_specialties(db: Session = Depends(get_db)):
+async def get_specialties(db: DbSession = Depends(get_db)):
+    body = await catalog_cache.aget_or_load("specialties", lambda: run_db(db, _get_specialties), tags=CATALOG_TAGS)
+    return _json_response(body)
+
+def _get_specialties(db: Session) -> bytes:
     specialties = db.query(Specialty).all()
-    return specialties
+    return SPECIALTIES_JSON.dump_json(SPECIALTIES_JSON.validate_python(specialties, from_attributes=True))
+
+def _doctor_response(doctor: Doctor) -> DoctorResponse:
+    return DoctorResponse(
+        id=doctor.id,
+        name=doctor.name,
+        specialty_id=doctor.specialty_id,
+        specialty_name=doctor.specialty.name if doctor.specialty else None,
+        rating=doctor.rating,
+        experience_years=doctor.experience_years,
+        price=doctor.price,
+        photo_url=doctor.photo_url,
+        created_at=doctor.created_at
+    )
 
 @catalog_router.get("/doctors", response_model=List[DoctorResponse])
-def get_doctors(
+async def get_doctors(
     specialty_id: Optional[UUID] = Query(None),
-    db: Session = Depends(get_db)
+    db: DbSession = Depends(get_db)
 ):
-    query = db.query(Doctor)
+    body = await catalog_cache.aget_or_load(
+        f"doctors:{specialty_id or 'all'}", lambda: run_db(db, _get_doctors, specialty_id), tags=CATALOG_TAGS
+    )
+    return _json_response(body)
+
+def _get_doctors(db: Session, specialty_id: Optional[UUID]) -> bytes:
+    # The specialty name is needed for every doctor: load it in the same query, not one query per doctor
+    query = db.query(Doctor).options(joinedload(Doctor.specialty))
 
     if specialty_id:
         query = query.filter(Doctor.specialty_id == specialty_id)
 
-    doctors = query.all()
-
-    result = []
-    for doctor in doctors:
-        doctor_dict = {
-            "id": doctor.id,
-            "name": doctor.name,
-            "specialty_id": doctor.specialty_id,
-            "specialty_name": doctor.specialty.name if doctor.specialty else None,
-            "rating": doctor.rating,
-            "experience_years": doctor.experience_years,
-            "price": doctor.price,
-            "photo_url": doctor.photo_url,
-            "created_at": doctor.created_at
-        }
-        result.append(DoctorResponse(**doctor_dict))
-
-    return result
+    return DOCTORS_JSON.dump_json([_doctor_response(doctor) for doctor in query.all()])
 
 @catalog_router.get("/doctors/{doctor_id}", response_model=DoctorResponse)
-def get_doctor(doctor_id: UUID, db: Session = Depends(get_db)):
-    doctor = db.query(Doctor).filter(Doctor.id == doctor_id).first()
+async def get_doctor(doctor_id: UUID, db: DbSession = Depends(get_db)):
+    # Unknown ids raise 404 from the loader and are not cached
+    body = await catalog_cache.aget_or_load(
+        f"doctor:{doctor_id}", lambda: run_db(db, _get_doctor, doctor_id), tags=CATALOG_TAGS
+    )
+    return _json_response(body)
+
+def _get_doctor(db: Session, doctor_id: UUID) -> bytes:
+    doctor = db.query(Doctor).options(joinedload(Doctor.specialty)).filter(Doctor.id == doctor_id).first()
 
     if not doctor:
         raise HTTPException(
@@ -52,16 +86,4 @@ def get_doctor(doctor_id: UUID, db: Session = Depends(get_db)):
             detail="Doctor not found"
         )
 
-    doctor_dict = {
-        "id": doctor.id,
-        "name": doctor.name,
-        "specialty_id": doctor.specialty_id,
-        "specialty_name": doctor.specialty.name if doctor.specialty else None,
-        "rating": doctor.rating,
-        "experience_years": doctor.experience_years,
-        "price": doctor.price,
-        "photo_url": doctor.photo_url,
-        "created_at": doctor.created_at
-    }
-
-    return DoctorResponse(**doctor_dict)
+    return _doctor_response(doctor).model_dump_json().encode("utf-8")
@@ -0,0 +1,97 @@
+"""
+Card number validation and network detection.
+
+BinTable is compiled from a CSV of BIN/IIN ranges (data/bin_ranges.csv by
+default, PAYMENT_BIN_TABLE_PATH to override). Every range is widened to
+PREFIX_DIGITS-digit bounds, overlaps are resolved in favour of the narrowest
+range, and the result is kept as sorted, disjoint interval starts so a lookup
+is one bisect on the card's first PREFIX_DIGITS digits.
+
+luhn_valid() rejects mistyped numbers before they cost a user lookup, a
+gateway call or a FAILED payment row.
+"""
+import csv
+import os
+from bisect import bisect_right
+from typing import List, NamedTuple, Optional, Tuple
+
+PREFIX_DIGITS = 8
+PAYMENT_BIN_TABLE_PATH = os.getenv(
+    "PAYMENT_BIN_TABLE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "bin_ranges.csv")
+)
+
+# Digit value after the Luhn doubling step: 0,2,4,6,8,1,3,5,7,9
+_LUHN_DOUBLED = (0, 2, 4, 6, 8, 1, 3, 5, 7, 9)
+
+
+def luhn_valid(number: str) -> bool:
+    """Luhn (mod 10) check of a string of ASCII digits; anything else is invalid."""
+    if not number.isascii() or not number.isdigit():
+        return False
+    total = 0
+    double = False
+    for char in reversed(number):
+        digit = ord(char) - 48
+        total += _LUHN_DOUBLED[digit] if double else digit
+        double = not double
+    return total % 10 == 0
+
+
+class BinRange(NamedTuple):
+    network: str
+    lengths: Tuple[int, ...]
+
+
+class BinTable:
+    def __init__(self, ranges: List[Tuple[int, int, BinRange]]):
+        self._starts: List[int] = []
+        self._ends: List[int] = []
+        self._entries: List[BinRange] = []
+        self._compile(ranges)
+
+    @classmethod
+    def from_csv(cls, path: str = PAYMENT_BIN_TABLE_PATH) -> "BinTable":
+        ranges = []
+        with open(path, newline="") as data:
+            rows = csv.DictReader(line for line in data if line.strip() and not line.startswith("#"))
+            for row in rows:
+                start, end = row["start"].strip(), row["end"].strip()
+                if len(start) != len(end) or len(start) > PREFIX_DIGITS:
+                    raise ValueError(f"Bad BIN range {start}-{end} in {path}")
+                pad = PREFIX_DIGITS - len(start)
+                lengths = tuple(int(length) for length in row["lengths"].split(";"))
+                ranges.append((int(start) * 10 ** pad, (int(end) + 1) * 10 ** pad - 1, BinRange(row["network"].strip(), lengths)))
+        return cls(ranges)
+
+    def _compile(self, ranges):
+        # Cut the number line at every range boundary; each piece takes the
+        # narrowest range that covers it
+        cuts = sorted({low for low, _, _ in ranges} | {high + 1 for _, high, _ in ranges})
+        for low, next_low in zip(cuts, cuts[1:]):
+            covering = [(high - start, entry) for start, high, entry in ranges if start <= low and next_low - 1 <= high]
+            if not covering:
+                continue
+            entry = min(covering, key=lambda item: item[0])[1]
+            if self._entries and self._entries[-1] == entry and self._ends[-1] == low - 1:
+                self._ends[-1] = next_low - 1
+            else:
+                self._starts.append(low)
+                self._ends.append(next_low - 1)
+                self._entries.append(entry)
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def lookup(self, card_number: str) -> Optional[BinRange]:
+        prefix = int(card_number[:PREFIX_DIGITS].ljust(PREFIX_DIGITS, "0"))
+        index = bisect_right(self._starts, prefix) - 1
+        if index >= 0 and prefix <= self._ends[index]:
+            return self._entries[index]
+        return None
+
+    def network(self, card_number: str) -> str:
+        entry = self.lookup(card_number)
+        return entry.network if entry else "Unknown"
+
+
+bin_table = BinTable.from_csv()
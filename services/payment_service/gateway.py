@@ -0,0 +1,192 @@
+"""
+Card authorisation gateways.
+
+PAYMENT_GATEWAY selects the implementation:
+
+* ``simulated`` (default): approves 95% of payments in-process after
+  PAYMENT_SIMULATED_LATENCY_MS, like the original simulate_payment_processing.
+* ``http``: HttpPaymentGateway posts to PAYMENT_GATEWAY_URL/authorisations with
+  a pooled httpx.AsyncClient, a per-call timeout and at most
+  PAYMENT_GATEWAY_MAX_CONCURRENCY calls in flight. gateway_simulator.py
+  serves that API locally with configurable latency, errors and rate limits.
+
+Gateways are async, but process_payment and the payment workers are threads.
+GatewayRunner owns one event loop in a background thread; callers block on
+authorise() while every gateway call shares that loop's connection pool and
+concurrency limit.
+"""
+import asyncio
+import logging
+import os
+import random
+import threading
+from typing import NamedTuple, Optional
+
+import httpx
+
+from shared.metrics import track_outbound
+
+logger = logging.getLogger(__name__)
+
+PAYMENT_GATEWAY = os.getenv("PAYMENT_GATEWAY", "simulated")  # simulated | http
+PAYMENT_GATEWAY_URL = os.getenv("PAYMENT_GATEWAY_URL", "http://localhost:8099").rstrip("/")
+PAYMENT_GATEWAY_TIMEOUT_SECONDS = float(os.getenv("PAYMENT_GATEWAY_TIMEOUT_SECONDS", "10"))
+PAYMENT_GATEWAY_MAX_CONNECTIONS = int(os.getenv("PAYMENT_GATEWAY_MAX_CONNECTIONS", "50"))
+PAYMENT_GATEWAY_MAX_CONCURRENCY = int(os.getenv("PAYMENT_GATEWAY_MAX_CONCURRENCY", "50"))
+# Stand-in for gateway latency when load testing the simulated gateway
+PAYMENT_SIMULATED_LATENCY_MS = float(os.getenv("PAYMENT_SIMULATED_LATENCY_MS", "0"))
+PAYMENT_SIMULATED_APPROVAL_RATE = float(os.getenv("PAYMENT_SIMULATED_APPROVAL_RATE", "0.95"))
+
+
+class GatewayError(Exception):
+    """The gateway gave no decision (timeout, rate limit, server error); the card may still have been charged."""
+
+
+class AuthorisationRequest(NamedTuple):
+    reference: str  # our transaction_id, sent so the gateway can deduplicate
+    amount: float
+    card_last_four: str
+    card_type: str
+
+
+class GatewayDecision(NamedTuple):
+    approved: bool
+    gateway_reference: Optional[str] = None
+    decline_reason: Optional[str] = None
+
+
+class PaymentGateway:
+    async def authorise(self, request: AuthorisationRequest) -> GatewayDecision:
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class SimulatedGateway(PaymentGateway):
+    def __init__(self, latency_ms: float = PAYMENT_SIMULATED_LATENCY_MS, approval_rate: float = PAYMENT_SIMULATED_APPROVAL_RATE):
+        self.latency_ms = latency_ms
+        self.approval_rate = approval_rate
+
+    async def authorise(self, request: AuthorisationRequest) -> GatewayDecision:
+        if self.latency_ms > 0:
+            await asyncio.sleep(self.latency_ms / 1000)
+        if random.random() < self.approval_rate:
+            return GatewayDecision(True, f"SIM-{request.reference}")
+        return GatewayDecision(False, decline_reason="declined")
+
+
+class HttpPaymentGateway(PaymentGateway):
+    def __init__(
+        self,
+        base_url: str = PAYMENT_GATEWAY_URL,
+        timeout: float = PAYMENT_GATEWAY_TIMEOUT_SECONDS,
+        max_connections: int = PAYMENT_GATEWAY_MAX_CONNECTIONS,
+        max_concurrency: int = PAYMENT_GATEWAY_MAX_CONCURRENCY,
+    ):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.max_concurrency = max_concurrency
+        # Created lazily so they bind to the loop that runs the calls
+        self._client: Optional[httpx.AsyncClient] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+            )
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+        return self._client
+
+    async def authorise(self, request: AuthorisationRequest) -> GatewayDecision:
+        client = self._get_client()
+        async with self._slots:
+            try:
+                response = await client.post(
+                    "/authorisations",
+                    json=request._asdict(),
+                    headers={"Idempotency-Key": request.reference},
+                )
+            except httpx.HTTPError as e:
+                raise GatewayError(str(e) or type(e).__name__) from e
+        if response.status_code not in (200, 402):
+            raise GatewayError(f"HTTP {response.status_code}")
+        # A body we cannot read is no decision either, e.g. an HTML page from a proxy
+        try:
+            payload = response.json()
+        except ValueError as e:
+            raise GatewayError(f"HTTP {response.status_code} with an undecodable body") from e
+        if not isinstance(payload, dict):
+            raise GatewayError(f"HTTP {response.status_code} with an unexpected body")
+        if response.status_code == 402:
+            return GatewayDecision(False, decline_reason=payload.get("reason", "declined"))
+        return GatewayDecision(bool(payload.get("approved")), payload.get("reference"), payload.get("reason"))
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class GatewayRunner:
+    """Runs a PaymentGateway on a dedicated event loop for thread-based callers."""
+
+    def __init__(self, gateway: PaymentGateway, call_timeout: float = PAYMENT_GATEWAY_TIMEOUT_SECONDS):
+        self.gateway = gateway
+        self.call_timeout = call_timeout
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name="payment-gateway", daemon=True)
+                self._thread.start()
+            return self._loop
+
+    def authorise(self, request: AuthorisationRequest) -> GatewayDecision:
+        """Block until the gateway decides; raises GatewayError on timeout or failure."""
+        future = asyncio.run_coroutine_threadsafe(
+            asyncio.wait_for(self.gateway.authorise(request), self.call_timeout), self._ensure_loop()
+        )
+        try:
+            with track_outbound("payment-gateway"):
+                return future.result()
+        except asyncio.TimeoutError as e:
+            raise GatewayError("Gateway call timed out") from e
+
+    async def authorise_async(self, request: AuthorisationRequest) -> GatewayDecision:
+        """authorise() for async callers: awaits the gateway loop instead of blocking a thread."""
+        future = asyncio.run_coroutine_threadsafe(
+            asyncio.wait_for(self.gateway.authorise(request), self.call_timeout), self._ensure_loop()
+        )
+        try:
+            with track_outbound("payment-gateway"):
+                return await asyncio.wrap_future(future)
+        except asyncio.TimeoutError as e:
+            raise GatewayError("Gateway call timed out") from e
+
+    def stop(self):
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.gateway.close(), loop).result(timeout=5)
+        loop.call_soon_threadsafe(loop.stop)
+        self._thread.join(timeout=5)
+        loop.close()
+
+
+def build_gateway() -> PaymentGateway:
+    if PAYMENT_GATEWAY == "http":
+        return HttpPaymentGateway()
+    return SimulatedGateway()
+
+
+payment_gateway = GatewayRunner(build_gateway())
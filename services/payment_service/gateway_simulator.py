@@ -0,0 +1,147 @@
+"""
+Local stand-in for the card gateway, for load tests and benchmarks.
+
+Serves the API HttpPaymentGateway talks to (POST /authorisations) with a
+configurable latency distribution, share of server errors, share of
+declines and a token-bucket rate limit, so process_payment can be measured
+against a slow or flaky gateway before a real one is wired in.
+
+Usage:
+    python gateway_simulator.py --port 8099 --latency lognormal:200,0.5 \\
+        [--slow-rate 0.01 --slow-ms 3000] [--error-rate 0.02] [--decline-rate 0.05] [--rate-limit 100]
+
+Latency specs (milliseconds): ``fixed:200``, ``uniform:50,400`` or
+``lognormal:MEDIAN,SIGMA``. Point payment_service at it with
+PAYMENT_GATEWAY=http PAYMENT_GATEWAY_URL=http://localhost:8099.
+"""
+import argparse
+import asyncio
+import math
+import random
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, NamedTuple, Optional
+
+from fastapi import FastAPI, Header
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+
+class SimulatorConfig(NamedTuple):
+    latency: str = "fixed:0"
+    slow_rate: float = 0.0
+    slow_ms: float = 0.0
+    error_rate: float = 0.0
+    decline_rate: float = 0.05
+    rate_limit: float = 0.0  # requests per second, 0 = unlimited
+
+
+class Authorisation(BaseModel):
+    reference: str
+    amount: float
+    card_last_four: str
+    card_type: str
+
+
+def latency_sampler(spec: str) -> Callable[[], float]:
+    """Parse a latency spec into a function returning seconds."""
+    kind, _, params = spec.partition(":")
+    values = [float(value) for value in params.split(",") if value]
+    if kind == "fixed":
+        return lambda: values[0] / 1000
+    if kind == "uniform":
+        low, high = values
+        return lambda: random.uniform(low, high) / 1000
+    if kind == "lognormal":
+        median, sigma = values
+        return lambda: random.lognormvariate(math.log(median), sigma) / 1000
+    raise ValueError(f"Unknown latency spec {spec!r}")
+
+
+class TokenBucket:
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+def create_app(config: SimulatorConfig = SimulatorConfig()) -> FastAPI:
+    app = FastAPI(title="Payment gateway simulator")
+    sample_latency = latency_sampler(config.latency)
+    bucket = TokenBucket(config.rate_limit) if config.rate_limit > 0 else None
+    # Decisions by Idempotency-Key, so a retried reference gets the same answer
+    decisions: "OrderedDict[str, tuple]" = OrderedDict()
+    counters = {"requests": 0, "approved": 0, "declined": 0, "errors": 0, "rate_limited": 0, "replayed": 0}
+
+    @app.post("/authorisations")
+    async def authorise(authorisation: Authorisation, idempotency_key: Optional[str] = Header(None)):
+        counters["requests"] += 1
+        if bucket is not None and not bucket.take():
+            counters["rate_limited"] += 1
+            return JSONResponse(status_code=429, content={"reason": "rate limited"}, headers={"Retry-After": "1"})
+        key = idempotency_key or authorisation.reference
+        if key in decisions:
+            counters["replayed"] += 1
+            status_code, content = decisions[key]
+            return JSONResponse(status_code=status_code, content=content)
+
+        delay = sample_latency()
+        if config.slow_rate and random.random() < config.slow_rate:
+            delay += config.slow_ms / 1000
+        await asyncio.sleep(delay)
+
+        if random.random() < config.error_rate:
+            counters["errors"] += 1
+            return JSONResponse(status_code=503, content={"reason": "gateway error"})
+        if random.random() < config.decline_rate:
+            counters["declined"] += 1
+            status_code, content = 402, {"approved": False, "reason": "insufficient funds"}
+        else:
+            counters["approved"] += 1
+            status_code, content = 200, {"approved": True, "reference": f"GW-{secrets.token_hex(6).upper()}"}
+        decisions[key] = (status_code, content)
+        if len(decisions) > 100000:
+            decisions.popitem(last=False)
+        return JSONResponse(status_code=status_code, content=content)
+
+    @app.get("/stats")
+    def stats():
+        return counters
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", default="fixed:0")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="share of calls that get --slow-ms extra")
+    parser.add_argument("--slow-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of calls answered 503")
+    parser.add_argument("--decline-rate", type=float, default=0.05, help="share of calls declined (402)")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="requests per second before 429, 0 = off")
+    args = parser.parse_args()
+
+    latency_sampler(args.latency)  # fail fast on a bad spec
+    config = SimulatorConfig(args.latency, args.slow_rate, args.slow_ms, args.error_rate, args.decline_rate, args.rate_limit)
+
+    import uvicorn
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""
+Idempotency-Key handling for POST /payments/.
+
+The first request with a key inserts an idempotency_keys row in the same
+transaction that writes the PENDING payment, and fills in the 202 response
+before committing. A concurrent request with the same key blocks on that
+uncommitted insert (ON CONFLICT waits for the other transaction) and, once
+it commits, replays the stored response instead of charging again. If the
+first request fails without committing, the key is free and the waiting
+request processes the payment itself.
+
+In sync mode the request then replaces the 202 with the gateway's decision,
+if it gets one. Decisions never change, so they are also kept in a small
+in-process LRU that answers most retries without a query; a 202 read back
+from the table is not cached, since a decision may still replace it. Keys live
+PAYMENT_IDEMPOTENCY_TTL_SECONDS and are deleted in batches by
+IdempotencyKeyPurger.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from http import HTTPStatus
+from typing import NamedTuple, Optional
+
+from sqlalchemy import delete, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import DBAPIError
+
+from database import SessionLocal
+from models import IdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+PAYMENT_IDEMPOTENCY_TTL_SECONDS = int(os.getenv("PAYMENT_IDEMPOTENCY_TTL_SECONDS", str(24 * 3600)))
+# How long a duplicate waits for the first request before answering 409
+PAYMENT_IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("PAYMENT_IDEMPOTENCY_WAIT_SECONDS", "30"))
+PAYMENT_IDEMPOTENCY_CACHE_SIZE = int(os.getenv("PAYMENT_IDEMPOTENCY_CACHE_SIZE", "10000"))
+PAYMENT_IDEMPOTENCY_PURGE_INTERVAL_SECONDS = float(os.getenv("PAYMENT_IDEMPOTENCY_PURGE_INTERVAL_SECONDS", "600"))
+PAYMENT_IDEMPOTENCY_PURGE_BATCH_SIZE = int(os.getenv("PAYMENT_IDEMPOTENCY_PURGE_BATCH_SIZE", "1000"))
+MAX_KEY_LENGTH = 255
+
+LOCK_NOT_AVAILABLE = "55P03"
+
+
+class IdempotencyKeyInProgress(Exception):
+    """The first request with this key is still running after the wait timeout."""
+
+
+class IdempotencyKeyMismatch(Exception):
+    """The key was already used with a different request body."""
+
+
+class StoredResponse(NamedTuple):
+    fingerprint: str
+    status_code: int
+    body: dict
+    expires_at: datetime
+
+
+def request_fingerprint(payment_request) -> str:
+    """Hash of the fields that define a charge; the full card number and CVV are left out."""
+    fields = {
+        "user_id": str(payment_request.user_id),
+        "amount": payment_request.amount,
+        "card_last_four": payment_request.card_number[-4:],
+        "card_holder": payment_request.card_holder,
+        "expiry_date": payment_request.expiry_date,
+    }
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class IdempotencyStore:
+    def __init__(
+        self,
+        ttl: int = PAYMENT_IDEMPOTENCY_TTL_SECONDS,
+        wait: float = PAYMENT_IDEMPOTENCY_WAIT_SECONDS,
+        cache_size: int = PAYMENT_IDEMPOTENCY_CACHE_SIZE,
+    ):
+        self.ttl = ttl
+        self.wait = wait
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, StoredResponse]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cached(self, key: str) -> Optional[StoredResponse]:
+        with self._lock:
+            stored = self._cache.get(key)
+            if stored is None:
+                return None
+            if stored.expires_at <= datetime.utcnow():
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+            return stored
+
+    def remember(self, key: str, stored: StoredResponse):
+        """Cache a committed response."""
+        if self.cache_size <= 0:
+            return
+        with self._lock:
+            self._cache[key] = stored
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    @staticmethod
+    def _check(stored: StoredResponse, fingerprint: str) -> StoredResponse:
+        if stored.fingerprint != fingerprint:
+            raise IdempotencyKeyMismatch()
+        return stored
+
+    def claim(self, db, key: str, fingerprint: str) -> Optional[StoredResponse]:
+        """Reserve ``key`` in the current transaction, or return the response to replay.
+
+        Returns None when the caller owns the key and must process the payment
+        and call complete() before committing.
+        """
+        stored = self._cached(key)
+        if stored is not None:
+            return self._check(stored, fingerprint)
+
+        # SET does not take bind parameters; the value is a float from config
+        db.execute(text(f"SET LOCAL lock_timeout = '{int(self.wait * 1000)}ms'"))
+        now = datetime.utcnow()
+        try:
+            values = dict(fingerprint=fingerprint, created_at=now, expires_at=now + timedelta(seconds=self.ttl))
+            # An expired key not purged yet is taken over as if it were new
+            claimed = db.execute(
+                pg_insert(IdempotencyKey)
+                .values(key=key, **values)
+                .on_conflict_do_update(
+                    index_elements=[IdempotencyKey.key],
+                    set_=dict(values, payment_id=None, response_status=None, response_body=None),
+                    where=IdempotencyKey.expires_at <= now,
+                )
+                .returning(IdempotencyKey.key)
+            ).scalar()
+        except DBAPIError as e:
+            # OperationalError from psycopg2; asyncpg surfaces lock timeouts as a plain DBAPIError
+            if getattr(e.orig, "pgcode", None) == LOCK_NOT_AVAILABLE:
+                db.rollback()
+                raise IdempotencyKeyInProgress() from e
+            raise
+        if claimed is not None:
+            return None
+
+        row = db.execute(select(IdempotencyKey).where(IdempotencyKey.key == key)).scalar_one()
+        stored = StoredResponse(row.fingerprint, row.response_status, row.response_body, row.expires_at)
+        db.rollback()
+        if stored.status_code != HTTPStatus.ACCEPTED:
+            self.remember(key, stored)
+        return self._check(stored, fingerprint)
+
+    def complete(self, db, key: str, status_code: int, body: dict, payment_id=None) -> StoredResponse:
+        """Record the response for ``key``; it becomes visible when the caller commits,
+        after which the caller passes the result to remember()."""
+        row = db.get(IdempotencyKey, key)
+        row.payment_id = payment_id
+        row.response_status = status_code
+        row.response_body = body
+        db.flush()
+        return StoredResponse(row.fingerprint, status_code, body, row.expires_at)
+
+
+class IdempotencyKeyPurger:
+    """Deletes expired keys in batches, claimed with SKIP LOCKED like the auth token purge."""
+
+    def __init__(
+        self,
+        interval: float = PAYMENT_IDEMPOTENCY_PURGE_INTERVAL_SECONDS,
+        batch_size: int = PAYMENT_IDEMPOTENCY_PURGE_BATCH_SIZE,
+    ):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def purge(self) -> int:
+        total = 0
+        now = datetime.utcnow()
+        db = SessionLocal()
+        try:
+            while not self._stop.is_set():
+                expired = (
+                    select(IdempotencyKey.key)
+                    .where(IdempotencyKey.expires_at < now)
+                    .limit(self.batch_size)
+                    .with_for_update(skip_locked=True)
+                    .scalar_subquery()
+                )
+                deleted = db.execute(delete(IdempotencyKey).where(IdempotencyKey.key.in_(expired))).rowcount
+                db.commit()
+                total += deleted
+                if deleted < self.batch_size:
+                    break
+        finally:
+            db.close()
+        return total
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                deleted = self.purge()
+                if deleted:
+                    logger.info("Purged %d expired idempotency keys", deleted)
+            except Exception:
+                logger.exception("Idempotency key purge failed")
+
+    def start(self):
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="idempotency-key-purge", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+idempotency_store = IdempotencyStore()
+idempotency_purger = IdempotencyKeyPurger()
@@ -1,7 +1,15 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from routers import payment_router
-from database import create_tables
+from routers import payment_router, payment_workers, token_verifier
+from database import dispose_engines, pool_monitor, warm_pool
+from idempotency import idempotency_purger
+from gateway import payment_gateway
+from shared.http_client import DeadlineMiddleware, ForwardAuthorizationMiddleware, close_clients
+from shared.admission import AdmissionMiddleware
+from shared.health import health_router, readiness
+from shared.metrics import MetricsMiddleware
+from shared.query_profiler import QueryProfilerMiddleware
+from shared.tracing import TracingMiddleware, tracing_router
 
 app = FastAPI(
     title="SaludYa Payment Service",
@@ -10,6 +18,7 @@ app = FastAPI(
     root_path="/api/payments"
 )
 
+app.add_middleware(AdmissionMiddleware, service="payment_service", routes=app.routes)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -17,12 +26,41 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(DeadlineMiddleware)
+app.add_middleware(ForwardAuthorizationMiddleware)
+app.add_middleware(QueryProfilerMiddleware, service="payment_service")
+app.add_middleware(TracingMiddleware, service="payment_service")
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(payment_router, tags=["Payments"])
+app.include_router(health_router)
+app.include_router(tracing_router)
 
 @app.on_event("startup")
 async def startup():
-    create_tables()
+    pool_monitor.check_budget()
+    await warm_pool()
+    token_verifier.start()
+    idempotency_purger.start()
+    payment_workers.start()
+    readiness.set_ready()
+
+@app.on_event("shutdown")
+async def shutdown():
+    readiness.set_not_ready()
+    token_verifier.stop()
+    idempotency_purger.stop()
+    payment_workers.stop()
+    payment_gateway.stop()
+    close_clients()
+    await dispose_engines()
+
+@app.get("/db/pool/stats")
+def db_pool_stats(cluster: bool = False):
+    stats = pool_monitor.stats()
+    if cluster:
+        stats["cluster"] = pool_monitor.cluster_budget()
+    return stats
 
 @app.get("/")
 def read_root():
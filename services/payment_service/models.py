@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Float, DateTime, Enum as SQLEnum
+from sqlalchemy import Column, String, Float, Date, DateTime, Index, Integer, JSON, Enum as SQLEnum, text
 from sqlalchemy.dialects.postgresql import UUID
 from database import Base
 import uuid
@@ -13,7 +13,13 @@ class PaymentStatus(enum.Enum):
 
 class Payment(Base):
     __tablename__ = "payments"
-    __table_args__ = {'schema': 'payment_service'}
+    __table_args__ = (
+        # Queue of payments waiting for the async workers
+        Index('idx_payments_pending', 'created_at', postgresql_where=text("status = 'PENDING'")),
+        # Payment history, newest first
+        Index('idx_payments_user_created', 'user_id', text('created_at DESC'), text('id DESC')),
+        {'schema': 'payment_service'},
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     user_id = Column(UUID(as_uuid=True), nullable=False, index=True)
@@ -22,5 +28,33 @@ class Payment(Base):
     card_type = Column(String, nullable=False)
     status = Column(String, default=PaymentStatus.PENDING.value)
     transaction_id = Column(String, nullable=False, unique=True)
+    # Gateway calls without a decision and when the async worker may retry (see payment_queue.py)
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class IdempotencyKey(Base):
+    """Response of a POST /payments/ call, replayed for retries with the same Idempotency-Key."""
+    __tablename__ = "idempotency_keys"
+    __table_args__ = {'schema': 'payment_service'}
+
+    key = Column(String(255), primary_key=True)
+    fingerprint = Column(String(64), nullable=False)
+    payment_id = Column(UUID(as_uuid=True), nullable=True)
+    response_status = Column(Integer, nullable=True)
+    response_body = Column(JSON, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+class UserDailySpend(Base):
+    """Completed payment totals per user and day, updated as payments complete."""
+    __tablename__ = "user_daily_spend"
+    __table_args__ = {'schema': 'payment_service'}
+
+    user_id = Column(UUID(as_uuid=True), primary_key=True)
+    day = Column(Date, primary_key=True)
+    total_amount = Column(Float, nullable=False, default=0)
+    payment_count = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,289 @@
+"""
+Queued payment authorisation.
+
+PAYMENT_PROCESSING_MODE=async: POST /payments/ stores the payment as PENDING
+and answers 202 right away; the payments table itself is the queue.
+PaymentWorkerPool runs PAYMENT_WORKERS threads that each claim the oldest due
+PENDING row with FOR UPDATE SKIP LOCKED, authorise it and commit COMPLETED or
+FAILED, so any number of replicas can drain the queue without double
+charging. The row lock is held for the gateway call: if a worker dies
+mid-call the row becomes claimable again.
+
+PAYMENT_PROCESSING_MODE=sync: POST /payments/ also commits the PENDING row
+before it calls the gateway, with next_attempt_at PAYMENT_CHARGE_LEASE_SECONDS
+ahead so no worker takes it while the request is still waiting for the
+decision. A single worker thread picks up what the requests leave behind:
+payments without a decision and payments whose request died mid-call.
+
+A GatewayError means the gateway gave no decision. The card may or may not
+have been charged, so the payment stays PENDING: its attempts counter goes
+up and next_attempt_at holds it back for an exponential backoff (capped at
+PAYMENT_RETRY_MAX_BACKOFF_SECONDS). Only after PAYMENT_MAX_ATTEMPTS calls
+without a decision is it marked FAILED. Every call carries the transaction
+id as Idempotency-Key, so the gateway settles a retry against the first
+charge instead of charging twice.
+
+Clients poll GET /{payment_id} or long-poll GET /{payment_id}/wait, which
+returns as soon as a local worker finishes the payment and re-reads the row
+every PAYMENT_LONG_POLL_RECHECK_SECONDS to notice payments finished by other
+replicas.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List
+from uuid import UUID
+
+from sqlalchemy import func, or_
+
+from database import SessionLocal
+from gateway import PAYMENT_GATEWAY_TIMEOUT_SECONDS, GatewayError
+from models import Payment, PaymentStatus
+from spend import record_completed
+
+logger = logging.getLogger(__name__)
+
+PAYMENT_PROCESSING_MODE = os.getenv("PAYMENT_PROCESSING_MODE", "sync")  # sync | async
+PAYMENT_WORKERS = int(os.getenv("PAYMENT_WORKERS", "8"))
+PAYMENT_WORKER_POLL_SECONDS = float(os.getenv("PAYMENT_WORKER_POLL_SECONDS", "1.0"))
+PAYMENT_MAX_ATTEMPTS = int(os.getenv("PAYMENT_MAX_ATTEMPTS", "5"))
+PAYMENT_RETRY_MAX_BACKOFF_SECONDS = float(os.getenv("PAYMENT_RETRY_MAX_BACKOFF_SECONDS", "60"))
+# How long a sync-mode request owns its PENDING payment before a worker may retry it
+PAYMENT_CHARGE_LEASE_SECONDS = float(
+    os.getenv("PAYMENT_CHARGE_LEASE_SECONDS", str(3 * PAYMENT_GATEWAY_TIMEOUT_SECONDS)))
+PAYMENT_LONG_POLL_MAX_SECONDS = float(os.getenv("PAYMENT_LONG_POLL_MAX_SECONDS", "30"))
+PAYMENT_LONG_POLL_RECHECK_SECONDS = float(os.getenv("PAYMENT_LONG_POLL_RECHECK_SECONDS", "1.0"))
+THROUGHPUT_WINDOW_SECONDS = 60.0
+
+
+def _percentiles(samples) -> dict:
+    samples = sorted(samples)
+    if not samples:
+        return {"p50_ms": None, "p99_ms": None}
+    return {
+        "p50_ms": round(samples[len(samples) // 2] * 1000, 3),
+        "p99_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000, 3),
+    }
+
+
+class PipelineMetrics:
+    def __init__(self, samples: int = 10000):
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self._finished_at = deque(maxlen=samples)
+        self._queue_wait = deque(maxlen=samples)
+        self._authorise = deque(maxlen=samples)
+
+    def record_submitted(self):
+        with self._lock:
+            self.submitted += 1
+
+    def record_retried(self):
+        with self._lock:
+            self.retried += 1
+
+    def record_finished(self, succeeded: bool, queue_wait: float, authorise: float):
+        with self._lock:
+            if succeeded:
+                self.completed += 1
+            else:
+                self.failed += 1
+            self._finished_at.append(time.monotonic())
+            self._queue_wait.append(queue_wait)
+            self._authorise.append(authorise)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            cutoff = time.monotonic() - THROUGHPUT_WINDOW_SECONDS
+            recent = sum(1 for finished in self._finished_at if finished >= cutoff)
+            return {
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "retried": self.retried,
+                "throughput_per_second": round(recent / THROUGHPUT_WINDOW_SECONDS, 3),
+                "queue_wait": _percentiles(self._queue_wait),
+                "authorise": _percentiles(self._authorise),
+            }
+
+
+class PaymentWaiters:
+    """Wakes long-polling requests when a worker of this process finishes their payment."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters: Dict[UUID, List[asyncio.Future]] = {}
+
+    async def wait(self, payment_id: UUID, timeout: float) -> bool:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            self._waiters.setdefault(payment_id, []).append(future)
+        try:
+            await asyncio.wait_for(future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self._lock:
+                futures = self._waiters.get(payment_id, [])
+                if future in futures:
+                    futures.remove(future)
+                if not futures:
+                    self._waiters.pop(payment_id, None)
+
+    def notify(self, payment_id: UUID):
+        with self._lock:
+            futures = self._waiters.pop(payment_id, [])
+        for future in futures:
+            future.get_loop().call_soon_threadsafe(_resolve, future)
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class PaymentWorkerPool:
+    def __init__(
+        self,
+        authorise: Callable[[Payment], bool],
+        workers: int = PAYMENT_WORKERS,
+        poll_interval: float = PAYMENT_WORKER_POLL_SECONDS,
+        max_attempts: int = PAYMENT_MAX_ATTEMPTS,
+        max_backoff: float = PAYMENT_RETRY_MAX_BACKOFF_SECONDS,
+        session_factory=SessionLocal,
+    ):
+        self.authorise = authorise
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.max_backoff = max_backoff
+        self.session_factory = session_factory
+        self.metrics = PipelineMetrics()
+        self.waiters = PaymentWaiters()
+        self.busy = 0
+        self._busy_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def _backoff(self, attempts: int) -> timedelta:
+        return timedelta(seconds=min(self.max_backoff, 2 ** attempts))
+
+    def retry_later(self, payment: Payment) -> bool:
+        """Count a gateway call without a decision; False once the payment is out of attempts."""
+        payment.attempts += 1
+        if payment.attempts >= self.max_attempts:
+            return False
+        payment.next_attempt_at = datetime.utcnow() + self._backoff(payment.attempts)
+        self.metrics.record_retried()
+        return True
+
+    def run_once(self) -> bool:
+        """Claim and authorise one due PENDING payment; False when none is due."""
+        db = self.session_factory()
+        try:
+            payment = (
+                db.query(Payment)
+                .filter(
+                    Payment.status == PaymentStatus.PENDING.value,
+                    or_(Payment.next_attempt_at.is_(None), Payment.next_attempt_at <= datetime.utcnow()),
+                )
+                .order_by(Payment.created_at)
+                .with_for_update(skip_locked=True)
+                .first()
+            )
+            if payment is None:
+                db.rollback()
+                return False
+            payment_id = payment.id
+            with self._busy_lock:
+                self.busy += 1
+            try:
+                queue_wait = max(0.0, (datetime.utcnow() - payment.created_at).total_seconds())
+                claimed = time.perf_counter()
+                try:
+                    succeeded = self.authorise(payment)
+                except GatewayError as e:
+                    # No decision, maybe a charge: keep it queued unless it has run out of attempts
+                    if self.retry_later(payment):
+                        db.commit()
+                        logger.warning(
+                            "No gateway decision for payment %s (attempt %d): %s", payment_id, payment.attempts, e)
+                        return True
+                    logger.error("No gateway decision for payment %s after %d attempts: %s", payment_id, payment.attempts, e)
+                    succeeded = False
+                except Exception:
+                    logger.exception("Authorisation of payment %s failed", payment.id)
+                    succeeded = False
+                authorise_seconds = time.perf_counter() - claimed
+                payment.status = PaymentStatus.COMPLETED.value if succeeded else PaymentStatus.FAILED.value
+                if succeeded:
+                    record_completed(db, payment.user_id, payment.amount)
+                db.commit()
+            finally:
+                with self._busy_lock:
+                    self.busy -= 1
+            self.metrics.record_finished(succeeded, queue_wait, authorise_seconds)
+            self.waiters.notify(payment_id)
+            return True
+        finally:
+            db.close()
+
+    def notify(self):
+        """Wake idle workers after a new PENDING payment was committed."""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self.run_once():
+                    continue
+            except Exception:
+                logger.exception("Payment worker failed")
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def queue_stats(self) -> dict:
+        db = self.session_factory()
+        try:
+            depth, oldest = db.query(func.count(Payment.id), func.min(Payment.created_at)).filter(
+                Payment.status == PaymentStatus.PENDING.value
+            ).one()
+        finally:
+            db.close()
+        stats = {
+            "mode": PAYMENT_PROCESSING_MODE,
+            "workers": len(self._threads),
+            "busy_workers": self.busy,
+            "queue_depth": depth,
+            "oldest_pending_seconds": round((datetime.utcnow() - oldest).total_seconds(), 3) if oldest else None,
+        }
+        stats.update(self.metrics.snapshot())
+        return stats
+
+    def start(self):
+        if self._threads:
+            return
+        self._stop.clear()
+        # In sync mode requests authorise their own payments; one thread retries the leftovers
+        workers = self.workers if PAYMENT_PROCESSING_MODE == "async" else 1
+        for number in range(workers):
+            thread = threading.Thread(target=self._run, name=f"payment-worker-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
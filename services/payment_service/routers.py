@@ -1,45 +1,96 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
+from sqlalchemy import tuple_
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
-from database import get_db
+from database import DbSession, SessionLocal, get_db, run_db
 from models import Payment, PaymentStatus
-from schemas import PaymentRequest, PaymentResponse
-from uuid import UUID
+from schemas import (
+    DailySpend,
+    PaymentHistoryResponse,
+    PaymentRequest,
+    PaymentResponse,
+    PaymentSummary,
+    SpendTotalsResponse,
+)
+from uuid import UUID, uuid4
+from datetime import date, datetime, timedelta
+from typing import List, Optional
+import asyncio
+import base64
 import secrets
-import random
-from service_clients import UserServiceClient
+from idempotency import (
+    MAX_KEY_LENGTH,
+    IdempotencyKeyInProgress,
+    IdempotencyKeyMismatch,
+    idempotency_store,
+    request_fingerprint,
+)
+from payment_queue import (
+    PAYMENT_CHARGE_LEASE_SECONDS,
+    PAYMENT_LONG_POLL_MAX_SECONDS,
+    PAYMENT_LONG_POLL_RECHECK_SECONDS,
+    PAYMENT_PROCESSING_MODE,
+    PaymentWorkerPool,
+)
+from gateway import AuthorisationRequest, GatewayError, payment_gateway
+from spend import record_completed, spend_by_day
+from card_bins import bin_table
+from shared.http_client import ServiceError, all_client_stats
+from shared.service_clients import UserServiceClient, upstream_error
+from shared.tokens import TokenVerifier
 
-payment_router = APIRouter()
+# Verifies signed access tokens locally, without calling Auth Service
+token_verifier = TokenVerifier.from_env()
+
+payment_router = APIRouter(dependencies=[Depends(token_verifier.dependency)])
+
+
+user_client = UserServiceClient()
 
 
 def get_user_client() -> UserServiceClient:
-    return UserServiceClient()
+    return user_client
 
 
 
 def detect_card_type(card_number: str) -> str:
-    first_digit = card_number[0]
-    if first_digit == '4':
-        return 'Visa'
-    elif first_digit == '5':
-        return 'Mastercard'
-    elif first_digit == '3':
-        return 'American Express'
-    else:
-        return 'Unknown'
+    return bin_table.network(card_number)
 
 
-def simulate_payment_processing() -> bool:
-    return random.random() > 0.05
+def _authorisation_request(payment: Payment) -> AuthorisationRequest:
+    return AuthorisationRequest(
+        reference=payment.transaction_id,
+        amount=payment.amount,
+        card_last_four=payment.card_last_four,
+        card_type=payment.card_type,
+    )
 
 
-@payment_router.post("/", response_model=PaymentResponse, status_code=status.HTTP_201_CREATED)
-def process_payment(
-    payment_request: PaymentRequest,
-    db: Session = Depends(get_db),
-    user_client: UserServiceClient = Depends(get_user_client)
-):
-    # Validate user exists via User Service API
-    if not user_client.user_exists(payment_request.user_id):
+def authorise_payment(payment: Payment) -> bool:
+    """Run the card through the configured gateway (PAYMENT_GATEWAY)."""
+    return payment_gateway.authorise(_authorisation_request(payment)).approved
+
+
+async def authorise_payment_async(request: AuthorisationRequest) -> bool:
+    return (await payment_gateway.authorise_async(request)).approved
+
+
+# Drains PENDING payments (in sync mode only those left without a decision); started from main.py
+payment_workers = PaymentWorkerPool(authorise=authorise_payment)
+
+
+PAYMENT_FAILED_DETAIL = "Payment processing failed. Please try again."
+
+
+async def _charge(payment_request: PaymentRequest, user_client: UserServiceClient) -> Payment:
+    """Validate the user and build the new, unsaved PENDING payment."""
+    # Validate user exists via User Service API; an unreachable User Service is a 503, not "not found"
+    try:
+        user_found = await user_client.auser_exists(payment_request.user_id)
+    except ServiceError as e:
+        raise upstream_error(e)
+    if not user_found:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="User not found. Please provide a valid user ID."
@@ -51,41 +102,226 @@ def process_payment(
 
     transaction_id = f"TXN-{secrets.token_hex(8).upper()}"
 
-    payment_successful = simulate_payment_processing()
-
     new_payment = Payment(
+        id=uuid4(),
         user_id=payment_request.user_id,
         amount=payment_request.amount,
         card_last_four=card_last_four,
         card_type=card_type,
         transaction_id=transaction_id,
-        status=PaymentStatus.COMPLETED.value if payment_successful else PaymentStatus.FAILED.value
+        status=PaymentStatus.PENDING.value
+    )
+    if PAYMENT_PROCESSING_MODE != "async":
+        # The request authorises it itself; workers keep off until the lease runs out
+        new_payment.next_attempt_at = datetime.utcnow() + timedelta(seconds=PAYMENT_CHARGE_LEASE_SECONDS)
+
+    return new_payment
+
+
+def _payment_response(payment: Payment, message: str) -> PaymentResponse:
+    return PaymentResponse(
+        id=payment.id,
+        user_id=payment.user_id,
+        amount=payment.amount,
+        card_last_four=payment.card_last_four,
+        card_type=payment.card_type,
+        status=payment.status,
+        transaction_id=payment.transaction_id,
+        created_at=payment.created_at,
+        message=message
     )
 
+
+def _replay(stored) -> JSONResponse:
+    return JSONResponse(status_code=stored.status_code, content=stored.body, headers={"Idempotent-Replayed": "true"})
+
+
+@payment_router.post("/", response_model=PaymentResponse, status_code=status.HTTP_201_CREATED)
+async def process_payment(
+    payment_request: PaymentRequest,
+    db: DbSession = Depends(get_db),
+    user_client: UserServiceClient = Depends(get_user_client),
+    idempotency_key: Optional[str] = Header(None, max_length=MAX_KEY_LENGTH),
+):
+    # Retries with the same Idempotency-Key get the first response instead of a second charge
+    if idempotency_key:
+        try:
+            stored = await run_db(db, idempotency_store.claim, idempotency_key, request_fingerprint(payment_request))
+        except IdempotencyKeyMismatch:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="Idempotency-Key was already used with a different payment request"
+            )
+        except IdempotencyKeyInProgress:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="A payment with this Idempotency-Key is still being processed",
+                headers={"Retry-After": "1"}
+            )
+        if stored is not None:
+            return _replay(stored)
+
+    new_payment = await _charge(payment_request, user_client)
+    payment_id, authorisation = new_payment.id, _authorisation_request(new_payment)
+    # Stored before the gateway call: a timeout may still have charged the card,
+    # and the transaction id is what lets a retry find that charge
+    status_code, body, stored = await run_db(db, _save_payment, new_payment, idempotency_key)
+    if PAYMENT_PROCESSING_MODE != "async":
+        try:
+            approved = await authorise_payment_async(authorisation)
+        except GatewayError:
+            approved = None
+        status_code, body, stored = await run_db(db, _settle_payment, payment_id, approved, idempotency_key)
+    if idempotency_key:
+        idempotency_store.remember(idempotency_key, stored)
+
+    if status_code == status.HTTP_202_ACCEPTED:
+        payment_workers.metrics.record_submitted()
+        payment_workers.notify()
+        # Poll GET /{id} or long-poll GET /{id}/wait for the outcome
+        return JSONResponse(status_code=status_code, content=body, headers={"Location": f"{body['id']}/wait"})
+
+    if status_code == status.HTTP_400_BAD_REQUEST:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=PAYMENT_FAILED_DETAIL
+        )
+
+    return body
+
+
+def _save_payment(db: Session, new_payment: Payment, idempotency_key: Optional[str]):
+    """Store the PENDING payment (and the 202 for its Idempotency-Key) and commit.
+
+    Returns (status_code, body, stored response or None).
+    """
     db.add(new_payment)
+    db.flush()
+    return _respond(db, new_payment, idempotency_key)
+
+
+def _settle_payment(db: Session, payment_id: UUID, approved: Optional[bool], idempotency_key: Optional[str]):
+    """Record the gateway's decision on a sync-mode payment; None leaves it PENDING for the workers."""
+    payment = db.query(Payment).filter(Payment.id == payment_id).with_for_update().one()
+    # A worker may have settled it already if the request outlived its lease
+    if payment.status == PaymentStatus.PENDING.value:
+        if approved is None:
+            if not payment_workers.retry_later(payment):
+                payment.status = PaymentStatus.FAILED.value
+        elif approved:
+            payment.status = PaymentStatus.COMPLETED.value
+            record_completed(db, payment.user_id, payment.amount)
+        else:
+            payment.status = PaymentStatus.FAILED.value
+    return _respond(db, payment, idempotency_key)
+
+
+def _respond(db: Session, payment: Payment, idempotency_key: Optional[str]):
+    """Build the response for ``payment``, record it for the Idempotency-Key and commit."""
+    if payment.status == PaymentStatus.PENDING.value:
+        status_code = status.HTTP_202_ACCEPTED
+        body = _payment_response(payment, "Payment accepted for processing").model_dump(mode="json")
+    elif payment.status == PaymentStatus.COMPLETED.value:
+        status_code = status.HTTP_201_CREATED
+        body = _payment_response(payment, "Payment processed successfully").model_dump(mode="json")
+    else:
+        status_code, body = status.HTTP_400_BAD_REQUEST, {"detail": PAYMENT_FAILED_DETAIL}
+
+    stored = None
+    if idempotency_key:
+        stored = idempotency_store.complete(db, idempotency_key, status_code, body, payment_id=payment.id)
     db.commit()
-    db.refresh(new_payment)
+    return status_code, body, stored
+
+PAYMENT_HISTORY_MAX_PAGE_SIZE = 100
 
-    if not payment_successful:
+
+def _encode_cursor(payment: Payment) -> str:
+    raw = f"{payment.created_at.isoformat()}|{payment.id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor: str):
+    try:
+        created_at, payment_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|")
+        return datetime.fromisoformat(created_at), UUID(payment_id)
+    except ValueError:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Payment processing failed. Please try again."
+            detail="Invalid cursor"
         )
 
-    return PaymentResponse(
-        id=new_payment.id,
-        user_id=new_payment.user_id,
-        amount=new_payment.amount,
-        card_last_four=new_payment.card_last_four,
-        card_type=new_payment.card_type,
-        status=new_payment.status,
-        transaction_id=new_payment.transaction_id,
-        created_at=new_payment.created_at,
-        message="Payment processed successfully"
+
+@payment_router.get("/user/{user_id}", response_model=PaymentHistoryResponse)
+async def get_user_payments(
+    user_id: UUID,
+    limit: int = Query(20, ge=1, le=PAYMENT_HISTORY_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    payment_status: Optional[List[PaymentStatus]] = Query(None, alias="status"),
+    db: DbSession = Depends(get_db),
+):
+    """Payments of a user, newest first. Filter with ?status=COMPLETED&status=FAILED."""
+    return await run_db(db, _get_user_payments, user_id, limit, cursor, payment_status)
+
+
+def _get_user_payments(
+    db: Session,
+    user_id: UUID,
+    limit: int,
+    cursor: Optional[str],
+    payment_status: Optional[List[PaymentStatus]],
+) -> PaymentHistoryResponse:
+    query = db.query(Payment).filter(Payment.user_id == user_id)
+    if payment_status:
+        query = query.filter(Payment.status.in_([s.value for s in payment_status]))
+    if cursor:
+        # Keyset pagination: continue strictly after the last row of the previous page
+        created_at, payment_id = _decode_cursor(cursor)
+        query = query.filter(tuple_(Payment.created_at, Payment.id) < tuple_(created_at, payment_id))
+    payments = query.order_by(Payment.created_at.desc(), Payment.id.desc()).limit(limit + 1).all()
+
+    next_cursor = _encode_cursor(payments[limit - 1]) if len(payments) > limit else None
+    return PaymentHistoryResponse(
+        user_id=user_id,
+        payments=[PaymentSummary.model_validate(payment) for payment in payments[:limit]],
+        next_cursor=next_cursor,
+    )
+
+
+@payment_router.get("/user/{user_id}/totals", response_model=SpendTotalsResponse)
+async def get_user_spend(
+    user_id: UUID,
+    start: Optional[date] = Query(None, alias="from"),
+    end: Optional[date] = Query(None, alias="to"),
+    db: DbSession = Depends(get_db),
+):
+    """Completed payment totals of a user, overall and per day, from the spend rollup."""
+    days = await run_db(db, spend_by_day, user_id, start, end)
+    return SpendTotalsResponse(
+        user_id=user_id,
+        total_amount=sum(day.total_amount for day in days),
+        payment_count=sum(day.payment_count for day in days),
+        days=[DailySpend.model_validate(day) for day in days],
     )
 
+
+@payment_router.get("/queue/stats")
+def payment_queue_stats():
+    """Queue depth, worker utilisation, throughput and latency of the async pipeline."""
+    return payment_workers.queue_stats()
+
+
+@payment_router.get("/clients/stats")
+def service_client_stats():
+    """Latency, retries, hedges and circuit state of the calls to other services."""
+    return all_client_stats()
+
 @payment_router.get("/{payment_id}", response_model=PaymentResponse)
-def get_payment(payment_id: UUID, db: Session = Depends(get_db)):
+async def get_payment(payment_id: UUID, db: DbSession = Depends(get_db)):
+    return await run_db(db, _get_payment, payment_id)
+
+
+def _get_payment(db: Session, payment_id: UUID) -> PaymentResponse:
     payment = db.query(Payment).filter(Payment.id == payment_id).first()
 
     if not payment:
@@ -94,14 +330,31 @@ def get_payment(payment_id: UUID, db: Session = Depends(get_db)):
             detail="Payment not found"
         )
 
-    return PaymentResponse(
-        id=payment.id,
-        user_id=payment.user_id,
-        amount=payment.amount,
-        card_last_four=payment.card_last_four,
-        card_type=payment.card_type,
-        status=payment.status.value,
-        transaction_id=payment.transaction_id,
-        created_at=payment.created_at,
-        message="Payment retrieved successfully"
-    )
+    return _payment_response(payment, "Payment retrieved successfully")
+
+
+def _load_payment(payment_id: UUID) -> Optional[Payment]:
+    with SessionLocal() as db:
+        return db.query(Payment).filter(Payment.id == payment_id).first()
+
+
+@payment_router.get("/{payment_id}/wait", response_model=PaymentResponse)
+async def wait_for_payment(
+    payment_id: UUID,
+    timeout: float = Query(PAYMENT_LONG_POLL_MAX_SECONDS, gt=0, le=PAYMENT_LONG_POLL_MAX_SECONDS),
+):
+    """Long-poll: answers once the payment leaves PENDING, or with its current state after ``timeout`` seconds."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        payment = await run_in_threadpool(_load_payment, payment_id)
+        if not payment:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Payment not found"
+            )
+        remaining = deadline - loop.time()
+        if payment.status != PaymentStatus.PENDING.value or remaining <= 0:
+            return _payment_response(payment, "Payment retrieved successfully")
+        # Woken early by a local worker; the periodic re-read covers other replicas
+        await payment_workers.waiters.wait(payment_id, min(remaining, PAYMENT_LONG_POLL_RECHECK_SECONDS))
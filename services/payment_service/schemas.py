@@ -1,8 +1,9 @@
 from pydantic import BaseModel, validator
-from datetime import datetime
+from datetime import date, datetime
 from uuid import UUID
-from typing import Optional
+from typing import List, Optional
 import re
+from card_bins import bin_table, luhn_valid
 
 class PaymentRequest(BaseModel):
     user_id: UUID
@@ -15,19 +16,24 @@ class PaymentRequest(BaseModel):
     @validator('card_number')
     def validate_card_number(cls, v):
         v = v.replace(' ', '').replace('-', '')
-        if not v.isdigit() or len(v) != 16:
+        # Runs before the user lookup, so mistyped numbers never reach the gateway
+        # ASCII digits only: str.isdigit() also accepts other scripts' digits
+        if not re.fullmatch(r'[0-9]{12,19}', v) or not luhn_valid(v):
             raise ValueError('Invalid card number')
+        card_range = bin_table.lookup(v)
+        if card_range is not None and len(v) not in card_range.lengths:
+            raise ValueError(f'Invalid card number length for {card_range.network}')
         return v
 
     @validator('cvv')
     def validate_cvv(cls, v):
-        if not v.isdigit() or len(v) not in [3, 4]:
+        if not re.fullmatch(r'[0-9]{3,4}', v):
             raise ValueError('Invalid CVV')
         return v
 
     @validator('expiry_date')
     def validate_expiry(cls, v):
-        if not re.match(r'^\d{2}/\d{2}$', v):
+        if not re.fullmatch(r'[0-9]{2}/[0-9]{2}', v):
             raise ValueError('Invalid expiry date format. Use MM/YY')
         return v
 
@@ -44,3 +50,34 @@ class PaymentResponse(BaseModel):
 
     class Config:
         from_attributes = True
+
+class PaymentSummary(BaseModel):
+    id: UUID
+    amount: float
+    card_last_four: str
+    card_type: str
+    status: str
+    transaction_id: str
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+class PaymentHistoryResponse(BaseModel):
+    user_id: UUID
+    payments: List[PaymentSummary]
+    next_cursor: Optional[str] = None  # pass as ?cursor= to get the next page
+
+class DailySpend(BaseModel):
+    day: date
+    total_amount: float
+    payment_count: int
+
+    class Config:
+        from_attributes = True
+
+class SpendTotalsResponse(BaseModel):
+    user_id: UUID
+    total_amount: float
+    payment_count: int
+    days: List[DailySpend]
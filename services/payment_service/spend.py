@@ -0,0 +1,38 @@
+"""
+Per-user spend rollup.
+
+Every payment that reaches COMPLETED adds its amount to the user's row for
+that (UTC) day in user_daily_spend, inside the transaction that completes it,
+so totals are read from at most one row per day instead of scanning payments.
+"""
+from datetime import date, datetime
+from typing import Optional
+from uuid import UUID
+
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from models import UserDailySpend
+
+
+def record_completed(db: Session, user_id: UUID, amount: float, completed_at: Optional[datetime] = None):
+    """Add a completed payment to the rollup; the caller commits."""
+    day = (completed_at or datetime.utcnow()).date()
+    statement = pg_insert(UserDailySpend).values(user_id=user_id, day=day, total_amount=amount, payment_count=1)
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[UserDailySpend.user_id, UserDailySpend.day],
+        set_={
+            "total_amount": UserDailySpend.total_amount + statement.excluded.total_amount,
+            "payment_count": UserDailySpend.payment_count + 1,
+        },
+    ))
+
+
+def spend_by_day(db: Session, user_id: UUID, start: Optional[date] = None, end: Optional[date] = None):
+    """Rollup rows for ``user_id`` between ``start`` and ``end`` (inclusive), newest first."""
+    query = db.query(UserDailySpend).filter(UserDailySpend.user_id == user_id)
+    if start is not None:
+        query = query.filter(UserDailySpend.day >= start)
+    if end is not None:
+        query = query.filter(UserDailySpend.day <= end)
+    return query.order_by(UserDailySpend.day.desc()).all()
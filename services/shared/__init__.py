@@ -0,0 +1,7 @@
+"""
+Code shared by the SaludYa services.
+
+Each service runs with the ``services`` directory on its import path
+(see the Dockerfiles and start_all_services.sh), so modules here are
+imported as ``shared.<module>``.
+"""
@@ -0,0 +1,251 @@
+"""
+Admission control: per-route concurrency limits, priorities and load shedding.
+
+Without it, a slow dependency takes over the service. When Groq slows down,
+/orient requests hold the request threadpool (40 threads, shared by every
+sync handler and by run_in_threadpool) and cheap reads start timing out
+behind them. AdmissionMiddleware decides before a request reaches its
+handler:
+
+* Routes with a RouteLimit ("POST /orient", "POST /login", ...) may run at
+  most ``concurrency`` requests at once. At most ``queue`` more wait, for at
+  most ADMISSION_QUEUE_TIMEOUT_MS. Anything beyond is answered 503 at once,
+  with Retry-After, so the client backs off instead of piling up.
+* Every request then takes a slot of the process-wide gate,
+  ADMISSION_MAX_CONCURRENCY slots (default 40, the threadpool's size) with
+  at most ADMISSION_MAX_QUEUE waiting. A freed slot goes to the waiter of
+  the best class, then the oldest: reads (GET, HEAD), then writes, then the
+  limited routes. So a backlog of expensive calls never delays a catalog
+  read, and the threadpool's own queue, which is first come first served,
+  stays short.
+* /health/... and /traces/... bypass both, so probes keep answering under
+  overload.
+* In monolith mode, a call from one service to another in the same process
+  (shared.http_client.serve_in_process) skips the gate: the request that
+  makes it already holds a slot, and waiting for a second one would
+  deadlock once every slot is held by such a request.
+
+A queued request never waits longer than its caller's remaining budget
+(DEADLINE_HEADER, see shared.http_client). Rejections and waits are
+exported as
+
+    admission_rejected_total{method,route,reason}     reason: queue_full | timeout
+    admission_queue_seconds{method,route}             (histogram, admitted requests)
+    admission_in_flight{service,limiter} / admission_waiting{service,limiter}
+
+and the wait is a span of the request's trace. A rejected request keeps
+its route template, so it shows up as a 503 of that route in
+http_requests_total.
+
+Each service passes its defaults to the middleware in main.py.
+ADMISSION_ROUTES overrides or adds limits, e.g. "POST /orient=4:8,GET
+/doctors=20:40" (concurrency:queue). In monolith mode the gate is shared
+by all six services, like the threadpool. ADMISSION_ENABLED=false turns
+the middleware into a pass-through.
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from starlette.responses import JSONResponse
+from starlette.routing import Match
+
+from shared.http_client import IN_PROCESS_SCOPE_KEY, remaining_budget
+from shared.metrics import registry
+from shared.tracing import record_span
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "40"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "100"))
+ADMISSION_QUEUE_TIMEOUT_MS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_MS", "1000"))
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "1"))
+ADMISSION_ROUTES = os.getenv("ADMISSION_ROUTES", "")
+
+# Priority classes, best first; CRITICAL bypasses admission
+CRITICAL, READ, WRITE, EXPENSIVE = 0, 1, 2, 3
+READ_METHODS = {"GET", "HEAD", "OPTIONS"}
+BYPASS_PREFIXES = ("/health/", "/traces/")
+
+REJECTED = registry.counter(
+    "admission_rejected_total", "Requests answered 503 by admission control.", ("method", "route", "reason"))
+QUEUE_SECONDS = registry.histogram(
+    "admission_queue_seconds", "Time admitted requests waited for a slot.", ("method", "route"),
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+
+
+class RouteLimit:
+    """At most ``concurrency`` requests of a route at once and ``queue`` waiting."""
+
+    def __init__(self, concurrency: int, queue: int, priority: int = EXPENSIVE):
+        self.concurrency = concurrency
+        self.queue = queue
+        self.priority = priority
+
+
+def parse_routes(value: str) -> Dict[str, RouteLimit]:
+    """"POST /orient=4:8,POST /login=8:16" -> {"POST /orient": RouteLimit(4, 8), ...}"""
+    limits = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        key, _, numbers = item.rpartition("=")
+        concurrency, _, queue = numbers.partition(":")
+        limits[" ".join(key.split())] = RouteLimit(int(concurrency), int(queue or 0))
+    return limits
+
+
+class Rejected(Exception):
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class Limiter:
+    """A concurrency limit with a bounded queue; a freed slot goes to the best priority, then the oldest waiter.
+
+    Used from the event loop only, so it needs no lock.
+    """
+
+    def __init__(self, name: str, limit: int, max_queue: int):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.active = 0
+        self.waiting = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._order = itertools.count()
+
+    async def acquire(self, priority: int, timeout: float):
+        """Take a slot, waiting at most ``timeout`` seconds; raises Rejected."""
+        if self.active < self.limit and not self.waiting:
+            self.active += 1
+            return
+        if self.waiting >= self.max_queue:
+            raise Rejected("queue_full")
+        if timeout <= 0:
+            raise Rejected("timeout")
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._order), future))
+        self.waiting += 1
+        try:
+            # release() hands the slot over by resolving the future; active stays the same
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                return  # handed a slot just as the wait ran out
+            raise Rejected("timeout")
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+        finally:
+            self.waiting -= 1
+
+    def release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+
+# One gate per process: the threadpool it protects is per process too
+gate = Limiter("global", ADMISSION_MAX_CONCURRENCY, ADMISSION_MAX_QUEUE)
+_route_limiters: List[Tuple[str, Limiter]] = []
+
+
+def _collect_limiters():
+    limiters = [("all", gate)] + _route_limiters
+    in_flight = [(("service", "limiter"), (service, limiter.name), limiter.active) for service, limiter in limiters]
+    waiting = [(("service", "limiter"), (service, limiter.name), limiter.waiting) for service, limiter in limiters]
+    yield "admission_in_flight", "gauge", "Requests holding an admission slot.", in_flight
+    yield "admission_waiting", "gauge", "Requests queued for an admission slot.", waiting
+
+
+registry.add_collector(_collect_limiters)
+
+
+class AdmissionMiddleware:
+    """Limit, prioritise and shed requests per route before they reach their handler."""
+
+    def __init__(self, app, service: str, routes: Sequence, limits: Optional[Dict[str, RouteLimit]] = None,
+                 enabled: bool = ADMISSION_ENABLED, queue_timeout: float = ADMISSION_QUEUE_TIMEOUT_MS / 1000,
+                 retry_after: int = ADMISSION_RETRY_AFTER):
+        self.app = app
+        self.service = service
+        # The app's route list: routes included after the middleware was added still show up
+        self.routes = routes
+        self.enabled = enabled
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.limiters: Dict[str, Tuple[Limiter, RouteLimit]] = {}
+        for key, limit in dict(limits or {}, **parse_routes(ADMISSION_ROUTES)).items():
+            limiter = Limiter(key, limit.concurrency, limit.queue)
+            self.limiters[key] = (limiter, limit)
+            _route_limiters.append((service, limiter))
+
+    def _match(self, scope):
+        for route in self.routes:
+            match, child_scope = route.matches(scope)
+            if match == Match.FULL:
+                return route
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if not self.enabled or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        route = self._match(scope)
+        template = getattr(route, "path", None)
+        if template is not None and template.startswith(BYPASS_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route_limit = self.limiters.get(f"{method} {template}")
+        if route_limit is not None:
+            priority = route_limit[1].priority
+        else:
+            priority = READ if method in READ_METHODS else WRITE
+        timeout = self.queue_timeout
+        budget = remaining_budget()
+        if budget is not None:
+            timeout = min(timeout, budget)
+
+        started = time.perf_counter()
+        held: List[Limiter] = []
+        try:
+            # The route's own limit first, so its backlog waits there and not in the shared gate
+            if route_limit is not None:
+                await route_limit[0].acquire(priority, timeout)
+                held.append(route_limit[0])
+            if not scope.get(IN_PROCESS_SCOPE_KEY):
+                await gate.acquire(priority, timeout - (time.perf_counter() - started))
+                held.append(gate)
+        except Rejected as e:
+            for limiter in held:
+                limiter.release()
+            label = template or "unmatched"
+            REJECTED.inc((method, label, e.reason))
+            if route is not None:
+                # So metrics and tracing file the 503 under the route
+                scope["route"] = route
+            response = JSONResponse(
+                {"detail": "Service is overloaded, please retry later"},
+                status_code=503,
+                headers={"Retry-After": str(self.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+
+        waited = time.perf_counter() - started
+        QUEUE_SECONDS.observe((method, template or "unmatched"), waited)
+        if waited >= 0.0005:
+            record_span("admission queue", waited)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            for limiter in reversed(held):
+                limiter.release()
@@ -0,0 +1,740 @@
+"""
+Caching with one interface and pluggable backends.
+
+A Cache is a namespace ("catalog", "orientation", ...) over a backend.
+Callers use get_or_load (sync code) or aget_or_load (handlers); on a miss
+the loader runs and its value is stored with a TTL and optional tags:
+
+    catalog_cache = Cache("catalog", build_backend(engine), ttl=300)
+    body = await catalog_cache.aget_or_load("specialties", load, tags=("catalog",))
+
+Backends (CACHE_BACKEND):
+
+* ``memory``: per-process LRU with TTL, MemoryBackend. The default.
+* ``postgres``: entries in the UNLOGGED table public.cache_entries
+  (migration 017), shared by every replica, PostgresBackend. One round trip
+  per lookup, made on the threadpool by aget_or_load.
+* ``near``: a short-lived MemoryBackend (CACHE_NEAR_TTL_SECONDS) in front
+  of the Postgres table, NearCacheBackend. Hits stay in process; a miss
+  reads the table before the loader runs. Deletes and tag invalidations are
+  published with pg_notify on CACHE_CHANNEL, and every replica's listener
+  drops them from its own memory tier (a dropped LISTEN connection clears
+  it, as for the profile cache).
+* ``off``: no caching, the loader always runs.
+
+Values are encoded with msgpack in every backend, so a value comes back the
+same whichever backend is configured (tuples come back as lists) and a
+cached value cannot be changed by the caller that loaded it. Store
+primitives, lists, dicts and bytes: a JSON response body is the usual
+value.
+
+Stampedes are handled twice. Concurrent misses of a key are coalesced: one
+caller runs the loader, the others wait for its result (at most
+CACHE_COALESCE_TIMEOUT_SECONDS, then they load themselves). And entries are
+refreshed early with probability rising towards expiry (XFetch, beta
+CACHE_EARLY_REFRESH_BETA; each entry remembers how long its load took), so
+a popular key is reloaded by one request before it expires instead of by
+all of them after. While that refresh runs, other callers get the current
+value.
+
+A load that overlapped a delete or invalidation of this process is not
+stored. A failing shared store is a miss, never an error: lookups and
+writes are logged and counted in cache_backend_errors_total.
+
+Metrics, per namespace:
+
+    cache_requests_total{namespace,result}     hit | miss | refresh | coalesced
+    cache_load_seconds{namespace,outcome}      (histogram) ok | error
+    cache_invalidations_total{namespace,kind}  key | tag
+    cache_entries{namespace,tier} / cache_evictions_total{namespace,tier}
+
+    python -m shared.cache --tag catalog [--key catalog:specialties]
+
+deletes entries from the Postgres table and notifies the near caches, e.g.
+after the catalog was edited by hand. Memory-only caches keep them until
+their TTL.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import select
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import msgpack
+from fastapi.concurrency import run_in_threadpool
+
+from shared.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")  # memory | postgres | near | off
+CACHE_MEMORY_MAX_ENTRIES = int(os.getenv("CACHE_MEMORY_MAX_ENTRIES", "10000"))
+CACHE_NEAR_TTL_SECONDS = float(os.getenv("CACHE_NEAR_TTL_SECONDS", "30"))
+CACHE_EARLY_REFRESH_BETA = float(os.getenv("CACHE_EARLY_REFRESH_BETA", "1.0"))
+CACHE_COALESCE_TIMEOUT_SECONDS = float(os.getenv("CACHE_COALESCE_TIMEOUT_SECONDS", "10"))
+CACHE_PURGE_INTERVAL_SECONDS = float(os.getenv("CACHE_PURGE_INTERVAL_SECONDS", "60"))
+CACHE_CHANNEL = "cache_invalidated"
+
+REQUESTS = registry.counter(
+    "cache_requests_total", "Cache lookups by namespace and result.", ("namespace", "result"))
+LOAD_SECONDS = registry.histogram(
+    "cache_load_seconds", "Time spent in loaders after a miss or an early refresh.", ("namespace", "outcome"))
+INVALIDATIONS = registry.counter(
+    "cache_invalidations_total", "Cache deletes and tag invalidations.", ("namespace", "kind"))
+BACKEND_ERRORS = registry.counter(
+    "cache_backend_errors_total", "Failed operations on the shared cache store.", ("operation",))
+
+
+class Entry(NamedTuple):
+    value: bytes
+    expires_at: float  # time.time(), so replicas agree on it
+    load_seconds: float  # how long the load took, for the early refresh
+    tags: Tuple[str, ...]
+
+
+class CacheBackend:
+    """Stores encoded entries by key. ``remote`` backends do I/O and are called on the threadpool."""
+
+    name = "none"
+    remote = False
+    # False for CACHE_BACKEND=off: loaders always run, not even coalesced
+    enabled = False
+
+    def __init__(self):
+        # Bumped by every delete, invalidation and clear of this process
+        self.generation = 0
+
+    def get(self, key: str) -> Optional[Entry]:
+        return None
+
+    def get_local(self, key: str) -> Optional[Entry]:
+        """What can be answered without I/O."""
+        return None if self.remote else self.get(key)
+
+    def set(self, key: str, entry: Entry, generation: Optional[int] = None):
+        pass
+
+    def delete(self, keys: Sequence[str]):
+        self.generation += 1
+
+    def invalidate_tags(self, tags: Sequence[str]):
+        self.generation += 1
+
+    def clear(self):
+        self.generation += 1
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    @property
+    def memory_tier(self) -> Optional["MemoryBackend"]:
+        return None
+
+    def stats(self) -> dict:
+        return {"backend": self.name}
+
+
+class MemoryBackend(CacheBackend):
+    """LRU bounded by ``max_entries``; ``max_ttl`` caps how long an entry stays, whatever its own TTL."""
+
+    name = "memory"
+    enabled = True
+
+    def __init__(self, max_entries: int = CACHE_MEMORY_MAX_ENTRIES, max_ttl: Optional[float] = None,
+                 name: str = "memory"):
+        super().__init__()
+        self.name = name
+        self.max_entries = max_entries
+        self.max_ttl = max_ttl
+        # key -> (entry, time.time() after which this copy is dropped)
+        self._entries: "OrderedDict[str, Tuple[Entry, float]]" = OrderedDict()
+        self._tags: Dict[str, set] = {}
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    @property
+    def memory_tier(self) -> "MemoryBackend":
+        return self
+
+    def get(self, key: str) -> Optional[Entry]:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            if time.time() >= item[1]:
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return item[0]
+
+    def set(self, key: str, entry: Entry, generation: Optional[int] = None):
+        if self.max_entries <= 0:
+            return
+        deadline = entry.expires_at if self.max_ttl is None else min(entry.expires_at, time.time() + self.max_ttl)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (entry, deadline)
+            for tag in entry.tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key: str):
+        entry, _ = self._entries.pop(key)
+        for tag in entry.tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def delete(self, keys: Sequence[str]):
+        with self._lock:
+            self.generation += 1
+            for key in keys:
+                if key in self._entries:
+                    self._remove(key)
+
+    def invalidate_tags(self, tags: Sequence[str]):
+        with self._lock:
+            self.generation += 1
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._tags.clear()
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.name,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "evictions": self.evictions,
+        }
+
+
+class PostgresBackend(CacheBackend):
+    """Entries in public.cache_entries, shared by every replica; deletes are also published on CACHE_CHANNEL."""
+
+    name = "postgres"
+    enabled = True
+    remote = True
+
+    def __init__(self, engine, channel: str = CACHE_CHANNEL, purge_interval: float = CACHE_PURGE_INTERVAL_SECONDS,
+                 strict: bool = False):
+        super().__init__()
+        self.engine = engine
+        # Raise failed deletes instead of logging them (the invalidation command does)
+        self.strict = strict
+        self.channel = channel
+        self.purge_interval = purge_interval
+        self._next_purge = time.monotonic() + purge_interval
+
+    def get(self, key: str) -> Optional[Entry]:
+        try:
+            with self.engine.connect() as connection:
+                row = connection.exec_driver_sql(
+                    "SELECT value, expires_at, load_seconds, tags FROM public.cache_entries "
+                    "WHERE key = %s AND expires_at > %s",
+                    (key, time.time()),
+                ).first()
+        except Exception:
+            logger.exception("Cache lookup of %s failed", key)
+            BACKEND_ERRORS.inc(("get",))
+            return None
+        if row is None:
+            return None
+        return Entry(bytes(row[0]), row[1], row[2], tuple(row[3]))
+
+    def set(self, key: str, entry: Entry, generation: Optional[int] = None):
+        if generation is not None and generation != self.generation:
+            return
+        try:
+            with self.engine.begin() as connection:
+                connection.exec_driver_sql(
+                    "INSERT INTO public.cache_entries (key, value, expires_at, load_seconds, tags) "
+                    "VALUES (%s, %s, %s, %s, %s) ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value, "
+                    "expires_at = EXCLUDED.expires_at, load_seconds = EXCLUDED.load_seconds, tags = EXCLUDED.tags",
+                    (key, entry.value, entry.expires_at, entry.load_seconds, list(entry.tags)),
+                )
+                if time.monotonic() >= self._next_purge:
+                    self._next_purge = time.monotonic() + self.purge_interval
+                    connection.exec_driver_sql(
+                        "DELETE FROM public.cache_entries WHERE expires_at <= %s", (time.time(),))
+        except Exception:
+            logger.exception("Cache write of %s failed", key)
+            BACKEND_ERRORS.inc(("set",))
+
+    def _delete_where(self, operation: str, condition: str, values: List[str], payload: dict):
+        self.generation += 1
+        try:
+            with self.engine.begin() as connection:
+                connection.exec_driver_sql(f"DELETE FROM public.cache_entries WHERE {condition}", (values,))
+                # Delivered on commit, after the rows are gone
+                connection.exec_driver_sql("SELECT pg_notify(%s, %s)", (self.channel, json.dumps(payload)))
+        except Exception:
+            if self.strict:
+                raise
+            logger.exception("Cache %s of %s failed", operation, values)
+            BACKEND_ERRORS.inc((operation,))
+
+    def delete(self, keys: Sequence[str]):
+        self._delete_where("delete", "key = ANY(%s)", list(keys), {"keys": list(keys)})
+
+    def invalidate_tags(self, tags: Sequence[str]):
+        self._delete_where("invalidate", "tags && %s::text[]", list(tags), {"tags": list(tags)})
+
+    def clear(self):
+        self.generation += 1
+        with self.engine.begin() as connection:
+            connection.exec_driver_sql("TRUNCATE public.cache_entries")
+            connection.exec_driver_sql("SELECT pg_notify(%s, %s)", (self.channel, json.dumps({"clear": True})))
+
+
+class NearCacheBackend(CacheBackend):
+    """A memory tier in front of a shared backend, kept coherent by CacheInvalidationListener."""
+
+    name = "near"
+    enabled = True
+    remote = True
+
+    def __init__(self, local: MemoryBackend, shared: PostgresBackend):
+        super().__init__()
+        self.local = local
+        self.shared = shared
+        self.listener = CacheInvalidationListener(local, shared.engine, shared.channel)
+        self.shared_hits = 0
+
+    @property
+    def generation(self) -> int:
+        return self.local.generation
+
+    @generation.setter
+    def generation(self, value: int):
+        pass  # the memory tier's counter is the one that matters
+
+    def get(self, key: str) -> Optional[Entry]:
+        entry = self.local.get(key)
+        if entry is not None:
+            return entry
+        generation = self.local.generation
+        entry = self.shared.get(key)
+        if entry is not None:
+            self.shared_hits += 1
+            self.local.set(key, entry, generation)
+        return entry
+
+    def get_local(self, key: str) -> Optional[Entry]:
+        return self.local.get(key)
+
+    @property
+    def memory_tier(self) -> MemoryBackend:
+        return self.local
+
+    def set(self, key: str, entry: Entry, generation: Optional[int] = None):
+        if generation is not None and generation != self.local.generation:
+            return
+        self.local.set(key, entry, generation)
+        self.shared.set(key, entry)
+
+    def delete(self, keys: Sequence[str]):
+        self.local.delete(keys)
+        self.shared.delete(keys)
+
+    def invalidate_tags(self, tags: Sequence[str]):
+        self.local.invalidate_tags(tags)
+        self.shared.invalidate_tags(tags)
+
+    def clear(self):
+        self.local.clear()
+        self.shared.clear()
+
+    def start(self):
+        self.listener.start()
+
+    def stop(self):
+        self.listener.stop()
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "local": self.local.stats(), "shared_hits": self.shared_hits}
+
+
+class CacheInvalidationListener:
+    """LISTENs on CACHE_CHANNEL and applies other replicas' deletes and invalidations to a memory tier."""
+
+    def __init__(self, local: MemoryBackend, engine, channel: str = CACHE_CHANNEL, reconnect_delay: float = 5.0):
+        self.local = local
+        self.engine = engine
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _connect(self):
+        connection = self.engine.raw_connection()
+        dbapi_connection = connection.driver_connection
+        # Keep the LISTEN session out of the request pool
+        connection.detach()
+        dbapi_connection.autocommit = True
+        with dbapi_connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {self.channel}")
+        return dbapi_connection
+
+    def apply(self, payload: str):
+        message = json.loads(payload)
+        if message.get("clear"):
+            self.local.clear()
+        if message.get("keys"):
+            self.local.delete(message["keys"])
+        if message.get("tags"):
+            self.local.invalidate_tags(message["tags"])
+
+    def _listen(self, dbapi_connection):
+        while not self._stop.is_set():
+            if select.select([dbapi_connection], [], [], 1.0)[0]:
+                dbapi_connection.poll()
+                while dbapi_connection.notifies:
+                    notify = dbapi_connection.notifies.pop(0)
+                    try:
+                        self.apply(notify.payload)
+                    except (ValueError, AttributeError):
+                        logger.warning("Ignoring cache invalidation %r", notify.payload)
+
+    def _run(self):
+        while not self._stop.is_set():
+            dbapi_connection = None
+            try:
+                dbapi_connection = self._connect()
+                # Anything invalidated while we were not listening is unknown
+                self.local.clear()
+                self._listen(dbapi_connection)
+            except Exception:
+                logger.exception("Cache invalidation listener failed; reconnecting")
+                self.local.clear()
+                self._stop.wait(self.reconnect_delay)
+            finally:
+                if dbapi_connection is not None:
+                    try:
+                        dbapi_connection.close()
+                    except Exception:
+                        pass
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="cache-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+def build_backend(engine=None, kind: str = CACHE_BACKEND) -> CacheBackend:
+    """The backend CACHE_BACKEND asks for; ``engine`` (the service's sync engine) is needed by postgres and near."""
+    if kind == "off":
+        return CacheBackend()
+    if kind == "memory":
+        return MemoryBackend()
+    if engine is None:
+        raise ValueError(f"CACHE_BACKEND={kind} needs a database engine")
+    if kind == "postgres":
+        return PostgresBackend(engine)
+    if kind == "near":
+        return NearCacheBackend(MemoryBackend(max_ttl=CACHE_NEAR_TTL_SECONDS, name="near"), PostgresBackend(engine))
+    raise ValueError(f"Unknown CACHE_BACKEND {kind!r}")
+
+
+def encode(value: Any) -> bytes:
+    return msgpack.packb(value, use_bin_type=True)
+
+
+def decode(data: bytes) -> Any:
+    return msgpack.unpackb(data, raw=False)
+
+
+class _Call:
+    """A load in progress in sync code, which other threads wait for."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.data: Optional[bytes] = None
+        self.error: Optional[BaseException] = None
+
+
+class Cache:
+    """A namespace of keys in a backend, with coalesced loads and early refresh."""
+
+    def __init__(self, namespace: str, backend: CacheBackend, ttl: float,
+                 beta: float = CACHE_EARLY_REFRESH_BETA, coalesce_timeout: float = CACHE_COALESCE_TIMEOUT_SECONDS):
+        self.namespace = namespace
+        self.backend = backend
+        self.ttl = ttl
+        self.beta = beta
+        self.coalesce_timeout = coalesce_timeout
+        self.counts = {"hit": 0, "miss": 0, "refresh": 0, "coalesced": 0}
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self._async_calls: Dict[str, asyncio.Future] = {}
+        _caches.append(self)
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    def _count(self, result: str):
+        self.counts[result] += 1
+        REQUESTS.inc((self.namespace, result))
+
+    def _refresh_early(self, entry: Entry) -> bool:
+        """XFetch: true with a probability that grows as expiry nears, sooner for slow loads."""
+        if self.beta <= 0:
+            return False
+        return time.time() - entry.load_seconds * self.beta * math.log(1.0 - random.random()) >= entry.expires_at
+
+    def _entry(self, data: bytes, ttl: Optional[float], tags: Iterable[str], load_seconds: float) -> Entry:
+        return Entry(data, time.time() + (self.ttl if ttl is None else ttl), load_seconds, tuple(tags))
+
+    def _observe_load(self, started: float, outcome: str) -> float:
+        seconds = time.perf_counter() - started
+        LOAD_SECONDS.observe((self.namespace, outcome), seconds)
+        return seconds
+
+    def _keep(self, full_key: str, entry: Entry, error: Exception) -> Any:
+        """An early refresh failed: the entry has not expired yet, so keep serving it."""
+        logger.warning("Refreshing %s failed, serving the cached value: %r", full_key, error)
+        return decode(entry.value)
+
+    # Sync code
+
+    def get(self, key: str) -> Any:
+        entry = self.backend.get(self._key(key))
+        self._count("hit" if entry is not None else "miss")
+        return None if entry is None else decode(entry.value)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None, tags: Iterable[str] = ()):
+        self.backend.set(self._key(key), self._entry(encode(value), ttl, tags, 0.0))
+
+    def get_or_load(self, key: str, loader: Callable[[], Any], ttl: Optional[float] = None,
+                    tags: Iterable[str] = (), cacheable: Optional[Callable[[Any], bool]] = None) -> Any:
+        """The cached value, or ``loader()``'s, stored unless ``cacheable(value)`` is false."""
+        if not self.backend.enabled:
+            return loader()
+        full_key = self._key(key)
+        entry = self.backend.get_local(full_key)
+        if entry is not None and not self._refresh_early(entry):
+            self._count("hit")
+            return decode(entry.value)
+
+        with self._lock:
+            call = self._calls.get(full_key)
+            leader = call is None
+            if leader:
+                call = self._calls[full_key] = _Call()
+        if not leader:
+            if entry is not None:
+                # Someone else is refreshing it; the current value is still valid
+                self._count("hit")
+                return decode(entry.value)
+            self._count("coalesced")
+            if call.done.wait(self.coalesce_timeout):
+                if call.error is not None:
+                    raise call.error
+                return decode(call.data)
+            return decode(encode(loader()))
+
+        try:
+            # Only the leader asks the shared store, so a burst of misses costs one lookup
+            if entry is None and self.backend.remote:
+                entry = self.backend.get(full_key)
+                if entry is not None and not self._refresh_early(entry):
+                    self._count("hit")
+                    call.data = entry.value
+                    return decode(entry.value)
+            self._count("miss" if entry is None else "refresh")
+            generation = self.backend.generation
+            started = time.perf_counter()
+            try:
+                value = loader()
+                # Encoded even when not stored, so every caller gets the same types
+                call.data = encode(value)
+            except Exception as e:
+                self._observe_load(started, "error")
+                if entry is not None:
+                    call.data = entry.value
+                    return self._keep(full_key, entry, e)
+                call.error = e
+                raise
+            load_seconds = self._observe_load(started, "ok")
+        except BaseException as e:
+            if call.data is None and call.error is None:
+                call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(full_key, None)
+            call.done.set()
+        if cacheable is None or cacheable(value):
+            self.backend.set(full_key, self._entry(call.data, ttl, tags, load_seconds), generation)
+        return decode(call.data)
+
+    def delete(self, *keys: str):
+        self.backend.delete([self._key(key) for key in keys])
+        INVALIDATIONS.inc((self.namespace, "key"), len(keys))
+
+    def invalidate_tags(self, *tags: str):
+        self.backend.invalidate_tags(list(tags))
+        INVALIDATIONS.inc((self.namespace, "tag"), len(tags))
+
+    # Async code: the remote backends' I/O goes to the threadpool
+
+    async def aget_or_load(self, key: str, loader: Callable[[], Awaitable[Any]], ttl: Optional[float] = None,
+                           tags: Iterable[str] = (), cacheable: Optional[Callable[[Any], bool]] = None) -> Any:
+        """get_or_load for coroutines: ``loader`` returns an awaitable."""
+        if not self.backend.enabled:
+            return await loader()
+        full_key = self._key(key)
+        entry = self.backend.get_local(full_key)
+        if entry is not None and not self._refresh_early(entry):
+            self._count("hit")
+            return decode(entry.value)
+
+        future = self._async_calls.get(full_key)
+        if future is not None:
+            if entry is not None:
+                self._count("hit")
+                return decode(entry.value)
+            self._count("coalesced")
+            try:
+                return decode(await asyncio.wait_for(asyncio.shield(future), self.coalesce_timeout))
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # The loading request was cancelled: load for ourselves
+            return decode(encode(await loader()))
+
+        future = self._async_calls[full_key] = asyncio.get_running_loop().create_future()
+        try:
+            if entry is None and self.backend.remote:
+                entry = await run_in_threadpool(self.backend.get, full_key)
+                if entry is not None and not self._refresh_early(entry):
+                    self._count("hit")
+                    future.set_result(entry.value)
+                    return decode(entry.value)
+            self._count("miss" if entry is None else "refresh")
+            generation = self.backend.generation
+            started = time.perf_counter()
+            try:
+                value = await loader()
+                data = encode(value)
+            except Exception as e:
+                self._observe_load(started, "error")
+                if entry is not None:
+                    future.set_result(entry.value)
+                    return self._keep(full_key, entry, e)
+                future.set_exception(e)
+                future.exception()  # retrieved, whether or not anyone was waiting
+                raise
+            future.set_result(data)
+            load_seconds = self._observe_load(started, "ok")
+        finally:
+            # Cancelled (or failed before loading): waiters load for themselves
+            if not future.done():
+                future.cancel()
+            del self._async_calls[full_key]
+        if cacheable is None or cacheable(value):
+            cached = self._entry(data, ttl, tags, load_seconds)
+            if self.backend.remote:
+                await run_in_threadpool(self.backend.set, full_key, cached, generation)
+            else:
+                self.backend.set(full_key, cached, generation)
+        return decode(data)
+
+    async def adelete(self, *keys: str):
+        await run_in_threadpool(self.delete, *keys)
+
+    async def ainvalidate_tags(self, *tags: str):
+        await run_in_threadpool(self.invalidate_tags, *tags)
+
+    def start(self):
+        self.backend.start()
+
+    def stop(self):
+        self.backend.stop()
+
+    def stats(self) -> dict:
+        lookups = self.counts["hit"] + self.counts["miss"] + self.counts["refresh"]
+        return {
+            "namespace": self.namespace,
+            "ttl_seconds": self.ttl,
+            **self.counts,
+            "hit_ratio": round(self.counts["hit"] / lookups, 4) if lookups else None,
+            "in_flight": len(self._calls) + len(self._async_calls),
+            **self.backend.stats(),
+        }
+
+
+_caches: List[Cache] = []
+
+
+def _collect_memory_tiers():
+    tiers = [(cache.namespace, cache.backend.memory_tier) for cache in _caches]
+    tiers = [(namespace, tier) for namespace, tier in tiers if tier is not None]
+    entries = [(("namespace", "tier"), (namespace, tier.name), len(tier._entries)) for namespace, tier in tiers]
+    evictions = [(("namespace", "tier"), (namespace, tier.name), tier.evictions) for namespace, tier in tiers]
+    yield "cache_entries", "gauge", "Entries held in process, per namespace.", entries
+    yield "cache_evictions_total", "counter", "Entries the in-process LRU evicted, per namespace.", evictions
+
+
+registry.add_collector(_collect_memory_tiers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Delete entries from the shared cache and notify near caches.")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--tag", action="append", default=[], help="delete every entry with this tag")
+    parser.add_argument("--key", action="append", default=[], help="delete this key (with its namespace)")
+    parser.add_argument("--all", action="store_true", help="delete every entry")
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error("DATABASE_URL is not set")
+    if not (args.tag or args.key or args.all):
+        parser.error("give --tag, --key or --all")
+
+    from sqlalchemy import create_engine
+
+    engine = create_engine(args.database_url)
+    backend = PostgresBackend(engine, strict=True)
+    if args.all:
+        backend.clear()
+    if args.key:
+        backend.delete(args.key)
+    if args.tag:
+        backend.invalidate_tags(args.tag)
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+"""
+Connection pool settings, telemetry and a max_connections guard.
+
+All six services share one PostgreSQL server, so one service with an
+oversized or stuck pool can starve the others. Each service's database.py
+builds its engines with PoolMonitor.engine_options(), which takes the pool
+settings from the service's environment:
+
+    DB_POOL_SIZE (5)         connections kept open
+    DB_MAX_OVERFLOW (10)     extra connections opened under load
+    DB_POOL_TIMEOUT (30)     seconds to wait for a connection before failing
+    DB_POOL_RECYCLE (-1)     close connections older than this many seconds (-1: never)
+    DB_POOL_PRE_PING (false) test each connection with a round trip at checkout
+    DB_POOL_WARM (pool size) connections opened at startup, before the service reports ready
+
+PoolMonitor.watch() hooks the pool's checkout, checkin, connect and close
+events. It keeps counters and windows of recent checkout waits and hold
+times, plus the open time of every live connection for connection ages.
+stats() is served by each service at GET /db/pool/stats. The same numbers
+are in /metrics (see shared.metrics). A checkout that
+times out is counted and logged with the service name, so "QueuePool
+limit" errors can be traced to the pool that ran dry.
+
+The guard: every connection carries an application_name such as
+``saludya/auth_service/15/3f2a9c1b7d10:7``, which gives the service, the
+most connections that process can open (pool_size + max_overflow for each
+of its engines) and the process. check_budget() reads these names from
+pg_stat_activity. It adds up the budgets of the other running processes
+and this one, then compares the sum with max_connections, less the
+superuser reserve and DB_CONNECTION_HEADROOM (5) kept free for psql and
+migrations. DB_POOL_GUARD picks what happens when the sum is too high:
+"warn" (the default) logs the breakdown, "strict" refuses to start, "off"
+skips the check.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+
+from sqlalchemy import exc, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.event import listen
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from shared.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "-1"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "false").lower() == "true"
+DB_POOL_WARM = int(os.getenv("DB_POOL_WARM", str(DB_POOL_SIZE)))
+DB_POOL_GUARD = os.getenv("DB_POOL_GUARD", "warn")  # warn | strict | off
+DB_CONNECTION_HEADROOM = int(os.getenv("DB_CONNECTION_HEADROOM", "5"))
+
+APPLICATION_PREFIX = "saludya"
+WAIT_WINDOW = 1000
+
+CHECKOUT_WAIT = registry.histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection.", ("service", "pool"))
+
+
+def _percentiles(samples) -> dict:
+    samples = sorted(samples)
+
+    def percentile(fraction: float) -> Optional[float]:
+        if not samples:
+            return None
+        return round(samples[min(len(samples) - 1, int(len(samples) * fraction))] * 1000, 2)
+
+    return {
+        "p50_ms": percentile(0.5),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+        "max_ms": round(samples[-1] * 1000, 2) if samples else None,
+    }
+
+
+class PoolStats:
+    """Counters, recent checkout waits and hold times, and live connections for one pool."""
+
+    def __init__(self, service: str, label: str, window: int = WAIT_WINDOW):
+        self.service = service
+        self.label = label
+        self.checkouts = 0
+        self.timeouts = 0
+        self.connects = 0
+        self.closes = 0
+        self.invalidations = 0
+        self._waits = deque(maxlen=window)
+        self._holds = deque(maxlen=window)
+        self._opened_at: Dict[object, float] = {}
+        self._lock = threading.Lock()
+
+    def observe_wait(self, seconds: float):
+        with self._lock:
+            self.checkouts += 1
+            self._waits.append(seconds)
+        CHECKOUT_WAIT.observe((self.service, self.label), seconds)
+
+    def observe_timeout(self, pool: QueuePool):
+        with self._lock:
+            self.timeouts += 1
+        logger.warning(
+            "%s %s pool exhausted: %d connections in use (pool_size %d, overflow %d), waited %.1fs",
+            self.service, self.label, pool.checkedout(), pool.size(), max(pool.overflow(), 0), DB_POOL_TIMEOUT,
+        )
+
+    def on_connect(self, dbapi_connection, record):
+        with self._lock:
+            self.connects += 1
+            self._opened_at[record] = time.monotonic()
+
+    def on_checkout(self, dbapi_connection, record, proxy):
+        record.info["checked_out_at"] = time.monotonic()
+
+    def on_checkin(self, dbapi_connection, record):
+        checked_out_at = record.info.pop("checked_out_at", None)
+        if checked_out_at is not None:
+            with self._lock:
+                self._holds.append(time.monotonic() - checked_out_at)
+
+    def on_close(self, dbapi_connection, record):
+        with self._lock:
+            self.closes += 1
+            self._opened_at.pop(record, None)
+
+    def on_invalidate(self, dbapi_connection, record, exception):
+        with self._lock:
+            self.invalidations += 1
+
+    def snapshot(self, pool: QueuePool) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            waits = list(self._waits)
+            holds = list(self._holds)
+            ages = [now - opened_at for opened_at in self._opened_at.values()]
+            counters = {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "connects": self.connects,
+                "closes": self.closes,
+                "invalidations": self.invalidations,
+            }
+        return {
+            "pool_size": pool.size(),
+            "in_use": pool.checkedout(),
+            "idle": pool.checkedin(),
+            "overflow": max(pool.overflow(), 0),
+            **counters,
+            "checkout_wait": _percentiles(waits),
+            "hold": _percentiles(holds),
+            "connection_age_seconds": {
+                "max": round(max(ages), 1) if ages else None,
+                "mean": round(sum(ages) / len(ages), 1) if ages else None,
+            },
+        }
+
+
+class _TimedPool:
+    """Times how long each checkout waits for a connection and counts timeouts."""
+
+    stats: Optional[PoolStats] = None
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            record = super()._do_get()
+        except exc.TimeoutError:
+            if self.stats is not None:
+                self.stats.observe_timeout(self)
+            raise
+        if self.stats is not None:
+            self.stats.observe_wait(time.perf_counter() - started)
+        return record
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+class TimedQueuePool(_TimedPool, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(_TimedPool, AsyncAdaptedQueuePool):
+    pass
+
+
+class PoolMonitor:
+    """Pool settings and telemetry for one service process."""
+
+    def __init__(self, service: str, engines: int = 1):
+        self.service = service
+        # The most connections this process can hold across all its engines
+        self.budget = (DB_POOL_SIZE + max(DB_MAX_OVERFLOW, 0)) * engines
+        self.instance = f"{socket.gethostname()[:16]}:{os.getpid()}"
+        self.application_name = f"{APPLICATION_PREFIX}/{service}/{self.budget}/{self.instance}"
+        self._pools: Dict[str, Engine] = {}
+        self._engine: Optional[Engine] = None
+        registry.add_collector(self._collect)
+
+    def engine_options(self, asyncio: bool = False) -> dict:
+        if asyncio:
+            connect_args = {"server_settings": {"application_name": self.application_name}}
+        else:
+            connect_args = {"application_name": self.application_name}
+        return {
+            "poolclass": TimedAsyncQueuePool if asyncio else TimedQueuePool,
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_timeout": DB_POOL_TIMEOUT,
+            "pool_recycle": DB_POOL_RECYCLE,
+            "pool_pre_ping": DB_POOL_PRE_PING,
+            "connect_args": connect_args,
+        }
+
+    def watch(self, engine: Engine, label: str = "sync"):
+        """Collect telemetry for the engine's pool (for an AsyncEngine pass engine.sync_engine)."""
+        stats = PoolStats(self.service, label)
+        engine.pool.stats = stats
+        listen(engine, "connect", stats.on_connect)
+        listen(engine, "checkout", stats.on_checkout)
+        listen(engine, "checkin", stats.on_checkin)
+        listen(engine, "close", stats.on_close)
+        listen(engine, "invalidate", stats.on_invalidate)
+        self._pools[label] = engine
+        if self._engine is None:
+            self._engine = engine
+
+    def warm(self, engine: Engine, count: int = DB_POOL_WARM):
+        """Open up to count connections at once and return them to the pool, so the first requests do not connect."""
+        connections = []
+        try:
+            for _ in range(min(count, DB_POOL_SIZE)):
+                connections.append(engine.connect())
+        finally:
+            for connection in connections:
+                connection.close()
+
+    async def warm_async(self, engine, count: int = DB_POOL_WARM):
+        """warm() for an AsyncEngine."""
+        connections = []
+        try:
+            for _ in range(min(count, DB_POOL_SIZE)):
+                connections.append(await engine.connect())
+        finally:
+            for connection in connections:
+                await connection.close()
+
+    def stats(self) -> dict:
+        return {
+            "service": self.service,
+            "application_name": self.application_name,
+            "budget": self.budget,
+            "settings": {
+                "pool_size": DB_POOL_SIZE,
+                "max_overflow": DB_MAX_OVERFLOW,
+                "pool_timeout": DB_POOL_TIMEOUT,
+                "pool_recycle": DB_POOL_RECYCLE,
+                "pool_pre_ping": DB_POOL_PRE_PING,
+            },
+            "pools": {label: engine.pool.stats.snapshot(engine.pool) for label, engine in self._pools.items()},
+        }
+
+    def _collect(self):
+        connections, timeouts, ages = [], [], []
+        for label, engine in self._pools.items():
+            pool = engine.pool
+            for state, value in (("in_use", pool.checkedout()), ("idle", pool.checkedin()),
+                                 ("overflow", max(pool.overflow(), 0))):
+                connections.append((("service", "pool", "state"), (self.service, label, state), value))
+            snapshot = pool.stats.snapshot(pool)
+            timeouts.append((("service", "pool"), (self.service, label), snapshot["timeouts"]))
+            ages.append((("service", "pool"), (self.service, label), snapshot["connection_age_seconds"]["max"] or 0))
+        yield "db_pool_connections", "gauge", "Pooled connections by state.", connections
+        yield "db_pool_checkout_timeouts_total", "counter", "Checkouts that gave up waiting.", timeouts
+        yield "db_pool_connection_age_max_seconds", "gauge", "Age of the oldest open connection.", ages
+
+    def cluster_budget(self) -> dict:
+        """Connection budgets of every SaludYa process connected to the server, next to its limit."""
+        with self._engine.connect() as connection:
+            max_connections = int(connection.execute(text("SHOW max_connections")).scalar())
+            reserved = int(connection.execute(text("SHOW superuser_reserved_connections")).scalar())
+            names = connection.execute(
+                text("SELECT DISTINCT application_name FROM pg_stat_activity WHERE application_name LIKE :prefix"),
+                {"prefix": f"{APPLICATION_PREFIX}/%"},
+            ).scalars().all()
+        budgets = {self.application_name: self.budget}
+        for name in names:
+            parts = name.split("/")
+            if len(parts) == 4 and parts[2].isdigit():
+                budgets[name] = int(parts[2])
+        by_service: Dict[str, int] = {}
+        for name, budget in budgets.items():
+            service = name.split("/")[1]
+            by_service[service] = by_service.get(service, 0) + budget
+        return {
+            "max_connections": max_connections,
+            "available": max_connections - reserved - DB_CONNECTION_HEADROOM,
+            "total_budget": sum(budgets.values()),
+            "processes": len(budgets),
+            "by_service": by_service,
+        }
+
+    def check_budget(self):
+        """Warn (or with DB_POOL_GUARD=strict, refuse to start) if all pools together could exceed max_connections."""
+        if DB_POOL_GUARD == "off" or self._engine is None:
+            return
+        try:
+            budget = self.cluster_budget()
+        except exc.SQLAlchemyError as e:
+            logger.warning("%s could not check the connection budget: %s", self.service, e)
+            return
+        if budget["total_budget"] <= budget["available"]:
+            logger.info(
+                "%s connection budget %d of %d available (%s)",
+                self.service, budget["total_budget"], budget["available"], budget["by_service"],
+            )
+            return
+        message = (
+            f"{self.service}: the pools of {budget['processes']} processes could open {budget['total_budget']} "
+            f"connections but only {budget['available']} of max_connections={budget['max_connections']} "
+            f"are available ({budget['by_service']}). Lower DB_POOL_SIZE / DB_MAX_OVERFLOW."
+        )
+        if DB_POOL_GUARD == "strict":
+            raise RuntimeError(message)
+        logger.warning(message)
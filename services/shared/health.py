@@ -0,0 +1,60 @@
+"""
+Liveness and readiness probes.
+
+    GET /health/live    200 while the process can serve at all
+    GET /health/ready   200 once startup finished, 503 before that and while shutting down
+
+A service is ready after its startup hook has warmed the database pools
+(see PoolMonitor.warm), so a load balancer or orchestrator that waits for
+/health/ready never sends a request to a worker that still has to open its
+connections. The schema is not touched at startup: ``python -m
+shared.migrate`` runs once per deploy, before the services. With several
+workers (shared.serve) every worker answers for itself, so an instance
+reports ready as soon as one worker is.
+
+The paths have two segments so that catch-all routes such as GET
+/{payment_id} cannot shadow them.
+"""
+import time
+from typing import Optional
+
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+# startup_seconds counts from here: main.py imports this module with the service's own modules
+IMPORTED_AT = time.monotonic()
+
+
+class Readiness:
+    def __init__(self):
+        self.ready = False
+        self.startup_seconds: Optional[float] = None
+
+    def set_ready(self):
+        self.startup_seconds = round(time.monotonic() - IMPORTED_AT, 3)
+        self.ready = True
+
+    def set_not_ready(self):
+        self.ready = False
+
+    def status(self) -> dict:
+        if self.ready:
+            status = "ready"
+        else:
+            status = "starting" if self.startup_seconds is None else "stopping"
+        return {"status": status, "startup_seconds": self.startup_seconds}
+
+
+readiness = Readiness()
+
+health_router = APIRouter(prefix="/health", tags=["Health"])
+
+
+@health_router.get("/live")
+def live():
+    return {"status": "alive"}
+
+
+@health_router.get("/ready")
+def ready():
+    return JSONResponse(readiness.status(), status_code=200 if readiness.ready else 503)
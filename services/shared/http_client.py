@@ -0,0 +1,524 @@
+"""
+Resilient HTTP client for calls between SaludYa services.
+
+Every ServiceClient talks to one target service and shares a single event
+loop thread with the other clients of the process, so all outbound calls go
+through pooled httpx.AsyncClient connections. Sync route handlers block on
+request(); async code awaits arequest(). On top of the pool each call gets:
+
+* a deadline: the caller's remaining budget (set by DeadlineMiddleware from
+  the incoming DEADLINE_HEADER, or by ``with deadline(seconds)``), capped at
+  SERVICE_CLIENT_DEADLINE_SECONDS. The remaining budget is forwarded to the
+  target in DEADLINE_HEADER so the whole chain gives up together.
+* retries with jittered exponential backoff, for idempotent requests only
+  (GET, HEAD, PUT, DELETE, or POST with idempotent=True / an Idempotency-Key),
+  on connection errors, timeouts, 429, 502, 503 and 504. A connect error is
+  retried for any method, since the request never left.
+* a circuit breaker per target: after SERVICE_CLIENT_BREAKER_FAILURES failed
+  attempts in a row, calls fail at once for SERVICE_CLIENT_BREAKER_RESET_SECONDS,
+  then one probe decides whether to close it again.
+* optional hedging: an idempotent attempt that has not answered after
+  ``hedge_after`` seconds is raced against a second one.
+* latency and outcome metrics per target (stats(), all_client_stats()).
+* a client span per attempt, whose traceparent is sent along (shared.tracing).
+* the caller's Authorization header (adopted by ForwardAuthorizationMiddleware),
+  so with ACCESS_TOKEN_REQUIRED=true the target accepts calls made on behalf
+  of an authenticated user.
+
+A target that cannot answer (timeout, connection error, 429, 502, 503 or
+504) raises ServiceUnavailable. Any other 5xx means it answered but failed,
+and raises a plain ServiceError, as do unexpected 4xx from the helpers. A
+404 is a normal response, so callers can tell "not found" from "could not
+ask" and from "asked, but it broke".
+
+In monolith mode (shared.monolith) the target service runs in the same
+process. serve_in_process() registers its ASGI app, and calls to it then go
+through httpx.ASGITransport: no socket and no serialization beyond the
+JSON bodies, with deadlines, retries and the breaker as before. They run
+on the server's event loop rather than the client loop, because the
+target's async database pool belongs to that loop.
+"""
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from shared.metrics import observe_outbound
+from shared.tracing import inject, span
+
+logger = logging.getLogger(__name__)
+
+SERVICE_CLIENT_TIMEOUT_SECONDS = float(os.getenv("SERVICE_CLIENT_TIMEOUT_SECONDS", "2"))
+SERVICE_CLIENT_DEADLINE_SECONDS = float(os.getenv("SERVICE_CLIENT_DEADLINE_SECONDS", "5"))
+SERVICE_CLIENT_RETRIES = int(os.getenv("SERVICE_CLIENT_RETRIES", "2"))
+SERVICE_CLIENT_BACKOFF_SECONDS = float(os.getenv("SERVICE_CLIENT_BACKOFF_SECONDS", "0.05"))
+SERVICE_CLIENT_BREAKER_FAILURES = int(os.getenv("SERVICE_CLIENT_BREAKER_FAILURES", "5"))
+SERVICE_CLIENT_BREAKER_RESET_SECONDS = float(os.getenv("SERVICE_CLIENT_BREAKER_RESET_SECONDS", "10"))
+# 0 disables hedging unless a client asks for it
+SERVICE_CLIENT_HEDGE_AFTER_MS = float(os.getenv("SERVICE_CLIENT_HEDGE_AFTER_MS", "0"))
+SERVICE_CLIENT_MAX_CONNECTIONS = int(os.getenv("SERVICE_CLIENT_MAX_CONNECTIONS", "100"))
+
+# Remaining budget of the caller in milliseconds
+DEADLINE_HEADER = "X-Request-Deadline-Ms"
+
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+RETRYABLE_STATUSES = {429, 502, 503, 504}
+LATENCY_WINDOW = 2048
+
+# time.monotonic() by which the current request must be answered
+_deadline: ContextVar[Optional[float]] = ContextVar("service_call_deadline", default=None)
+# Authorization header of the request being served, sent on the calls made for it
+_authorization: ContextVar[Optional[str]] = ContextVar("service_call_authorization", default=None)
+
+
+class ServiceError(Exception):
+    """The target answered with something the caller cannot use."""
+
+    def __init__(self, target: str, reason: str):
+        super().__init__(f"{target}: {reason}")
+        self.target = target
+        self.reason = reason
+
+
+class ServiceUnavailable(ServiceError):
+    """The target could not be asked: down, overloaded, too slow or circuit open.
+
+    Only these are worth retrying later; a 500 from the target is a ServiceError.
+    """
+
+
+def remaining_budget() -> Optional[float]:
+    """Seconds left for the current request, or None when it has no deadline."""
+    deadline_at = _deadline.get()
+    return None if deadline_at is None else deadline_at - time.monotonic()
+
+
+@contextmanager
+def deadline(seconds: float):
+    """Give the calls made inside the block at most ``seconds`` (never more than an outer deadline)."""
+    deadline_at = time.monotonic() + seconds
+    outer = _deadline.get()
+    token = _deadline.set(deadline_at if outer is None else min(outer, deadline_at))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+class DeadlineMiddleware:
+    """Adopt the caller's budget from DEADLINE_HEADER for the duration of a request."""
+
+    def __init__(self, app):
+        self.app = app
+        self._header = DEADLINE_HEADER.lower().encode("latin-1")
+
+    async def __call__(self, scope, receive, send):
+        budget_ms = None
+        if scope["type"] == "http":
+            for name, value in scope["headers"]:
+                if name == self._header:
+                    try:
+                        budget_ms = float(value)
+                    except ValueError:
+                        pass
+                    break
+        if budget_ms is None:
+            await self.app(scope, receive, send)
+            return
+        token = _deadline.set(time.monotonic() + budget_ms / 1000)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _deadline.reset(token)
+
+
+class ForwardAuthorizationMiddleware:
+    """Adopt the caller's Authorization header for the service calls made during its request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        authorization = None
+        if scope["type"] == "http":
+            for name, value in scope["headers"]:
+                if name == b"authorization":
+                    authorization = value.decode("latin-1")
+                    break
+        if authorization is None:
+            await self.app(scope, receive, send)
+            return
+        token = _authorization.set(authorization)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _authorization.reset(token)
+
+
+def _with_authorization(kwargs: dict) -> dict:
+    """Add the current request's Authorization header, unless the call sets its own."""
+    authorization = _authorization.get()
+    headers = kwargs.get("headers") or {}
+    if authorization is None or any(name.lower() == "authorization" for name in headers):
+        return kwargs
+    return dict(kwargs, headers=dict(headers, Authorization=authorization))
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str = "", failure_threshold: int = SERVICE_CLIENT_BREAKER_FAILURES,
+                 reset_timeout: float = SERVICE_CLIENT_BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning("Circuit to %s opened after %d failures", self.name, self.failures)
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self._probing = False
+
+
+class TargetStats:
+    """Outcome counters and a window of recent call latencies for one target."""
+
+    def __init__(self, target: str, window: int = LATENCY_WINDOW):
+        self.target = target
+        self.calls = 0
+        self.unavailable = 0
+        self.retries = 0
+        self.hedges = 0
+        self.short_circuited = 0
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float, ok: bool):
+        with self._lock:
+            self.calls += 1
+            if not ok:
+                self.unavailable += 1
+            self._latencies.append(seconds)
+        observe_outbound(self.target, seconds, "ok" if ok else "unavailable")
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            counters = {
+                "calls": self.calls,
+                "unavailable": self.unavailable,
+                "retries": self.retries,
+                "hedges": self.hedges,
+                "short_circuited": self.short_circuited,
+            }
+
+        def percentile(fraction: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * fraction))] * 1000, 2)
+
+        counters.update(p50_ms=percentile(0.5), p95_ms=percentile(0.95), p99_ms=percentile(0.99))
+        return counters
+
+
+class _LoopThread:
+    """The event loop that runs every ServiceClient's calls."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def get(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name=self.name, daemon=True)
+                self._thread.start()
+            return self._loop
+
+    def stop(self, closing: List["ServiceClient"]):
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        for client in closing:
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop).result(timeout=5)
+        loop.call_soon_threadsafe(loop.stop)
+        self._thread.join(timeout=5)
+        loop.close()
+
+
+_client_loop = _LoopThread("service-clients")
+_clients: Dict[str, "ServiceClient"] = {}
+# Target name -> (ASGI app, event loop it runs on) for services mounted in this process
+_in_process: Dict[str, Tuple[object, asyncio.AbstractEventLoop]] = {}
+
+
+# Set in the scope of requests sent to an in-process target, so shared.admission can tell
+# them from outside requests; a scope key, unlike a header, cannot be sent by a client
+IN_PROCESS_SCOPE_KEY = "saludya.in_process"
+
+
+def serve_in_process(target: str, app, loop: asyncio.AbstractEventLoop):
+    """Send calls to ``target`` straight to ``app`` on ``loop`` instead of over HTTP (monolith mode)."""
+
+    async def in_process_app(scope, receive, send):
+        await app(dict(scope, **{IN_PROCESS_SCOPE_KEY: True}), receive, send)
+
+    _in_process[target] = (in_process_app, loop)
+
+
+class ServiceClient:
+    def __init__(
+        self,
+        name: str,
+        base_url: str,
+        timeout: float = SERVICE_CLIENT_TIMEOUT_SECONDS,
+        default_deadline: float = SERVICE_CLIENT_DEADLINE_SECONDS,
+        retries: int = SERVICE_CLIENT_RETRIES,
+        backoff: float = SERVICE_CLIENT_BACKOFF_SECONDS,
+        hedge_after: float = SERVICE_CLIENT_HEDGE_AFTER_MS / 1000,
+        max_connections: int = SERVICE_CLIENT_MAX_CONNECTIONS,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.default_deadline = default_deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.hedge_after = hedge_after
+        self.max_connections = max_connections
+        self.breaker = breaker or CircuitBreaker(name)
+        self.metrics = TargetStats(name)
+        # Created on the client loop so its connections belong to that loop
+        self._client: Optional[httpx.AsyncClient] = None
+        _clients[name] = self
+
+    def _build_url(self, path: str) -> str:
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def _loop(self) -> asyncio.AbstractEventLoop:
+        in_process = _in_process.get(self.name)
+        return in_process[1] if in_process is not None else _client_loop.get()
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None and self.name in _in_process:
+            app, _ = _in_process[self.name]
+            # An exception in the target becomes a 500, as it would over HTTP
+            self._client = httpx.AsyncClient(
+                transport=httpx.ASGITransport(app=app, raise_app_exceptions=False), timeout=self.timeout,
+            )
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+            )
+        return self._client
+
+    def _deadline_at(self, timeout: Optional[float]) -> float:
+        deadline_at = time.monotonic() + (timeout if timeout is not None else self.default_deadline)
+        inherited = _deadline.get()
+        return deadline_at if inherited is None else min(inherited, deadline_at)
+
+    def request(self, method: str, path: str, *, timeout: Optional[float] = None,
+                idempotent: Optional[bool] = None, hedge: bool = True, **kwargs) -> httpx.Response:
+        """Blocking call from a thread; any response below 500 (including 404) is returned as is."""
+        deadline_at = self._deadline_at(timeout)
+        # Read here: the call itself runs on the client loop, outside this request's context
+        kwargs = _with_authorization(kwargs)
+        future = asyncio.run_coroutine_threadsafe(
+            self._call(method.upper(), path, kwargs, deadline_at, idempotent, hedge), self._loop()
+        )
+        return future.result()
+
+    async def arequest(self, method: str, path: str, *, timeout: Optional[float] = None,
+                       idempotent: Optional[bool] = None, hedge: bool = True, **kwargs) -> httpx.Response:
+        """Awaitable request() for async handlers; the call runs on the client loop (here if in-process)."""
+        deadline_at = self._deadline_at(timeout)
+        kwargs = _with_authorization(kwargs)
+        call = self._call(method.upper(), path, kwargs, deadline_at, idempotent, hedge)
+        loop = self._loop()
+        if loop is asyncio.get_running_loop():
+            return await call
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(call, loop))
+
+    def get_json(self, path: str, **kwargs) -> Optional[object]:
+        """GET a resource; None when the target answers 404."""
+        return self._json_or_none(self.request("GET", path, **kwargs))
+
+    async def aget_json(self, path: str, **kwargs) -> Optional[object]:
+        return self._json_or_none(await self.arequest("GET", path, **kwargs))
+
+    def post_json(self, path: str, json: object, **kwargs) -> object:
+        return self._json(self.request("POST", path, json=json, **kwargs))
+
+    async def apost_json(self, path: str, json: object, **kwargs) -> object:
+        return self._json(await self.arequest("POST", path, json=json, **kwargs))
+
+    def exists(self, path: str, **kwargs) -> bool:
+        """HEAD a resource: True for 2xx, False for 404."""
+        return self._found(self.request("HEAD", path, **kwargs))
+
+    async def aexists(self, path: str, **kwargs) -> bool:
+        return self._found(await self.arequest("HEAD", path, **kwargs))
+
+    def _found(self, response: httpx.Response) -> bool:
+        if response.status_code == 404:
+            return False
+        if not response.is_success:
+            raise ServiceError(self.name, f"HTTP {response.status_code}")
+        return True
+
+    def _json_or_none(self, response: httpx.Response) -> Optional[object]:
+        if response.status_code == 404:
+            return None
+        return self._json(response)
+
+    def _json(self, response: httpx.Response) -> object:
+        if not response.is_success:
+            raise ServiceError(self.name, f"HTTP {response.status_code}")
+        return response.json()
+
+    async def _send(self, method: str, path: str, kwargs: dict, deadline_at: float) -> httpx.Response:
+        remaining = deadline_at - time.monotonic()
+        headers = dict(kwargs.get("headers") or {})
+        headers[DEADLINE_HEADER] = str(max(0, int(remaining * 1000)))
+        with span(f"{method} {self.name}", "client", path=path) as attempt:
+            inject(headers)
+            response = await asyncio.wait_for(
+                self._get_client().request(method, self._build_url(path), **dict(kwargs, headers=headers)),
+                min(self.timeout, remaining),
+            )
+            if attempt is not None:
+                attempt.attributes["status"] = response.status_code
+            return response
+
+    async def _send_hedged(self, method: str, path: str, kwargs: dict, deadline_at: float) -> httpx.Response:
+        first = asyncio.ensure_future(self._send(method, path, kwargs, deadline_at))
+        done, _ = await asyncio.wait({first}, timeout=self.hedge_after)
+        if done:
+            return first.result()
+        self.metrics.hedges += 1
+        pending = {first, asyncio.ensure_future(self._send(method, path, kwargs, deadline_at))}
+        try:
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and task.result().status_code < 500:
+                        return task.result()
+                if not pending:
+                    # Both attempts failed; report the one that finished last
+                    return task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _call(self, method: str, path: str, kwargs: dict, deadline_at: float,
+                    idempotent: Optional[bool], hedge: bool) -> httpx.Response:
+        if idempotent is None:
+            headers = kwargs.get("headers") or {}
+            idempotent = method in IDEMPOTENT_METHODS or any(k.lower() == "idempotency-key" for k in headers)
+        hedged = hedge and idempotent and self.hedge_after > 0
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            if time.monotonic() >= deadline_at:
+                self.metrics.observe(time.monotonic() - started, ok=False)
+                raise ServiceUnavailable(self.name, "deadline exceeded")
+            if not self.breaker.allow():
+                self.metrics.short_circuited += 1
+                self.metrics.observe(time.monotonic() - started, ok=False)
+                raise ServiceUnavailable(self.name, "circuit open")
+
+            try:
+                if hedged:
+                    response = await self._send_hedged(method, path, kwargs, deadline_at)
+                else:
+                    response = await self._send(method, path, kwargs, deadline_at)
+            except asyncio.TimeoutError:
+                failure = "timed out"
+                unavailable = True
+                retryable = idempotent
+            except httpx.HTTPError as e:
+                failure = str(e) or type(e).__name__
+                unavailable = True
+                retryable = idempotent or isinstance(e, httpx.ConnectError)
+            else:
+                if response.status_code < 500 and response.status_code != 429:
+                    self.breaker.record_success()
+                    self.metrics.observe(time.monotonic() - started, ok=True)
+                    return response
+                failure = f"HTTP {response.status_code}"
+                unavailable = response.status_code in RETRYABLE_STATUSES
+                retryable = idempotent and unavailable
+            self.breaker.record_failure()
+
+            delay = random.uniform(0, self.backoff * 2 ** attempt)
+            if not retryable or attempt >= self.retries or time.monotonic() + delay >= deadline_at:
+                self.metrics.observe(time.monotonic() - started, ok=False)
+                if not unavailable:
+                    # The target answered, so a 500 is its bug, not an outage to wait out
+                    raise ServiceError(self.name, failure)
+                raise ServiceUnavailable(self.name, failure)
+            attempt += 1
+            self.metrics.retries += 1
+            await asyncio.sleep(delay)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> dict:
+        snapshot = self.metrics.snapshot()
+        snapshot.update(target="in-process" if self.name in _in_process else self.base_url, circuit=self.breaker.state)
+        return snapshot
+
+
+def all_client_stats() -> Dict[str, dict]:
+    return {name: client.stats() for name, client in _clients.items()}
+
+
+def close_clients():
+    """Close every client's connections and stop the client loop (service shutdown)."""
+    _client_loop.stop(list(_clients.values()))
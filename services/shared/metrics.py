@@ -0,0 +1,285 @@
+"""
+RED metrics (rate, errors, duration) in Prometheus text format.
+
+MetricsMiddleware times every request and records it under the matched
+route template ("/doctors/{doctor_id}", never the raw path, so a label
+cannot grow without bound), the method and the response status:
+
+    http_requests_total{method,route,status}
+    http_request_duration_seconds{method,route,status}   (histogram)
+    http_requests_in_progress
+
+A request also collects the time it spends in the components it waits on,
+observed per route when it finishes:
+
+    http_request_component_seconds{method,route,component}   (histogram)
+
+The components are "db" (cursor executions, timed by
+shared.query_profiler.watch_engine), "outbound" (calls recorded through
+track_outbound: the service clients, the Groq API, the payment gateway)
+and "password_hash" (bcrypt in auth_service). With these, slow /orient requests can be told
+apart as Groq, PostgreSQL or something else. The accumulator lives in a
+ContextVar. Starlette's threadpool and the service client loop copy the
+context, so time spent there is still credited to the request.
+track_outbound also feeds outbound_request_duration_seconds{target,outcome}
+and opens a client span (shared.tracing), and every query goes into
+db_query_duration_seconds.
+
+The middleware also answers GET /metrics with registry.render() itself:
+a route would be shadowed by catch-all routes such as GET /{payment_id}.
+Scrapes are not counted as requests. Recording costs a
+dict lookup and a bisect under a lock per sample. benchmarks/metrics_overhead.py
+measures it. METRICS_ENABLED=false turns the middleware into a pass-through.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from starlette.responses import Response
+
+from shared.tracing import span
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+UNMATCHED_ROUTE = "unmatched"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: tuple = (), amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labels, value in values:
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        # Per series: a count for each bucket (not cumulative, the last one is +Inf) and the sum
+        self._series: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: tuple, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _number(bound)
+                bucket_labels = _labels(self.labelnames, labels, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+# A collector returns (name, type, help, [(label names, label values, value), ...]) for values
+# that are read when scraped, such as pool sizes, rather than recorded as they happen.
+Sample = Tuple[Tuple[str, ...], tuple, float]
+Collector = Callable[[], Iterable[Tuple[str, str, str, List[Sample]]]]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._collectors: List[Collector] = []
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._metrics.setdefault(name, Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._metrics.setdefault(name, Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector: Collector):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        # Several collectors can report the same metric (one PoolMonitor per service in monolith mode)
+        collected: Dict[str, Tuple[str, str, List[Sample]]] = {}
+        for collector in self._collectors:
+            for name, kind, documentation, samples in collector():
+                collected.setdefault(name, (kind, documentation, []))[2].extend(samples)
+        for name, (kind, documentation, samples) in collected.items():
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labelnames, labels, value in samples:
+                lines.append(f"{name}{_labels(labelnames, labels)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUESTS = registry.counter(
+    "http_requests_total", "HTTP requests by route template and status.", ("method", "route", "status"))
+REQUEST_DURATION = registry.histogram(
+    "http_request_duration_seconds", "HTTP request duration by route template and status.",
+    ("method", "route", "status"))
+REQUEST_COMPONENTS = registry.histogram(
+    "http_request_component_seconds", "Time a request spent waiting on each component.",
+    ("method", "route", "component"))
+OUTBOUND_DURATION = registry.histogram(
+    "outbound_request_duration_seconds", "Calls to other services and external APIs.", ("target", "outcome"))
+DB_QUERY_DURATION = registry.histogram(
+    "db_query_duration_seconds", "Cursor executions on the service's engines.")
+
+_in_progress = 0
+
+
+def _collect_in_progress():
+    yield "http_requests_in_progress", "gauge", "HTTP requests being served.", [((), (), _in_progress)]
+
+
+registry.add_collector(_collect_in_progress)
+
+
+class RequestTimings:
+    """Seconds spent per component by one request."""
+
+    __slots__ = ("components",)
+
+    def __init__(self):
+        self.components: Dict[str, float] = {}
+
+    def add(self, component: str, seconds: float):
+        self.components[component] = self.components.get(component, 0.0) + seconds
+
+
+_request_timings: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+
+def observe_component(component: str, seconds: float):
+    """Credit time spent waiting on a component to the current request, if any."""
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.add(component, seconds)
+
+
+def observe_outbound(target: str, seconds: float, outcome: str = "ok"):
+    OUTBOUND_DURATION.observe((target, outcome), seconds)
+    observe_component("outbound", seconds)
+
+
+@contextmanager
+def track_outbound(target: str):
+    """Time a call to another service or external API (outcome "error" if it raises), as a client span too."""
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        with span(target, "client"):
+            yield
+        outcome = "ok"
+    finally:
+        observe_outbound(target, time.perf_counter() - started, outcome)
+
+
+def _route_path(scope) -> str:
+    """The path without the app's root_path, which is still in it when the app is mounted (monolith mode)."""
+    path, root_path = scope["path"], scope.get("root_path", "")
+    if root_path and path.startswith(root_path + "/"):
+        return path[len(root_path):]
+    return path
+
+
+class MetricsMiddleware:
+    """Record rate, errors, duration and per-component time for every HTTP request."""
+
+    def __init__(self, app, enabled: bool = METRICS_ENABLED, path: str = "/metrics"):
+        self.app = app
+        self.enabled = enabled
+        self.path = path
+
+    async def __call__(self, scope, receive, send):
+        global _in_progress
+        if not self.enabled or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if _route_path(scope) == self.path and scope["method"] == "GET":
+            await metrics_response()(scope, receive, send)
+            return
+        started = time.perf_counter()
+        finished = None
+        status = 500
+
+        async def send_and_record(message):
+            nonlocal status, finished
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                # Background tasks run after this and are not the client's wait
+                finished = time.perf_counter()
+            await send(message)
+
+        timings = RequestTimings()
+        token = _request_timings.set(timings)
+        _in_progress += 1
+        try:
+            await self.app(scope, receive, send_and_record)
+        finally:
+            _in_progress -= 1
+            _request_timings.reset(token)
+            elapsed = (finished or time.perf_counter()) - started
+            route = scope.get("route")
+            template = getattr(route, "path", None) or UNMATCHED_ROUTE
+            method = scope["method"]
+            status_label = str(status)
+            REQUESTS.inc((method, template, status_label))
+            REQUEST_DURATION.observe((method, template, status_label), elapsed)
+            for component, seconds in timings.components.items():
+                REQUEST_COMPONENTS.observe((method, template, component), seconds)
+
+
+def metrics_response() -> Response:
+    return Response(registry.render(), media_type=CONTENT_TYPE)
@@ -0,0 +1,132 @@
+"""
+One-shot schema migration: applies database/migrations/*.sql in order.
+
+The services no longer create tables or seed data when they start. Run
+this once per deploy, before the services:
+
+    PYTHONPATH=services python -m shared.migrate [--dir database/migrations] [--dry-run]
+
+It takes DATABASE_URL and MIGRATIONS_DIR from the environment (or .env).
+Applied files are recorded in public.schema_migrations with a checksum, so
+each file runs once, in its own transaction. A file that changed after it
+was applied is reported and stops the run. Every run holds a PostgreSQL
+advisory lock, so replicas or jobs that start at the same time apply each
+file once.
+
+Databases created before this command have no schema_migrations table and
+have the files applied by docker-entrypoint-initdb.d. The files are
+written to be re-runnable (IF NOT EXISTS, ON CONFLICT DO NOTHING), so the
+first run applies them again and records them. New files must be
+re-runnable too.
+"""
+import argparse
+import hashlib
+import logging
+import os
+import sys
+import time
+from typing import List, Tuple
+
+from dotenv import find_dotenv, load_dotenv
+from sqlalchemy import create_engine
+
+logger = logging.getLogger(__name__)
+
+# The .env of the working directory (a service directory) or of one above it
+load_dotenv(find_dotenv(usecwd=True))
+
+DEFAULT_MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "database", "migrations")
+MIGRATIONS_DIR = os.getenv("MIGRATIONS_DIR", DEFAULT_MIGRATIONS_DIR)
+# Any fixed key: only migration runs take this lock
+LOCK_KEY = 0x5A1D7A
+
+
+class MigrationError(Exception):
+    pass
+
+
+def migration_files(directory: str) -> List[Tuple[str, str, str]]:
+    """(name, sql, checksum) of every .sql file in the directory, in name order."""
+    if not os.path.isdir(directory):
+        raise MigrationError(f"migrations directory {directory} does not exist")
+    files = []
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".sql"):
+            with open(os.path.join(directory, name), encoding="utf-8") as f:
+                sql = f.read()
+            files.append((name, sql, hashlib.sha256(sql.encode()).hexdigest()))
+    return files
+
+
+def migrate(database_url: str, directory: str = MIGRATIONS_DIR, dry_run: bool = False) -> List[str]:
+    """Apply the files not applied yet and return their names."""
+    files = migration_files(directory)
+    engine = create_engine(database_url, pool_size=1, max_overflow=0, connect_args={"application_name": "saludya/migrate"})
+    connection = engine.raw_connection()
+    applied_now = []
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT pg_advisory_lock(%s)", (LOCK_KEY,))
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS public.schema_migrations ("
+            " version VARCHAR(255) PRIMARY KEY,"
+            " checksum VARCHAR(64) NOT NULL,"
+            " applied_at TIMESTAMP NOT NULL DEFAULT NOW())"
+        )
+        cursor.execute("SELECT version, checksum FROM public.schema_migrations")
+        applied = dict(cursor.fetchall())
+        connection.commit()
+
+        for name, sql, checksum in files:
+            if name in applied:
+                if applied[name] != checksum:
+                    raise MigrationError(f"{name} changed after it was applied; add a new migration instead")
+                continue
+            if dry_run:
+                applied_now.append(name)
+                continue
+            started = time.perf_counter()
+            try:
+                cursor.execute(sql)
+                cursor.execute(
+                    "INSERT INTO public.schema_migrations (version, checksum) VALUES (%s, %s)", (name, checksum)
+                )
+                connection.commit()
+            except Exception as e:
+                connection.rollback()
+                raise MigrationError(f"{name} failed: {e}") from e
+            logger.info("applied %s in %.0f ms", name, (time.perf_counter() - started) * 1000)
+            applied_now.append(name)
+    finally:
+        try:
+            connection.cursor().execute("SELECT pg_advisory_unlock(%s)", (LOCK_KEY,))
+            connection.commit()
+        finally:
+            connection.close()
+            engine.dispose()
+    return applied_now
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--dir", default=MIGRATIONS_DIR)
+    parser.add_argument("--dry-run", action="store_true", help="list the files that would be applied")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if not args.database_url:
+        parser.error("DATABASE_URL is not set")
+    try:
+        names = migrate(args.database_url, args.dir, args.dry_run)
+    except MigrationError as e:
+        logger.error("migration failed: %s", e)
+        sys.exit(1)
+    if not names:
+        logger.info("schema is up to date")
+    elif args.dry_run:
+        logger.info("would apply: %s", ", ".join(names))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Monolith mode: the six services in one process and one ASGI application.
+
+    cd services && ASGI_APP=shared.monolith:app PORT=8010 python -m shared.serve
+
+Each service's FastAPI app is mounted under its root_path (/api/auth,
+/api/users, ...), so the URLs are the ones the nginx proxy serves. Calls
+between the services (appointment and payment to user and catalog, auth's
+profile outbox to user) are sent to the mounted app through
+shared.http_client.serve_in_process, with no socket and no loopback hop;
+deadlines, retries, breakers and the client stats still apply.
+
+The services are flat modules that share names (main, database, models,
+routers, schemas). load_service() imports a service's main with its
+directory first on sys.path, then moves every module whose name another
+service also uses to "<service>.<module>" in sys.modules, so the next
+service imports its own. Modules with unique names (password_hashing,
+gateway, ...) keep them, so the bcrypt process pool can still unpickle
+its functions.
+
+Mounted apps get no lifespan events of their own. The monolith's startup
+registers the in-process targets, then runs every service's startup in
+order; its shutdown runs them in reverse. Each service keeps its own
+pools and background threads, so DB_POOL_SIZE / DB_MAX_OVERFLOW apply six
+times per process (twelve in async mode). GET /health/ready answers once
+all six have started, GET /traces/... serves the spans of all of them
+(shared.tracing) and GET /metrics serves their metrics;
+routes with the same template in several services (such as "/") share
+their series. The signed-token revocation sync still uses HTTP: point
+AUTH_REVOCATIONS_URL at this process's /api/auth/revocations.
+"""
+import asyncio
+import importlib
+import os
+import sys
+from typing import List, Optional, Tuple
+
+from fastapi import FastAPI
+
+from shared.health import health_router
+from shared.http_client import serve_in_process
+from shared.metrics import metrics_response
+from shared.tracing import tracing_router
+
+SERVICES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Directory, mount prefix (the app's root_path) and the client target name other services call it by
+SERVICES: Tuple[Tuple[str, str, Optional[str]], ...] = (
+    ("user_service", "/api/users", "user-service"),
+    ("catalog_service", "/api/catalog", "catalog-service"),
+    ("auth_service", "/api/auth", None),
+    ("appointment_service", "/api/appointments", None),
+    ("ai_orientation_service", "/api/ai", None),
+    ("payment_service", "/api/payments", None),
+)
+
+
+def _module_names(directory: str) -> List[str]:
+    return [name[:-3] for name in os.listdir(os.path.join(SERVICES_DIR, directory)) if name.endswith(".py")]
+
+
+def shared_module_names() -> set:
+    """Module names used by more than one service."""
+    seen, shared = set(), set()
+    for directory, _, _ in SERVICES:
+        for name in _module_names(directory):
+            (shared if name in seen else seen).add(name)
+    return shared
+
+
+def load_service(directory: str, shared_names: set) -> FastAPI:
+    """Import a service's main.py and return its app, leaving the module names free for the next service."""
+    path = os.path.abspath(os.path.join(SERVICES_DIR, directory))
+    sys.path.insert(0, path)
+    try:
+        module = importlib.import_module("main")
+    finally:
+        sys.path.remove(path)
+        for name in shared_names:
+            loaded = sys.modules.pop(name, None)
+            if loaded is not None:
+                sys.modules[f"{directory}.{name}"] = loaded
+    return module.app
+
+
+def build_app() -> FastAPI:
+    app = FastAPI(
+        title="SaludYa",
+        description="All SaludYa services in one process",
+        version="1.0.0",
+    )
+    shared_names = shared_module_names()
+    services: List[Tuple[FastAPI, Optional[str]]] = []
+    for directory, prefix, target in SERVICES:
+        service_app = load_service(directory, shared_names)
+        services.append((service_app, target))
+        app.mount(prefix, service_app)
+    app.include_router(health_router)
+    app.include_router(tracing_router)
+    app.add_api_route("/metrics", metrics_response, include_in_schema=False)
+
+    @app.on_event("startup")
+    async def startup():
+        loop = asyncio.get_running_loop()
+        for service_app, target in services:
+            if target is not None:
+                serve_in_process(target, service_app, loop)
+        for service_app, _ in services:
+            await service_app.router.startup()
+
+    @app.on_event("shutdown")
+    async def shutdown():
+        for service_app, _ in reversed(services):
+            await service_app.router.shutdown()
+
+    return app
+
+
+app = build_app()
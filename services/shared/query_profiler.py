@@ -0,0 +1,202 @@
+"""
+Per-request SQL profiling: query counts, DB time, slow queries and N+1 shapes.
+
+watch_engine() hooks an engine's before_cursor_execute and
+after_cursor_execute events. These are the only cursor listeners in the
+services, so shared.metrics gets its "db" time and db_query_duration_seconds,
+and shared.tracing its db spans, from here as well. Each statement is reduced to its shape by normalize():
+literals and bind parameters become ?, IN lists become IN (...), and
+whitespace is collapsed. A lazy load that runs once per row therefore
+shows up as one shape executed many times.
+
+QueryProfilerMiddleware gives every request a QueryProfile. The profile
+counts queries, DB time and executions per shape. When the request ends:
+
+* the query count goes into http_request_db_queries{method,route}
+* every shape executed more than QUERY_REPEAT_THRESHOLD (5) times is
+  logged as a "repeated_statement" event and counted in
+  db_repeated_statements_total{route}. This is usually an N+1, e.g. a
+  lazy relationship loaded inside a loop.
+
+Any statement slower than SLOW_QUERY_MS (200) is logged right away as a
+"slow_query" event. Both events are one JSON object per log line, with
+the service, the route template and the normalized SQL, never the
+parameter values.
+
+assert_max_queries() is the test helper. Requests (or direct calls) made
+inside the block that run more than the limit raise QueryBudgetExceeded,
+an AssertionError that lists the shapes. benchmarks/query_budgets.py
+applies it to each service's hot endpoints and exits non-zero on a
+regression.
+"""
+import json
+import logging
+import os
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import List, Optional
+
+from sqlalchemy.engine import Engine
+from sqlalchemy.event import listen
+
+from shared.metrics import DB_QUERY_DURATION, UNMATCHED_ROUTE, observe_component, registry
+from shared.tracing import current_span, record_span
+
+logger = logging.getLogger(__name__)
+
+QUERY_PROFILER_ENABLED = os.getenv("QUERY_PROFILER_ENABLED", "true").lower() == "true"
+QUERY_REPEAT_THRESHOLD = int(os.getenv("QUERY_REPEAT_THRESHOLD", "5"))
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+
+QUERIES_PER_REQUEST = registry.histogram(
+    "http_request_db_queries", "SQL statements executed per request.", ("method", "route"),
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100))
+REPEATED_STATEMENTS = registry.counter(
+    "db_repeated_statements_total", "Statement shapes executed more than QUERY_REPEAT_THRESHOLD times in one request.",
+    ("route",))
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w$])\d+(?:\.\d+)?\b")
+# psycopg2 (%(name)s, %s) and asyncpg ($1) placeholders
+_PARAMETER = re.compile(r"%\(\w+\)s|%s|\$\d+")
+_IN_LIST = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+_SPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=2048)
+def normalize(statement: str) -> str:
+    """The shape of a statement: literals and parameters as ?, IN lists as IN (...), single spaces."""
+    shape = _STRING.sub("?", statement)
+    shape = _PARAMETER.sub("?", shape)
+    shape = _NUMBER.sub("?", shape)
+    shape = _IN_LIST.sub("IN (...)", shape)
+    return _SPACE.sub(" ", shape).strip()
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryProfile:
+    """Queries run by one request (or one assert_max_queries block)."""
+
+    __slots__ = ("scope", "queries", "seconds", "shapes")
+
+    def __init__(self, scope: Optional[dict] = None):
+        self.scope = scope
+        self.queries = 0
+        self.seconds = 0.0
+        self.shapes: Counter = Counter()
+
+    @property
+    def route(self) -> Optional[str]:
+        if self.scope is None:
+            return None
+        return getattr(self.scope.get("route"), "path", None) or UNMATCHED_ROUTE
+
+    def record(self, shape: str, seconds: float):
+        self.queries += 1
+        self.seconds += seconds
+        self.shapes[shape] += 1
+
+    def repeated(self, threshold: int = QUERY_REPEAT_THRESHOLD) -> List[tuple]:
+        return [(shape, count) for shape, count in self.shapes.most_common() if count > threshold]
+
+    def describe(self) -> str:
+        lines = [f"{self.queries} queries in {self.seconds * 1000:.1f} ms"]
+        lines.extend(f"  {count} x {shape}" for shape, count in self.shapes.most_common())
+        return "\n".join(lines)
+
+
+_profile: ContextVar[Optional[QueryProfile]] = ContextVar("query_profile", default=None)
+# Lists that assert_max_queries() is collecting finished request profiles into
+_sinks: List[List[QueryProfile]] = []
+
+
+def _log(event: str, service: str, profile: Optional[QueryProfile], **fields):
+    record = {"event": event, "service": service, "route": profile.route if profile else None}
+    record.update(fields)
+    logger.warning(json.dumps(record))
+
+
+def watch_engine(engine: Engine, service: str):
+    """Profile and time every statement on an engine (for an AsyncEngine pass engine.sync_engine)."""
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        # The execution context is new for every statement, and cheaper to reach than conn.info
+        context._profiler_started = time.perf_counter()
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._profiler_started
+        DB_QUERY_DURATION.observe((), elapsed)
+        observe_component("db", elapsed)
+        profile = _profile.get()
+        if profile is not None:
+            profile.record(normalize(statement), elapsed)
+        if current_span() is not None:
+            record_span(normalize(statement), elapsed, "db")
+        if elapsed * 1000 >= SLOW_QUERY_MS:
+            _log("slow_query", service, profile, duration_ms=round(elapsed * 1000, 1), statement=normalize(statement))
+
+    listen(engine, "before_cursor_execute", before_cursor_execute)
+    listen(engine, "after_cursor_execute", after_cursor_execute)
+
+
+class QueryProfilerMiddleware:
+    """Profile the queries of every HTTP request and flag repeated statement shapes."""
+
+    def __init__(self, app, service: str, enabled: bool = QUERY_PROFILER_ENABLED,
+                 repeat_threshold: int = QUERY_REPEAT_THRESHOLD):
+        self.app = app
+        self.service = service
+        self.enabled = enabled
+        self.repeat_threshold = repeat_threshold
+
+    async def __call__(self, scope, receive, send):
+        if not self.enabled or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        profile = QueryProfile(scope)
+        token = _profile.set(profile)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _profile.reset(token)
+            self._finish(profile, scope["method"])
+
+    def _finish(self, profile: QueryProfile, method: str):
+        route = profile.route
+        QUERIES_PER_REQUEST.observe((method, route), profile.queries)
+        for shape, count in profile.repeated(self.repeat_threshold):
+            REPEATED_STATEMENTS.inc((route,))
+            _log("repeated_statement", self.service, profile, count=count, queries=profile.queries, statement=shape)
+        for sink in _sinks:
+            sink.append(profile)
+
+
+@contextmanager
+def assert_max_queries(limit: int, route: Optional[str] = None):
+    """Fail if a request inside the block (only those to route, if given) or the block itself runs over limit queries.
+
+        with assert_max_queries(2, route="/doctors"):
+            client.get("/doctors")
+    """
+    block = QueryProfile()
+    requests: List[QueryProfile] = []
+    token = _profile.set(block)
+    _sinks.append(requests)
+    try:
+        yield requests
+    finally:
+        _sinks.remove(requests)
+        _profile.reset(token)
+    over = [profile for profile in requests if profile.queries > limit and (route is None or profile.route == route)]
+    if route is None and block.queries > limit:
+        over.append(block)
+    if over:
+        worst = max(over, key=lambda profile: profile.queries)
+        raise QueryBudgetExceeded(f"{worst.route or 'block'} ran over its budget of {limit}: {worst.describe()}")
@@ -0,0 +1,90 @@
+"""
+Production entry point: serves a service's main:app with N worker processes.
+
+    cd services/catalog_service && PYTHONPATH=.. python -m shared.serve
+
+It is configured from the environment (the Dockerfiles set PORT):
+
+    PORT (8000)                 port to listen on
+    HOST (0.0.0.0)              address to bind
+    WEB_CONCURRENCY (1)         worker processes, or "auto" for one per CPU
+    KEEP_ALIVE_TIMEOUT (5)      seconds an idle keep-alive connection stays open
+    LOG_LEVEL (info)
+    ASGI_APP (main:app)         the app to serve; shared.monolith:app serves all six services
+
+The workers share the listening socket and each runs the service's
+startup hook, so each has its own pools, caches and background threads.
+Every worker counts against the max_connections guard with its own
+application_name, and the background jobs claim their rows with FOR
+UPDATE SKIP LOCKED, so they can run in every worker. Size DB_POOL_SIZE /
+DB_MAX_OVERFLOW per worker, not per service.
+
+With several workers the listening socket is bound here rather than by
+uvicorn.run: uvicorn 0.27 creates it without IPPROTO_TCP, and asyncio only
+sets TCP_NODELAY on connections accepted from a TCP socket. Without it a
+response written as headers, then body waits for the client's delayed ACK
+(about 40 ms per request).
+
+Startup does not create tables or seed data: run ``python -m
+shared.migrate`` once per deploy first. A worker reports ready at GET
+/health/ready (shared.health) once its pools are warm.
+benchmarks/serving.py measures the time to ready and the requests per
+second per worker.
+"""
+import logging
+import os
+import socket
+import sys
+
+import uvicorn
+from uvicorn.main import STARTUP_FAILURE
+from uvicorn.supervisors import Multiprocess
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class Config(uvicorn.Config):
+    """Binds the socket the workers share as an IPPROTO_TCP socket (see above)."""
+
+    def bind_socket(self) -> socket.socket:
+        family = socket.AF_INET6 if ":" in self.host else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM, socket.IPPROTO_TCP)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            sock.bind((self.host, self.port))
+        except OSError as e:
+            logger.error(e)
+            sys.exit(1)
+        sock.set_inheritable(True)
+        logger.info("Uvicorn running on http://%s:%d with %d workers", self.host, self.port, self.workers)
+        return sock
+
+
+def worker_count(value: str) -> int:
+    if value == "auto":
+        return os.cpu_count() or 1
+    return max(int(value), 1)
+
+
+def main():
+    # The service directory holds main.py; it is the working directory in the images
+    sys.path.insert(0, os.getcwd())
+    config = Config(
+        os.getenv("ASGI_APP", "main:app"),
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", "8000")),
+        workers=worker_count(os.getenv("WEB_CONCURRENCY", "1")),
+        timeout_keep_alive=int(os.getenv("KEEP_ALIVE_TIMEOUT", "5")),
+        log_level=os.getenv("LOG_LEVEL", "info"),
+    )
+    server = uvicorn.Server(config)
+    if config.workers > 1:
+        Multiprocess(config, target=server.run, sockets=[config.bind_socket()]).run()
+    else:
+        server.run()
+        if not server.started:
+            sys.exit(STARTUP_FAILURE)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Clients for the SaludYa services, built on shared.http_client.
+
+The *_SERVICE_URL settings point straight at each service (docker-compose
+uses the container names), so calls between services no longer take the
+extra hop through the nginx proxy. Each target has one client per process;
+routers get it from their get_*_client dependency.
+
+Lookups return None / False only when the target says 404. When the target
+cannot be reached they raise ServiceUnavailable, which upstream_error() turns
+into a 503 for the caller instead of a misleading "not found". A target that
+answers with an error of its own (500, or an unexpected 4xx) raises
+ServiceError and becomes a 502.
+"""
+import os
+from typing import Iterable, List, Optional
+from uuid import UUID
+
+from fastapi import HTTPException, status
+
+from shared.http_client import ServiceClient, ServiceError, ServiceUnavailable
+
+USER_SERVICE_URL = os.getenv("USER_SERVICE_URL", "http://localhost:8002/")
+CATALOG_SERVICE_URL = os.getenv("CATALOG_SERVICE_URL", "http://localhost:8003/")
+
+
+class UserServiceClient(ServiceClient):
+    """Client for User Service API."""
+
+    def __init__(self, base_url: str = USER_SERVICE_URL, **options):
+        super().__init__("user-service", base_url, **options)
+
+    def get_user(self, user_id: UUID) -> Optional[dict]:
+        """Get user by ID. Returns None if user not found."""
+        return self.get_json(f"/{user_id}")
+
+    def get_users(self, user_ids: Iterable[UUID]) -> List[dict]:
+        """Get several users in one call. Unknown ids are left out."""
+        ids = [str(user_id) for user_id in user_ids]
+        if not ids:
+            return []
+        # A read, so it is safe to retry and hedge
+        return self.post_json("/batch", {"ids": ids}, idempotent=True)
+
+    def user_exists(self, user_id: UUID) -> bool:
+        """Check if a user exists (HEAD, no profile is transferred)."""
+        return self.exists(f"/{user_id}")
+
+    async def auser_exists(self, user_id: UUID) -> bool:
+        return await self.aexists(f"/{user_id}")
+
+
+class CatalogServiceClient(ServiceClient):
+    """Client for Catalog Service API."""
+
+    def __init__(self, base_url: str = CATALOG_SERVICE_URL, **options):
+        super().__init__("catalog-service", base_url, **options)
+
+    def get_doctor(self, doctor_id: UUID) -> Optional[dict]:
+        """Get doctor by ID. Returns None if doctor not found."""
+        return self.get_json(f"/doctors/{doctor_id}")
+
+    async def aget_doctor(self, doctor_id: UUID) -> Optional[dict]:
+        return await self.aget_json(f"/doctors/{doctor_id}")
+
+    def doctor_exists(self, doctor_id: UUID) -> bool:
+        """Check if a doctor exists."""
+        return self.get_doctor(doctor_id) is not None
+
+
+def upstream_error(error: ServiceError) -> HTTPException:
+    """HTTP error for a failed call to another service: 503 if it was unavailable, else 502."""
+    service = error.target.replace("-", " ").title()
+    if isinstance(error, ServiceUnavailable):
+        return HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"{service} unavailable. Please try again.",
+            headers={"Retry-After": "1"},
+        )
+    return HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=f"Unexpected response from {service}")
@@ -0,0 +1,292 @@
+"""
+Signed access tokens shared by the SaludYa services.
+
+Auth Service issues short-lived HMAC-SHA256 access tokens that carry the
+user id, issue time and expiry. Other services verify them locally with
+TokenVerifier instead of calling Auth Service or reading
+auth_service.auth_tokens. Revocations are kept in a small deny-list that
+each verifier syncs periodically from Auth Service's /revocations endpoint:
+single tokens by id (logout), and per-user cutoffs that reject every token
+of the user issued before a moment (logout-all).
+
+Internal-only routes (deleting a profile, bulk import) do not accept user
+tokens at all. They require ServiceCredential: the shared SERVICE_TOKEN in
+an X-Service-Token header, which nginx strips from public requests. Without
+SERVICE_TOKEN those routes are closed.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from typing import Dict, NamedTuple, Optional, Tuple
+from uuid import UUID
+
+import httpx
+from fastapi import Depends, Header, HTTPException, status
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+
+logger = logging.getLogger(__name__)
+
+_bearer = HTTPBearer(auto_error=False)
+
+
+class InvalidToken(Exception):
+    """Raised when an access token is malformed, forged, expired or revoked."""
+
+
+class AccessClaims(NamedTuple):
+    user_id: UUID
+    jti: str
+    expires_at: int
+    # 0 for tokens issued before iat was added; any logout-all cutoff rejects them
+    issued_at: int = 0
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _sign(body: str, secret: bytes) -> str:
+    return _b64encode(hmac.new(secret, body.encode("ascii"), hashlib.sha256).digest())
+
+
+def is_signed_token(token: str) -> bool:
+    """Opaque tokens are url-safe base64 and never contain a dot."""
+    return "." in token
+
+
+def issue_access_token(user_id: UUID, secret: bytes, ttl_seconds: int, now: Optional[float] = None):
+    """Return ``(token, claims)`` for a new access token valid for ``ttl_seconds``."""
+    issued_at = int(now if now is not None else time.time())
+    claims = AccessClaims(
+        user_id=user_id, jti=secrets.token_hex(8), expires_at=issued_at + ttl_seconds, issued_at=issued_at)
+    payload = {"sub": str(claims.user_id), "iat": claims.issued_at, "exp": claims.expires_at, "jti": claims.jti}
+    body = _b64encode(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+    return f"{body}.{_sign(body, secret)}", claims
+
+
+def decode_access_token(token: str, secret: bytes, now: Optional[float] = None) -> AccessClaims:
+    """Check signature and expiry of an access token and return its claims."""
+    body, _, signature = token.partition(".")
+    if not body or not signature:
+        raise InvalidToken("Malformed token")
+    if not hmac.compare_digest(signature, _sign(body, secret)):
+        raise InvalidToken("Bad signature")
+    try:
+        payload = json.loads(_b64decode(body))
+        claims = AccessClaims(
+            user_id=UUID(payload["sub"]),
+            jti=str(payload["jti"]),
+            expires_at=int(payload["exp"]),
+            issued_at=int(payload.get("iat", 0)),
+        )
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidToken("Malformed token") from e
+    if claims.expires_at <= (now if now is not None else time.time()):
+        raise InvalidToken("Token expired")
+    return claims
+
+
+class RevocationList:
+    """
+    In-memory deny-list of revoked access token ids and per-user cutoffs.
+
+    A cutoff rejects every token of its user issued before ``revoked_before``.
+    Entries are only kept until the revoked tokens would have expired anyway,
+    so the list stays as small as the number of revocations within one
+    access token lifetime.
+    """
+
+    def __init__(self, source_url: Optional[str] = None, interval: float = 30.0, timeout: float = 5.0):
+        self.source_url = source_url
+        self.interval = interval
+        self.timeout = timeout
+        self._entries: Dict[str, int] = {}
+        # user id -> (revoked_before, expires_at)
+        self._users: Dict[UUID, Tuple[int, int]] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __contains__(self, jti: str) -> bool:
+        return jti in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, jti: str, expires_at: int):
+        with self._lock:
+            self._entries[jti] = expires_at
+
+    def add_user(self, user_id: UUID, revoked_before: int, expires_at: int):
+        with self._lock:
+            self._users[user_id] = (revoked_before, expires_at)
+
+    def is_revoked(self, claims: AccessClaims) -> bool:
+        if claims.jti in self._entries:
+            return True
+        cutoff = self._users.get(claims.user_id)
+        return cutoff is not None and claims.issued_at < cutoff[0]
+
+    def replace(self, entries: Dict[str, int], users: Optional[Dict[UUID, Tuple[int, int]]] = None):
+        now = time.time()
+        fresh = {jti: exp for jti, exp in entries.items() if exp > now}
+        fresh_users = {user_id: cutoff for user_id, cutoff in (users or {}).items() if cutoff[1] > now}
+        with self._lock:
+            self._entries = fresh
+            self._users = fresh_users
+
+    def prune(self, now: Optional[float] = None):
+        now = now if now is not None else time.time()
+        with self._lock:
+            self._entries = {jti: exp for jti, exp in self._entries.items() if exp > now}
+            self._users = {user_id: cutoff for user_id, cutoff in self._users.items() if cutoff[1] > now}
+
+    def sync(self) -> bool:
+        """Fetch the current deny-list from Auth Service. Keeps the last copy on failure."""
+        if not self.source_url:
+            return False
+        try:
+            response = httpx.get(self.source_url, timeout=self.timeout)
+            response.raise_for_status()
+            body = response.json()
+            entries = {item["jti"]: int(item["exp"]) for item in body.get("revocations", [])}
+            users = {
+                UUID(item["user_id"]): (int(item["revoked_before"]), int(item["exp"]))
+                for item in body.get("users", [])
+            }
+        except (httpx.HTTPError, ValueError, KeyError, TypeError) as e:
+            logger.warning("Revocation list sync from %s failed: %s", self.source_url, e)
+            return False
+        self.replace(entries, users)
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.sync()
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if not self.source_url or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="revocation-sync", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.timeout)
+            self._thread = None
+
+
+class TokenVerifier:
+    """
+    Verifies signed access tokens without a network or database round trip.
+
+    When ``required`` is false, requests without a token, or with a legacy
+    opaque token, are let through and the dependency returns None; a signed
+    token that fails verification is always rejected.
+    """
+
+    def __init__(self, secret: Optional[str], revocations: Optional[RevocationList] = None, required: bool = False):
+        if required and not secret:
+            raise RuntimeError("ACCESS_TOKEN_REQUIRED is set but AUTH_TOKEN_SECRET is not")
+        self.secret = secret.encode("utf-8") if secret else None
+        self.revocations = revocations if revocations is not None else RevocationList()
+        self.required = required
+
+    @classmethod
+    def from_env(cls) -> "TokenVerifier":
+        revocations = RevocationList(
+            source_url=os.getenv("AUTH_REVOCATIONS_URL"),
+            interval=float(os.getenv("AUTH_REVOCATION_SYNC_SECONDS", "30")),
+        )
+        return cls(
+            secret=os.getenv("AUTH_TOKEN_SECRET"),
+            revocations=revocations,
+            required=os.getenv("ACCESS_TOKEN_REQUIRED", "false").lower() == "true",
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.secret is not None
+
+    def verify(self, token: str) -> AccessClaims:
+        if not self.enabled:
+            raise InvalidToken("Signed tokens are not configured")
+        claims = decode_access_token(token, self.secret)
+        if self.revocations.is_revoked(claims):
+            raise InvalidToken("Token revoked")
+        return claims
+
+    def start(self):
+        if self.enabled:
+            self.revocations.start()
+
+    def stop(self):
+        self.revocations.stop()
+
+    def dependency(
+        self,
+        credentials: Optional[HTTPAuthorizationCredentials] = Depends(_bearer),
+    ) -> Optional[AccessClaims]:
+        """FastAPI dependency returning the caller's claims, or None when not required."""
+        if not credentials:
+            if self.required:
+                raise HTTPException(
+                    status_code=status.HTTP_401_UNAUTHORIZED,
+                    detail="Missing or invalid token",
+                )
+            return None
+        token = credentials.credentials
+        if not self.enabled or (not is_signed_token(token) and not self.required):
+            return None
+        try:
+            return self.verify(token)
+        except InvalidToken:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid or expired token",
+            )
+
+
+SERVICE_TOKEN_HEADER = "X-Service-Token"
+
+
+class ServiceCredential:
+    """Shared secret that one service presents to another on internal-only routes."""
+
+    def __init__(self, secret: Optional[str]):
+        self.secret = secret or None
+
+    @classmethod
+    def from_env(cls) -> "ServiceCredential":
+        return cls(os.getenv("SERVICE_TOKEN"))
+
+    @property
+    def enabled(self) -> bool:
+        return self.secret is not None
+
+    def headers(self) -> Dict[str, str]:
+        """Headers to send on a call to an internal-only route."""
+        return {SERVICE_TOKEN_HEADER: self.secret} if self.enabled else {}
+
+    def dependency(self, x_service_token: Optional[str] = Header(None)):
+        """FastAPI dependency rejecting every caller that does not hold SERVICE_TOKEN."""
+        if not self.enabled or not x_service_token or not hmac.compare_digest(
+            x_service_token.encode("utf-8"), self.secret.encode("utf-8")
+        ):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Internal endpoint",
+            )
@@ -0,0 +1,446 @@
+"""
+Lightweight distributed tracing, with no external collector.
+
+TracingMiddleware opens a "server" span for every HTTP request. It joins
+the caller's trace when the request carries a W3C ``traceparent`` header;
+otherwise it starts a new trace, reusing the nginx X-Request-Id as the
+trace id, so the proxy's access log line and the trace share one id.
+Inside a request:
+
+* every ServiceClient attempt is a "client" span, and its traceparent is
+  sent to the target, whose server span becomes the child of that attempt
+  (retries and hedges show up as separate attempts)
+* track_outbound() calls (Groq, the payment gateway) are "client" spans
+* every cursor execution on a watched engine is a "db" span named by its
+  normalized statement (shared.query_profiler)
+* bcrypt runs are "internal" spans (auth_service)
+
+When nginx passes X-Request-Start (``t=$msec``, see deploy/nginx.conf) a
+"proxy" span covers the time from nginx receiving the request to the
+response, so time queued in or before the proxy is the proxy span's own
+time.
+
+The current span lives in a ContextVar. Starlette's threadpool and
+run_coroutine_threadsafe copy the context, so spans opened in sync
+handlers and on the service client loop find their parent. Work outside
+a request (outbox relays, background payment processing) is not traced.
+Every response carries its trace id in X-Trace-Id.
+
+Finished spans go to the exporter set by TRACING_EXPORTER:
+
+    memory (default)  the last TRACING_BUFFER_SPANS spans of the process,
+                      served at GET /traces/recent and GET /traces/{trace_id}
+    file              one JSON line per span in TRACING_DIR/spans-<pid>.jsonl
+    none              spans are propagated but not kept
+
+TRACING_SAMPLE_RATE (1.0) decides at the root of a trace whether its spans
+are kept; the decision travels in the traceparent flags.
+TRACING_ENABLED=false turns the middleware into a pass-through.
+
+The CLI collects a trace's spans from the services (or the span files)
+and prints its span tree and its critical path, with the time each
+service spent on it:
+
+    python -m shared.tracing --url http://localhost:8004 --url http://localhost:8002 <trace_id>
+    python -m shared.tracing --dir /tmp/saludya-traces            (slowest recent traces)
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import APIRouter
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "memory")  # memory | file | none
+TRACING_DIR = os.getenv("TRACING_DIR", os.path.join(tempfile.gettempdir(), "saludya-traces"))
+TRACING_SAMPLE_RATE = float(os.getenv("TRACING_SAMPLE_RATE", "1.0"))
+TRACING_BUFFER_SPANS = int(os.getenv("TRACING_BUFFER_SPANS", "10000"))
+
+TRACEPARENT_HEADER = "traceparent"
+TRACE_ID_HEADER = "X-Trace-Id"
+REQUEST_ID_HEADER = "X-Request-Id"
+REQUEST_START_HEADER = "X-Request-Start"
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+_TRACE_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+def _new_id(bits: int) -> str:
+    return format(random.getrandbits(bits), f"0{bits // 4}x")
+
+
+def parse_traceparent(value: str) -> Optional[Tuple[str, str, bool]]:
+    """(trace id, parent span id, sampled) of a traceparent header, or None if it is malformed."""
+    match = _TRACEPARENT.match(value.strip().lower())
+    if match is None or match.group(1) == "0" * 32:
+        return None
+    return match.group(1), match.group(2), bool(int(match.group(3), 16) & 1)
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "service", "kind", "sampled",
+                 "start", "duration", "attributes", "_started")
+
+    def __init__(self, trace_id: str, parent_id: Optional[str], name: str, service: str, kind: str = "internal",
+                 sampled: bool = True, start: Optional[float] = None, attributes: Optional[dict] = None):
+        self.trace_id = trace_id
+        self.span_id = _new_id(64)
+        self.parent_id = parent_id
+        self.name = name
+        self.service = service
+        self.kind = kind
+        self.sampled = sampled
+        # Wall clock, so spans from several processes line up; the duration comes from perf_counter
+        self.start = time.time() if start is None else start
+        self.duration: Optional[float] = None
+        self.attributes = attributes if attributes is not None else {}
+        self._started = time.perf_counter()
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def finish(self, duration: Optional[float] = None):
+        self.duration = time.perf_counter() - self._started if duration is None else duration
+        if self.sampled:
+            exporter.export(self.to_dict())
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "service": self.service,
+            "kind": self.kind,
+            "start": self.start,
+            "duration": self.duration,
+            "attributes": self.attributes,
+        }
+
+
+class MemoryExporter:
+    """The most recent spans of this process, in a ring buffer."""
+
+    def __init__(self, capacity: int = TRACING_BUFFER_SPANS):
+        self._spans = deque(maxlen=capacity)
+
+    def export(self, span: dict):
+        # deque.append is atomic, so no lock
+        self._spans.append(span)
+
+    def spans(self, trace_id: str) -> List[dict]:
+        return [span for span in list(self._spans) if span["trace_id"] == trace_id]
+
+    def recent(self, limit: int = 20) -> List[dict]:
+        """The slowest traces started in this process, as their root spans."""
+        roots = [span for span in list(self._spans) if span["parent_id"] is None]
+        roots.sort(key=lambda span: span["duration"], reverse=True)
+        return roots[:limit]
+
+
+class FileExporter:
+    """One JSON line per span, in a file per process, for ``python -m shared.tracing --dir``."""
+
+    def __init__(self, directory: str = TRACING_DIR):
+        self.directory = directory
+        self._file = None
+        self._lock = threading.Lock()
+
+    def export(self, span: dict):
+        line = json.dumps(span, separators=(",", ":")) + "\n"
+        with self._lock:
+            if self._file is None:
+                os.makedirs(self.directory, exist_ok=True)
+                self._file = open(os.path.join(self.directory, f"spans-{os.getpid()}.jsonl"), "a", buffering=1)
+            self._file.write(line)
+
+    def spans(self, trace_id: str) -> List[dict]:
+        return []
+
+    def recent(self, limit: int = 20) -> List[dict]:
+        return []
+
+
+class NullExporter:
+    def export(self, span: dict):
+        pass
+
+    def spans(self, trace_id: str) -> List[dict]:
+        return []
+
+    def recent(self, limit: int = 20) -> List[dict]:
+        return []
+
+
+def build_exporter(kind: str = TRACING_EXPORTER):
+    if kind == "file":
+        return FileExporter()
+    if kind == "none":
+        return NullExporter()
+    return MemoryExporter()
+
+
+exporter = build_exporter()
+
+_current: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def inject(headers: dict):
+    """Add the current span's traceparent to outgoing headers, if a request is being traced."""
+    current = _current.get()
+    if current is not None:
+        headers[TRACEPARENT_HEADER] = current.traceparent()
+
+
+@contextmanager
+def span(name: str, kind: str = "internal", **attributes):
+    """A child span of the current one for the block; yields None (and costs a lookup) outside a sampled trace."""
+    parent = _current.get()
+    if parent is None or not parent.sampled:
+        yield None
+        return
+    child = Span(parent.trace_id, parent.span_id, name, parent.service, kind, attributes=attributes)
+    token = _current.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.attributes["error"] = type(e).__name__
+        raise
+    finally:
+        _current.reset(token)
+        child.finish()
+
+
+def record_span(name: str, seconds: float, kind: str = "internal", **attributes):
+    """A child span of the current one that just took ``seconds`` (for timings taken by event hooks)."""
+    parent = _current.get()
+    if parent is None or not parent.sampled:
+        return
+    child = Span(parent.trace_id, parent.span_id, name, parent.service, kind,
+                 start=time.time() - seconds, attributes=attributes)
+    child.finish(seconds)
+
+
+class TracingMiddleware:
+    """Open a server span for every HTTP request, joined to the caller's trace when it sent one."""
+
+    def __init__(self, app, service: str, enabled: bool = TRACING_ENABLED,
+                 sample_rate: float = TRACING_SAMPLE_RATE, skip: Tuple[str, ...] = ("/health/", "/traces/")):
+        self.app = app
+        self.service = service
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.skip = skip
+
+    async def __call__(self, scope, receive, send):
+        if not self.enabled or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = {}
+        for name, value in scope["headers"]:
+            if name in (b"traceparent", b"x-request-id", b"x-request-start"):
+                headers[name] = value.decode("latin-1")
+
+        parent = parse_traceparent(headers.get(b"traceparent", ""))
+        if parent is not None:
+            trace_id, parent_id, sampled = parent
+        else:
+            request_id = headers.get(b"x-request-id", "").lower()
+            trace_id = request_id if _TRACE_ID.match(request_id) else _new_id(128)
+            parent_id = None
+            sampled = random.random() < self.sample_rate
+
+        proxy = None
+        request_start = headers.get(b"x-request-start", "")
+        if request_start.startswith("t="):
+            try:
+                proxy = Span(trace_id, parent_id, f"{scope['method']} {scope['path']}", "nginx", "proxy",
+                             sampled, start=float(request_start[2:]))
+                parent_id = proxy.span_id
+            except ValueError:
+                pass
+
+        server = Span(trace_id, parent_id, scope["method"], self.service, "server", sampled)
+        trace_header = (TRACE_ID_HEADER.lower().encode("latin-1"), trace_id.encode("latin-1"))
+
+        async def send_with_trace_id(message):
+            if message["type"] == "http.response.start":
+                server.attributes["status"] = message["status"]
+                message = dict(message, headers=list(message.get("headers", [])) + [trace_header])
+            await send(message)
+
+        token = _current.set(server)
+        try:
+            await self.app(scope, receive, send_with_trace_id)
+        finally:
+            _current.reset(token)
+            template = getattr(scope.get("route"), "path", None) or "unmatched"
+            server.name = f"{scope['method']} {template}"
+            if template.startswith(self.skip):
+                server.sampled = False
+            server.finish()
+            if proxy is not None:
+                proxy.sampled = server.sampled
+                proxy.finish(max(0.0, server.start + server.duration - proxy.start))
+
+
+tracing_router = APIRouter(prefix="/traces", tags=["Tracing"])
+
+
+@tracing_router.get("/recent")
+def recent_traces(limit: int = 20):
+    """Root spans of the slowest traces kept by this process (memory exporter only)."""
+    return exporter.recent(limit)
+
+
+@tracing_router.get("/{trace_id}")
+def trace_spans(trace_id: str):
+    """Spans of one trace kept by this process (memory exporter only)."""
+    return exporter.spans(trace_id.lower())
+
+
+# ---- CLI: collect a trace and print its critical path ----
+
+def load_spans(directory: Optional[str], urls: List[str], trace_id: Optional[str]) -> List[dict]:
+    """Spans of trace_id (of every trace if None; files only) from span files and /traces endpoints."""
+    spans: Dict[str, dict] = {}
+    if directory:
+        for path in glob.glob(os.path.join(directory, "*.jsonl")):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # a line still being written
+                    if trace_id is None or record["trace_id"] == trace_id:
+                        spans[record["span_id"]] = record
+    if urls:
+        import httpx
+
+        for url in urls:
+            if trace_id is None:
+                records = httpx.get(f"{url.rstrip('/')}/traces/recent", timeout=5).json()
+            else:
+                records = httpx.get(f"{url.rstrip('/')}/traces/{trace_id}", timeout=5).json()
+            for record in records:
+                spans[record["span_id"]] = record
+    return list(spans.values())
+
+
+def _end(span: dict) -> float:
+    return span["start"] + span["duration"]
+
+
+def critical_path(span: dict, children: Dict[str, List[dict]], until: Optional[float] = None) -> List[Tuple[dict, float]]:
+    """(span, seconds of its own on the path) in time order: the chain of work the span's duration waited on.
+
+    Walking back from the span's end, the path goes through the child that
+    finished last, then the child that finished last before that one started,
+    and so on. A child that overlaps the next one on the path counts only up
+    to where that one starts. Time no child covers is the span's own, so the
+    own times add up to the span's duration.
+    """
+    start = span["start"]
+    end = _end(span) if until is None else min(_end(span), until)
+    chosen = []
+    cursor = end
+    candidates = list(children.get(span["span_id"], []))
+    while True:
+        # Clocks of different processes differ a little: clip children to the parent
+        active = [child for child in candidates if max(child["start"], start) < cursor]
+        if not active:
+            break
+        child = max(active, key=lambda child: min(_end(child), cursor))
+        candidates.remove(child)
+        chosen.append((child, cursor))
+        cursor = max(child["start"], start)
+    chosen.reverse()
+    covered = sum(min(_end(child), limit) - max(child["start"], start) for child, limit in chosen)
+    path = [(span, max(0.0, end - start - covered))]
+    for child, limit in chosen:
+        path.extend(critical_path(child, children, limit))
+    return path
+
+
+def _label(span: dict) -> str:
+    name = span["name"] if len(span["name"]) <= 70 else span["name"][:67] + "..."
+    return f"{span['service']} {span['kind']} {name}"
+
+
+def print_trace(spans: List[dict]):
+    children: Dict[str, List[dict]] = {}
+    ids = {span["span_id"] for span in spans}
+    roots = []
+    for span in spans:
+        if span["parent_id"] in ids:
+            children.setdefault(span["parent_id"], []).append(span)
+        else:
+            roots.append(span)
+    root = max(roots, key=lambda span: span["duration"])
+    path = critical_path(root, children)
+    on_path = {span["span_id"] for span, _ in path}
+    services = sorted({span["service"] for span in spans})
+    print(f"trace {root['trace_id']}  {root['duration'] * 1000:.1f} ms, {len(spans)} spans, {', '.join(services)}")
+    if len(roots) > 1:
+        print(f"  ({len(roots) - 1} spans whose parent was not found are left out)")
+    print(f"{'start':>9} {'duration':>9}")
+
+    def walk(span: dict, depth: int):
+        marker = "*" if span["span_id"] in on_path else " "
+        print(f"{(span['start'] - root['start']) * 1000:>7.1f}ms {span['duration'] * 1000:>7.1f}ms "
+              f"{marker} {'  ' * depth}{_label(span)}")
+        for child in sorted(children.get(span["span_id"], []), key=lambda child: child["start"]):
+            walk(child, depth + 1)
+
+    walk(root, 0)
+    print("\ncritical path (* above):")
+    # Own time of a client span is the network, the proxy and the target's queue, not the target's code
+    by_service: Dict[str, float] = {}
+    for span, own in path:
+        key = f"{span['service']} {span['kind']}"
+        by_service[key] = by_service.get(key, 0.0) + own
+        if own >= 0.0001:
+            print(f"  {own * 1000:>7.1f}ms  {_label(span)}")
+    print("\nby service and span kind:")
+    for key, own in sorted(by_service.items(), key=lambda item: item[1], reverse=True):
+        print(f"  {own * 1000:>7.1f}ms  {own / root['duration'] * 100:>5.1f}%  {key}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("trace_id", nargs="?", help="without it, list the slowest recent traces")
+    parser.add_argument("--dir", help="read span files written with TRACING_EXPORTER=file")
+    parser.add_argument("--url", action="append", default=[], help="a service's base URL (memory exporter); repeat")
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+    if not args.dir and not args.url:
+        parser.error("give --dir or at least one --url")
+
+    if args.trace_id is None:
+        roots = [span for span in load_spans(args.dir, args.url, None) if span["parent_id"] is None]
+        roots.sort(key=lambda span: span["duration"], reverse=True)
+        for span in roots[:args.limit]:
+            print(f"{span['trace_id']}  {span['duration'] * 1000:>8.1f}ms  {_label(span)}")
+        return
+    spans = load_spans(args.dir, args.url, args.trace_id.lower())
+    if not spans:
+        raise SystemExit(f"no spans found for trace {args.trace_id}")
+    print_trace(spans)
+
+
+if __name__ == "__main__":
+    main()
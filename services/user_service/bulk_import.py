@@ -0,0 +1,88 @@
+"""
+Bulk user import for HR and insurer rosters.
+
+The CSV body is streamed with COPY into a temporary staging table that lives
+only for the importing transaction, then moved into user_service.users with a
+single INSERT ... SELECT ... ON CONFLICT DO NOTHING. Rows whose email, DNI or
+id already exist (or repeat within the file) are skipped rather than failing
+the whole roster. The header row must be exactly:
+
+    first_name,last_name,dni,email,phone,birth_date
+
+It is checked before COPY, which only ever sees the data rows, so a roster
+with its columns in another order is rejected instead of loaded shuffled.
+"""
+import csv
+from typing import IO, NamedTuple
+
+import psycopg2
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+IMPORT_COLUMNS = ("first_name", "last_name", "dni", "email", "phone", "birth_date")
+
+CREATE_STAGING = text("""
+    CREATE TEMPORARY TABLE user_import_staging (
+        first_name VARCHAR(255) NOT NULL,
+        last_name VARCHAR(255) NOT NULL,
+        dni VARCHAR(20) NOT NULL,
+        email VARCHAR(255) NOT NULL,
+        phone VARCHAR(20) NULL,
+        birth_date DATE NULL
+    ) ON COMMIT DROP
+""")
+
+COPY_STAGING = (
+    f"COPY user_import_staging ({', '.join(IMPORT_COLUMNS)}) "
+    "FROM STDIN WITH (FORMAT csv)"
+)
+
+# DO NOTHING also skips rows that collide with an earlier row of the same file
+MOVE_STAGING = text("""
+    INSERT INTO user_service.users (id, first_name, last_name, dni, email, phone, birth_date, created_at, updated_at)
+    SELECT gen_random_uuid(), first_name, last_name, dni, email, NULLIF(phone, ''), birth_date,
+           timezone('utc', now()), timezone('utc', now())
+    FROM user_import_staging
+    ON CONFLICT DO NOTHING
+""")
+
+
+class InvalidRoster(Exception):
+    """The CSV does not match IMPORT_COLUMNS or holds an unparseable value."""
+
+
+class ImportResult(NamedTuple):
+    received: int
+    inserted: int
+
+    @property
+    def skipped(self) -> int:
+        return self.received - self.inserted
+
+
+def read_header(csv_file: IO):
+    """Consume the header row of a binary CSV file and check it against IMPORT_COLUMNS."""
+    line = csv_file.readline()
+    try:
+        header = next(csv.reader([line.decode("utf-8-sig")]), [])
+    except UnicodeDecodeError as e:
+        raise InvalidRoster("header is not UTF-8") from e
+    if tuple(column.strip() for column in header) != IMPORT_COLUMNS:
+        raise InvalidRoster(f"unexpected header {','.join(header)!r}")
+
+
+def import_users_csv(db: Session, csv_file: IO) -> ImportResult:
+    """Load a CSV roster in one transaction; the caller commits."""
+    read_header(csv_file)
+    db.execute(CREATE_STAGING)
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(COPY_STAGING, csv_file)
+        received = cursor.rowcount
+    except (psycopg2.DataError, psycopg2.IntegrityError) as e:
+        # Bad dates, missing required values, wrong column count
+        raise InvalidRoster(str(e).splitlines()[0]) from e
+    finally:
+        cursor.close()
+    inserted = db.execute(MOVE_STAGING).rowcount
+    return ImportResult(received=received, inserted=inserted)
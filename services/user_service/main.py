@@ -1,7 +1,13 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from routers import user_router
-from database import create_tables
+from routers import user_router, token_verifier
+from database import dispose_engines, pool_monitor, warm_pool
+from shared.admission import AdmissionMiddleware
+from shared.health import health_router, readiness
+from shared.metrics import MetricsMiddleware
+from shared.query_profiler import QueryProfilerMiddleware
+from shared.tracing import TracingMiddleware, tracing_router
+from profile_cache import invalidation_listener
 import uvicorn
 
 app = FastAPI(
@@ -11,6 +17,7 @@ app = FastAPI(
     root_path="/api/users"
 )
 
+app.add_middleware(AdmissionMiddleware, service="user_service", routes=app.routes)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -18,12 +25,37 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(QueryProfilerMiddleware, service="user_service")
+app.add_middleware(TracingMiddleware, service="user_service")
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(user_router, tags=["Users"])
+app.include_router(health_router)
+app.include_router(tracing_router)
 
 @app.on_event("startup")
 async def startup():
-    create_tables()
+    pool_monitor.check_budget()
+    await warm_pool()
+    token_verifier.start()
+    if invalidation_listener is not None:
+        invalidation_listener.start()
+    readiness.set_ready()
+
+@app.on_event("shutdown")
+async def shutdown():
+    readiness.set_not_ready()
+    token_verifier.stop()
+    if invalidation_listener is not None:
+        invalidation_listener.stop()
+    await dispose_engines()
+
+@app.get("/db/pool/stats")
+def db_pool_stats(cluster: bool = False):
+    stats = pool_monitor.stats()
+    if cluster:
+        stats["cluster"] = pool_monitor.cluster_budget()
+    return stats
 
 @app.get("/")
 def read_root():
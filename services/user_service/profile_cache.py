@@ -0,0 +1,226 @@
+"""
+In-process cache of serialized user profiles.
+
+GET /{user_id} serves profiles from an LRU keyed by user id, holding the
+JSON body and an ETag derived from updated_at, so hits cost neither a query
+nor a serialization and If-None-Match can be answered with 304.
+
+update_user refreshes the local entry and publishes the user id on the
+Postgres channel PROFILE_CACHE_CHANNEL (pg_notify, delivered on commit).
+ProfileInvalidationListener LISTENs on that channel in a background thread
+and evicts the id on every other replica. If the listening connection drops,
+notifications may have been missed, so the whole cache is cleared.
+PROFILE_CACHE_TTL_SECONDS bounds staleness should anything else slip through.
+"""
+import logging
+import os
+import select
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Dict, NamedTuple, Optional
+from uuid import UUID
+
+logger = logging.getLogger(__name__)
+
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "10000"))
+PROFILE_CACHE_TTL_SECONDS = float(os.getenv("PROFILE_CACHE_TTL_SECONDS", "300"))
+PROFILE_CACHE_INVALIDATION = os.getenv("PROFILE_CACHE_INVALIDATION", "postgres")  # postgres | off
+PROFILE_CACHE_CHANNEL = "user_profile_changed"
+PROFILE_CACHE_LATENCY_SAMPLES = int(os.getenv("PROFILE_CACHE_LATENCY_SAMPLES", "10000"))
+
+
+def profile_etag(user_id: UUID, updated_at: datetime) -> str:
+    """Strong validator: changes whenever update_user bumps updated_at."""
+    return f'"{user_id.hex[:8]}-{int(updated_at.timestamp() * 1_000_000):x}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    # Weak comparison, as RFC 9110 requires for If-None-Match
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+class CachedProfile(NamedTuple):
+    etag: str
+    body: bytes
+    stored_at: float
+
+
+class LatencyWindow:
+    """The last ``size`` durations, for percentile reporting."""
+
+    def __init__(self, size: int = PROFILE_CACHE_LATENCY_SAMPLES):
+        self._samples = deque(maxlen=size)
+
+    def add(self, seconds: float):
+        self._samples.append(seconds)
+
+    def percentiles(self) -> Dict[str, Optional[float]]:
+        samples = sorted(self._samples)
+        if not samples:
+            return {"count": 0, "p50_ms": None, "p99_ms": None}
+        return {
+            "count": len(samples),
+            "p50_ms": round(samples[len(samples) // 2] * 1000, 3),
+            "p99_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000, 3),
+        }
+
+
+class ProfileCache:
+    def __init__(self, max_size: int = PROFILE_CACHE_SIZE, ttl: float = PROFILE_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[UUID, CachedProfile]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # Bumped by every invalidation, so a miss that raced with an update
+        # does not store the row it read before the update
+        self.generation = 0
+        self.latency = {"hit": LatencyWindow(), "miss": LatencyWindow()}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def get(self, user_id: UUID) -> Optional[CachedProfile]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and time.monotonic() - entry.stored_at > self.ttl:
+                del self._entries[user_id]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry
+
+    def peek(self, user_id: UUID) -> bool:
+        """Whether a fresh entry exists, without touching LRU order or counters."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            return entry is not None and time.monotonic() - entry.stored_at <= self.ttl
+
+    def put(self, user_id: UUID, etag: str, body: bytes, generation: Optional[int] = None) -> CachedProfile:
+        """Store a profile; with ``generation`` only if nothing was invalidated since it was read."""
+        entry = CachedProfile(etag, body, time.monotonic())
+        if not self.enabled:
+            return entry
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return entry
+            self._entries[user_id] = entry
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, user_id: UUID):
+        with self._lock:
+            self.generation += 1
+            if self._entries.pop(user_id, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def record(self, outcome: str, seconds: float):
+        self.latency[outcome].add(seconds)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            "invalidations": self.invalidations,
+            "latency": {outcome: window.percentiles() for outcome, window in self.latency.items()},
+        }
+
+
+class ProfileInvalidationListener:
+    """LISTENs on PROFILE_CACHE_CHANNEL and evicts the ids other replicas changed."""
+
+    def __init__(self, cache: ProfileCache, engine, channel: str = PROFILE_CACHE_CHANNEL, reconnect_delay: float = 5.0):
+        self.cache = cache
+        self.engine = engine
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _connect(self):
+        connection = self.engine.raw_connection()
+        dbapi_connection = connection.driver_connection
+        # Keep the LISTEN session out of the request pool
+        connection.detach()
+        dbapi_connection.autocommit = True
+        with dbapi_connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {self.channel}")
+        return dbapi_connection
+
+    def _listen(self, dbapi_connection):
+        while not self._stop.is_set():
+            if select.select([dbapi_connection], [], [], 1.0)[0]:
+                dbapi_connection.poll()
+                while dbapi_connection.notifies:
+                    notify = dbapi_connection.notifies.pop(0)
+                    try:
+                        self.cache.invalidate(UUID(notify.payload))
+                    except ValueError:
+                        logger.warning("Ignoring profile invalidation %r", notify.payload)
+
+    def _run(self):
+        while not self._stop.is_set():
+            dbapi_connection = None
+            try:
+                dbapi_connection = self._connect()
+                # Anything changed while we were not listening is unknown
+                self.cache.clear()
+                self._listen(dbapi_connection)
+            except Exception:
+                logger.exception("Profile invalidation listener failed; reconnecting")
+                self.cache.clear()
+                self._stop.wait(self.reconnect_delay)
+            finally:
+                if dbapi_connection is not None:
+                    try:
+                        dbapi_connection.close()
+                    except Exception:
+                        pass
+
+    def start(self):
+        if self._thread is not None or not self.cache.enabled:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="profile-cache-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+profile_cache = ProfileCache()
+
+
+def build_invalidation_listener() -> Optional[ProfileInvalidationListener]:
+    if PROFILE_CACHE_INVALIDATION == "off":
+        return None
+    from database import engine
+    return ProfileInvalidationListener(profile_cache, engine)
+
+
+invalidation_listener = build_invalidation_listener()
@@ -1,42 +1,187 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+import io
+import time
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import delete, func, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from database import get_db
+from database import DbSession, SessionLocal, get_db, run_db
 from models import User
-from schemas import UserCreate, UserUpdate, UserResponse
+from schemas import UserCreate, UserUpdate, UserResponse, UserBatchRequest, UserImportResponse
+from bulk_import import IMPORT_COLUMNS, InvalidRoster, import_users_csv
+from profile_cache import PROFILE_CACHE_CHANNEL, etag_matches, profile_cache, profile_etag
 from uuid import UUID
+from typing import List, Optional
 from datetime import datetime
+from shared.tokens import ServiceCredential, TokenVerifier
 
 user_router = APIRouter()
 
-@user_router.post("/", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
-def create_user(user: UserCreate, db: Session = Depends(get_db)):
-    existing_email = db.query(User).filter(User.email == user.email).first()
-    if existing_email:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Email already registered"
-        )
-
-    existing_dni = db.query(User).filter(User.dni == user.dni).first()
-    if existing_dni:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="DNI already registered"
-        )
+# Verifies signed access tokens locally; POST / stays open for Auth Service.
+token_verifier = TokenVerifier.from_env()
+# Guards the internal-only routes (DELETE /{user_id}, POST /import)
+service_credential = ServiceCredential.from_env()
+
+# Unique constraints/indexes on users, matched by column name so both the
+# migration names (users_email_key) and create_all names (ix_..._email) work
+UNIQUE_VIOLATIONS = (
+    ("email", "Email already registered"),
+    ("dni", "DNI already registered"),
+)
+
+def _violated_constraint(error: IntegrityError) -> str:
+    # psycopg2 reports it in orig.diag; asyncpg on the exception it was translated from
+    diag = getattr(error.orig, "diag", None) or error.orig.__cause__
+    return getattr(diag, "constraint_name", None) or ""
+
+def _unique_violation(error: IntegrityError) -> HTTPException:
+    constraint = _violated_constraint(error)
+    detail = "User already exists"
+    for column, message in UNIQUE_VIOLATIONS:
+        if column in constraint:
+            detail = message
+            break
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail=detail
+    )
+
+def _cache_profile(response: UserResponse, generation: Optional[int] = None):
+    body = response.model_dump_json().encode("utf-8")
+    return profile_cache.put(response.id, profile_etag(response.id, response.updated_at), body, generation)
+
+def _profile_response(entry, if_none_match: Optional[str]) -> Response:
+    # Clients must revalidate, which is cheap: a matching ETag is a 304 from memory
+    headers = {"ETag": entry.etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(if_none_match, entry.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
 
+@user_router.post("/", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
+async def create_user(
+    user: UserCreate,
+    db: DbSession = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None),
+):
+    return await run_db(db, _create_user, user, idempotency_key)
+
+def _create_user(db: Session, user: UserCreate, idempotency_key: Optional[str]) -> UserResponse:
+    # A single INSERT ... RETURNING; the unique indexes decide about duplicates
     data = user.model_dump()
     if data.get("id") is None:
         del data["id"]
-    new_user = User(**data)
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
-
-    return new_user
+    try:
+        new_user = db.execute(insert(User).values(**data).returning(User)).scalar_one()
+        response = UserResponse.model_validate(new_user)
+        db.commit()
+    except IntegrityError as e:
+        db.rollback()
+        # Auth Service retries profile delivery with the user id as Idempotency-Key;
+        # a replay of a create that already succeeded returns the stored profile
+        if idempotency_key and user.id and idempotency_key == str(user.id):
+            existing_user = db.query(User).filter(User.id == user.id).first()
+            if existing_user and existing_user.email == user.email:
+                return UserResponse.model_validate(existing_user)
+        raise _unique_violation(e)
+
+    return response
+
+@user_router.post("/validate", status_code=status.HTTP_204_NO_CONTENT)
+async def validate_user(user: UserCreate, db: DbSession = Depends(get_db)):
+    """Answer 400 with the create error a profile would get, without creating it.
+
+    Auth Service calls this before committing a registration in outbox mode,
+    so a duplicate email or DNI is reported to the client instead of being
+    found by the dispatcher after the account exists.
+    """
+    taken = await run_db(db, _taken_columns, user.email, user.dni)
+    for column, message in UNIQUE_VIOLATIONS:
+        if column in taken:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=message
+            )
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+def _taken_columns(db: Session, email: str, dni: str) -> set:
+    rows = db.query(User.email, User.dni).filter(or_(User.email == email, User.dni == dni)).limit(2).all()
+    taken = set()
+    for row in rows:
+        if row.email == email:
+            taken.add("email")
+        if row.dni == dni:
+            taken.add("dni")
+    return taken
+
+@user_router.post(
+    "/import", response_model=UserImportResponse, dependencies=[Depends(service_credential.dependency)]
+)
+async def import_users(request: Request):
+    """Bulk-create users from a CSV roster (text/csv body, header row required).
+
+    Internal only: a user's access token, however valid, is not enough.
+    Rows whose email or DNI is already registered are skipped, not rejected.
+    COPY goes through psycopg2, so the import uses a sync session on the
+    threadpool in either DATABASE_MODE.
+    """
+    body = await request.body()
+    if not body.strip():
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Empty roster"
+        )
 
-@user_router.get("/{user_id}", response_model=UserResponse)
-def get_user(user_id: UUID, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == user_id).first()
+    def run_import():
+        with SessionLocal() as db:
+            try:
+                result = import_users_csv(db, io.BytesIO(body))
+                db.commit()
+                return result
+            except InvalidRoster as e:
+                db.rollback()
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Invalid roster (expected {','.join(IMPORT_COLUMNS)}): {e}"
+                )
+
+    result = await run_in_threadpool(run_import)
+    return UserImportResponse(received=result.received, inserted=result.inserted, skipped=result.skipped)
+
+@user_router.post("/batch", response_model=List[UserResponse], dependencies=[Depends(token_verifier.dependency)])
+async def get_users_batch(request: UserBatchRequest, db: DbSession = Depends(get_db)):
+    """Profiles for up to 500 ids in one primary key lookup; unknown ids are left out."""
+    if not request.ids:
+        return []
+    return await run_db(db, _get_users_batch, set(request.ids))
+
+def _get_users_batch(db: Session, ids: set) -> List[User]:
+    return db.query(User).filter(User.id.in_(ids)).all()
+
+@user_router.get("/cache/stats")
+def profile_cache_stats():
+    """Hit ratio and GET /{user_id} latency percentiles of this replica's profile cache."""
+    return profile_cache.stats()
+
+@user_router.head("/{user_id}", dependencies=[Depends(token_verifier.dependency)])
+async def user_exists(user_id: UUID, db: DbSession = Depends(get_db)):
+    """Existence check for other services: probes the primary key and returns no body."""
+    found = profile_cache.peek(user_id) or await run_db(db, _user_found, user_id)
+    return Response(status_code=status.HTTP_200_OK if found else status.HTTP_404_NOT_FOUND)
+
+def _user_found(db: Session, user_id: UUID) -> bool:
+    return db.query(User.id).filter(User.id == user_id).first() is not None
+
+@user_router.get("/{user_id}", response_model=UserResponse, dependencies=[Depends(token_verifier.dependency)])
+async def get_user(user_id: UUID, db: DbSession = Depends(get_db), if_none_match: Optional[str] = Header(None)):
+    started = time.perf_counter()
+    entry = profile_cache.get(user_id)
+    if entry is not None:
+        response = _profile_response(entry, if_none_match)
+        profile_cache.record("hit", time.perf_counter() - started)
+        return response
+
+    generation = profile_cache.generation
+    user = await run_db(db, _get_user, user_id)
 
     if not user:
         raise HTTPException(
@@ -44,41 +189,60 @@ def get_user(user_id: UUID, db: Session = Depends(get_db)):
             detail="User not found"
         )
 
-    return user
+    response = _profile_response(_cache_profile(user, generation), if_none_match)
+    profile_cache.record("miss", time.perf_counter() - started)
+    return response
 
-@user_router.put("/{user_id}", response_model=UserResponse)
-def update_user(user_id: UUID, user_update: UserUpdate, db: Session = Depends(get_db)):
+def _get_user(db: Session, user_id: UUID) -> Optional[UserResponse]:
     user = db.query(User).filter(User.id == user_id).first()
+    return UserResponse.model_validate(user) if user else None
 
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="User not found"
-        )
+@user_router.put("/{user_id}", response_model=UserResponse, dependencies=[Depends(token_verifier.dependency)])
+async def update_user(user_id: UUID, user_update: UserUpdate, db: DbSession = Depends(get_db)):
+    response = await run_db(db, _update_user, user_id, user_update)
+    _cache_profile(response)
+    return response
 
+def _update_user(db: Session, user_id: UUID, user_update: UserUpdate) -> UserResponse:
     update_data = user_update.model_dump(exclude_unset=True)
+    update_data["updated_at"] = datetime.utcnow()
 
-    if "email" in update_data and update_data["email"] != user.email:
-        existing = db.query(User).filter(User.email == update_data["email"]).first()
-        if existing:
+    try:
+        user = db.execute(
+            update(User).where(User.id == user_id).values(**update_data).returning(User)
+        ).scalar_one_or_none()
+        if not user:
             raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Email already registered"
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="User not found"
             )
-
-    if "dni" in update_data and update_data["dni"] != user.dni:
-        existing = db.query(User).filter(User.dni == update_data["dni"]).first()
-        if existing:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="DNI already registered"
-            )
-
-    for key, value in update_data.items():
-        setattr(user, key, value)
-
-    user.updated_at = datetime.utcnow()
+        response = UserResponse.model_validate(user)
+        # Delivered to the other replicas' listeners only if the update commits
+        db.execute(select(func.pg_notify(PROFILE_CACHE_CHANNEL, str(user_id))))
+        db.commit()
+    except IntegrityError as e:
+        db.rollback()
+        raise _unique_violation(e)
+    return response
+
+@user_router.delete(
+    "/{user_id}", status_code=status.HTTP_204_NO_CONTENT, dependencies=[Depends(service_credential.dependency)]
+)
+async def delete_user(user_id: UUID, db: DbSession = Depends(get_db)):
+    """Remove a profile. Internal only: Auth Service undoes a profile whose account was never created."""
+    if not await run_db(db, _delete_user, user_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found"
+        )
+    profile_cache.invalidate(user_id)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+def _delete_user(db: Session, user_id: UUID) -> bool:
+    deleted = db.execute(delete(User).where(User.id == user_id).returning(User.id)).scalar_one_or_none()
+    if deleted is None:
+        db.rollback()
+        return False
+    db.execute(select(func.pg_notify(PROFILE_CACHE_CHANNEL, str(user_id))))
     db.commit()
-    db.refresh(user)
-
-    return user
+    return True
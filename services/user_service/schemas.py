@@ -1,7 +1,7 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 from datetime import datetime, date
 from uuid import UUID
-from typing import Optional
+from typing import List, Optional
 
 class UserCreate(BaseModel):
     id: Optional[UUID] = None  # When set (e.g. by auth service), use this as user id to link with auth_users
@@ -20,6 +20,14 @@ class UserUpdate(BaseModel):
     phone: Optional[str] = None
     birth_date: Optional[date] = None
 
+class UserBatchRequest(BaseModel):
+    ids: List[UUID] = Field(..., max_length=500)
+
+class UserImportResponse(BaseModel):
+    received: int
+    inserted: int
+    skipped: int
+
 class UserResponse(BaseModel):
     id: UUID
     first_name: str
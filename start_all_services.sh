@@ -21,6 +21,17 @@ if command_exists python; then
     PYTHON_CMD="python"
 fi
 
+# Apply the schema migrations first: the services no longer create tables or seed data
+# (DATABASE_URL from the environment or services/catalog_service/.env)
+echo "Applying database migrations..."
+if [ ! -f "services/catalog_service/.env" ] && [ -f "services/catalog_service/.env.example" ]; then
+    cp services/catalog_service/.env.example services/catalog_service/.env
+fi
+if ! (cd services/catalog_service && PYTHONPATH="..${PYTHONPATH:+:$PYTHONPATH}" $PYTHON_CMD -m shared.migrate --dir ../../database/migrations); then
+    echo "Error: migrations failed, not starting the services"
+    exit 1
+fi
+
 # Array of services with their directories and ports
 declare -a services=(
     "auth_service:8001"
@@ -53,8 +64,8 @@ for service_info in "${services[@]}"; do
         fi
     fi
 
-    # Start the service in background
-    $PYTHON_CMD main.py > "../../logs/${service}.log" 2>&1 &
+    # Start the service in background (services/ on the path for the shared package)
+    PYTHONPATH="..${PYTHONPATH:+:$PYTHONPATH}" $PYTHON_CMD main.py > "../../logs/${service}.log" 2>&1 &
     SERVICE_PID=$!
     echo "$service started with PID $SERVICE_PID"
 
@@ -0,0 +1,107 @@
+"""Card number checks: the Luhn digit, BinTable network lookups and the PaymentRequest validator."""
+import uuid
+
+import pytest
+from pydantic import ValidationError
+
+from conftest import import_service
+
+card_bins, schemas = import_service("payment_service", "card_bins", "schemas")
+
+VISA = "4532123456789014"
+
+
+def with_check_digit(body: str) -> str:
+    """Append the digit that makes ``body`` pass the Luhn check."""
+    for digit in "0123456789":
+        if card_bins.luhn_valid(body + digit):
+            return body + digit
+    raise AssertionError(body)
+
+
+def to_script(number: str, zero: str) -> str:
+    return "".join(chr(ord(zero) + int(char)) for char in number)
+
+
+def test_luhn_accepts_valid_and_rejects_a_mistyped_digit():
+    assert card_bins.luhn_valid(VISA)
+    assert card_bins.luhn_valid("0")
+    assert not card_bins.luhn_valid("4532123456789015")
+    assert not card_bins.luhn_valid("4532123456789041")  # swapped last two digits
+
+
+@pytest.mark.parametrize("number", [
+    to_script(VISA, "٠"),  # Arabic-Indic
+    to_script(VISA, "０"),  # fullwidth
+    to_script(VISA, "०"),  # Devanagari
+    VISA[:-1] + "²",  # superscript two, isdigit() but not a decimal digit
+    "",
+    "4532 1234 5678 9014",
+    "-4532123456789014",
+])
+def test_luhn_rejects_anything_but_ascii_digits(number):
+    assert not card_bins.luhn_valid(number)
+
+
+@pytest.mark.parametrize("number,network", [
+    (VISA, "Visa"),
+    ("5105105105105100", "Mastercard"),
+    ("2221000000000009", "Mastercard"),
+    ("2720990000000007", "Mastercard"),
+    ("378282246310005", "American Express"),
+    ("6011111111111117", "Discover"),
+    # Discover's 622126-622925 sits inside UnionPay's 62; the narrower range wins
+    ("6221260000000000", "Discover"),
+    ("6229250000000000", "Discover"),
+    ("6221250000000000", "UnionPay"),
+    ("6229260000000000", "UnionPay"),
+    ("3530111333300000", "JCB"),
+    ("9999999999999999", "Unknown"),
+])
+def test_shipped_table_networks(number, network):
+    assert card_bins.bin_table.network(number) == network
+
+
+def test_lookup_of_a_number_shorter_than_the_prefix():
+    assert card_bins.bin_table.network("4") == "Visa"
+    assert card_bins.bin_table.lookup("9") is None
+
+
+def test_overlaps_resolve_to_the_narrowest_range_and_neighbours_merge():
+    wide = card_bins.BinRange("Wide", (16,))
+    narrow = card_bins.BinRange("Narrow", (16,))
+    table = card_bins.BinTable([
+        (10_000_000, 19_999_999, wide),
+        (12_000_000, 12_999_999, narrow),
+        (20_000_000, 29_999_999, wide),
+    ])
+    assert [table.network(prefix) for prefix in ("11", "12", "13", "25", "30")] == [
+        "Wide", "Narrow", "Wide", "Wide", "Unknown"]
+    # 10-11, 12, 13-29: the rest of the first wide range merges with the adjacent second one
+    assert len(table) == 3
+
+
+def test_csv_with_uneven_range_bounds_is_refused(tmp_path):
+    path = tmp_path / "bins.csv"
+    path.write_text("# comment\nstart,end,network,lengths\n4,45,Visa,16\n")
+    with pytest.raises(ValueError, match="Bad BIN range"):
+        card_bins.BinTable.from_csv(str(path))
+
+
+def payment(card_number: str):
+    return schemas.PaymentRequest(
+        user_id=uuid.uuid4(), amount=10, card_number=card_number, card_holder="X", expiry_date="12/30", cvv="123")
+
+
+def test_payment_request_normalises_spaces_and_dashes():
+    assert payment("4532 1234-5678 9014").card_number == VISA
+
+
+@pytest.mark.parametrize("card_number,message", [
+    (to_script(VISA, "٠"), "Invalid card number"),
+    ("4532123456789015", "Invalid card number"),
+    (with_check_digit("378282246310005"), "Invalid card number length for American Express"),
+])
+def test_payment_request_rejects(card_number, message):
+    with pytest.raises(ValidationError, match=message):
+        payment(card_number)
@@ -0,0 +1,71 @@
+"""LoginThrottle with the in-memory backend: sliding window estimate and Retry-After."""
+import pytest
+
+from conftest import import_service
+
+(login_throttle,) = import_service("auth_service", "login_throttle")
+
+WINDOW = 60.0
+
+
+def throttle(**kwargs):
+    options = dict(window=WINDOW, max_per_email=10, max_per_ip=100)
+    options.update(kwargs)
+    return login_throttle.LoginThrottle(login_throttle.MemoryCounterBackend(shards=4), **options)
+
+
+def attempts(limiter, count: int, now: float, email: str = "a@x.co", ip=None):
+    return [limiter.check(email, ip, now=now) for _ in range(count)]
+
+
+def test_limit_within_one_window():
+    limiter = throttle()
+    assert attempts(limiter, 10, now=10.0) == [None] * 10
+    # Over the limit in this window alone: wait for the next window
+    assert limiter.check("a@x.co", None, now=15.0) == 45
+
+
+def test_previous_window_fades_linearly():
+    limiter = throttle()
+    attempts(limiter, 10, now=50.0)
+    # Halfway into the next window the 10 old attempts count as 5
+    assert attempts(limiter, 5, now=90.0) == [None] * 5
+    # 5 + 6 = 11: wait until the old window weighs 4, at 60 * 0.6 = 36s in
+    assert limiter.check("a@x.co", None, now=90.0) == 6
+
+
+def test_window_before_the_previous_one_is_forgotten():
+    limiter = throttle()
+    attempts(limiter, 20, now=10.0)
+    assert attempts(limiter, 10, now=130.0) == [None] * 10
+
+
+def test_email_is_case_insensitive_and_counted_apart_from_other_emails():
+    limiter = throttle()
+    attempts(limiter, 10, now=0.0, email="A@X.co")
+    assert limiter.check("a@x.co", None, now=0.0) is not None
+    assert limiter.check("b@x.co", None, now=0.0) is None
+
+
+def test_ip_limit_spans_emails_and_longest_wait_wins():
+    limiter = throttle(max_per_ip=3)
+    results = [limiter.check(f"user{n}@x.co", "10.0.0.1", now=30.0) for n in range(4)]
+    assert results == [None, None, None, 30]
+    assert limiter.check("user9@x.co", "10.0.0.2", now=30.0) is None
+
+
+@pytest.mark.parametrize("previous,current,elapsed,expected", [
+    (10, 0, 0.0, 10.0),
+    (10, 4, 30.0, 9.0),
+    (10, 4, 60.0, 4.0),
+])
+def test_sliding_estimate(previous, current, elapsed, expected):
+    assert login_throttle.sliding_estimate(previous, current, elapsed, WINDOW) == expected
+
+
+def test_full_shard_evicts_keys_idle_for_two_windows():
+    backend = login_throttle.MemoryCounterBackend(shards=1, max_keys_per_shard=2)
+    backend.hit("old", WINDOW, now=0.0)
+    backend.hit("recent", WINDOW, now=70.0)
+    backend.hit("new", WINDOW, now=130.0)
+    assert set(backend._shards[0]) == {"recent", "new"}
@@ -0,0 +1,55 @@
+"""
+PasswordHasher slots: login for an unknown email (equalize) must queue and
+give up exactly like a verify, or a 503 would tell which emails exist.
+"""
+import asyncio
+
+import pytest
+
+from conftest import import_service
+
+(password_hashing,) = import_service("auth_service", "password_hashing")
+
+HASHED = password_hashing.hash_password("secret", rounds=4)
+
+
+def hasher(**kwargs):
+    options = dict(rounds=4, workers=1, max_pending=0, queue_timeout=0.05, default_verify_seconds=0.2)
+    options.update(kwargs)
+    return password_hashing.PasswordHasher(**options)
+
+
+@pytest.mark.parametrize("holder", ["verify", "equalize"])
+def test_unknown_and_known_emails_are_turned_away_alike(holder):
+    async def scenario():
+        slots = hasher()
+        if holder == "verify":
+            # Slow enough to still hold the only slot while the others arrive
+            running = asyncio.ensure_future(slots.verify("secret", password_hashing.hash_password("secret", rounds=10)))
+        else:
+            running = asyncio.ensure_future(slots.equalize())
+        await asyncio.sleep(0.01)
+        outcomes = []
+        for attempt in (slots.equalize(), slots.verify("secret", HASHED)):
+            try:
+                await attempt
+                outcomes.append("served")
+            except password_hashing.PasswordHasherBusy:
+                outcomes.append("busy")
+        await running
+        return outcomes
+
+    assert asyncio.run(scenario()) == ["busy", "busy"]
+
+
+def test_equalize_waits_for_a_slot_then_as_long_as_a_verify():
+    async def scenario():
+        slots = hasher(max_pending=4, queue_timeout=1.0)
+        slots._verify_seconds = 0.1
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await asyncio.gather(slots.equalize(), slots.equalize())
+        return loop.time() - started
+
+    # One slot: the second caller queues behind the first
+    assert asyncio.run(scenario()) >= 0.2
@@ -0,0 +1,54 @@
+"""
+HttpPaymentGateway answers, served by an httpx MockTransport: only a
+readable 200 or 402 is a decision, anything else is a GatewayError.
+"""
+import asyncio
+
+import httpx
+import pytest
+
+from conftest import import_service
+
+(gateway,) = import_service("payment_service", "gateway")
+
+REQUEST = gateway.AuthorisationRequest("TXN-1", 10.0, "4242", "visa")
+
+
+def authorise(status_code: int, **response):
+    def handler(request: httpx.Request) -> httpx.Response:
+        assert request.headers["Idempotency-Key"] == "TXN-1"
+        return httpx.Response(status_code, **response)
+
+    async def call():
+        http_gateway = gateway.HttpPaymentGateway(base_url="http://gateway.test")
+        http_gateway._client = httpx.AsyncClient(base_url="http://gateway.test", transport=httpx.MockTransport(handler))
+        http_gateway._slots = asyncio.Semaphore(1)
+        try:
+            return await http_gateway.authorise(REQUEST)
+        finally:
+            await http_gateway.close()
+
+    return asyncio.run(call())
+
+
+def test_approval_and_decline_are_decisions():
+    assert authorise(200, json={"approved": True, "reference": "G-1"}) == gateway.GatewayDecision(True, "G-1")
+    assert authorise(402, json={"reason": "insufficient_funds"}) == gateway.GatewayDecision(
+        False, decline_reason="insufficient_funds")
+
+
+@pytest.mark.parametrize("status_code", [200, 402])
+def test_undecodable_body_is_no_decision(status_code):
+    with pytest.raises(gateway.GatewayError):
+        authorise(status_code, content=b"<html>Bad gateway</html>", headers={"Content-Type": "text/html"})
+
+
+@pytest.mark.parametrize("status_code", [200, 402])
+def test_non_object_body_is_no_decision(status_code):
+    with pytest.raises(gateway.GatewayError):
+        authorise(status_code, json=["approved"])
+
+
+def test_server_error_is_no_decision():
+    with pytest.raises(gateway.GatewayError, match="HTTP 500"):
+        authorise(500, json={"approved": True})
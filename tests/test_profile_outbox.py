@@ -0,0 +1,160 @@
+"""
+OutboxDispatcher against a stub User Service on a local port, with the
+outbox in an in-memory SQLite database. The stub answers by DNI: "dup" is
+rejected like a duplicate, "down" fails with 503, anything else is created.
+"""
+import json
+import threading
+import uuid
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from conftest import import_service
+from shared.service_clients import UserServiceClient
+
+models, profile_outbox = import_service("auth_service", "models", "profile_outbox")
+AuthUser, ProfileOutbox = models.AuthUser, models.ProfileOutbox
+
+
+@compiles(UUID, "sqlite")
+def compile_uuid(type_, compiler, **kw):
+    return "CHAR(32)"
+
+
+class StubUserService(BaseHTTPRequestHandler):
+    received = []
+    # Set by a test to look at the outbox while a delivery is in flight
+    on_request = None
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        StubUserService.received.append((self.headers.get("Idempotency-Key"), payload))
+        if StubUserService.on_request is not None:
+            StubUserService.on_request(payload)
+        if payload["dni"] == "dup":
+            self._answer(400, {"detail": "DNI already registered"})
+        elif payload["dni"] == "down":
+            self._answer(503, {"detail": "Service Unavailable"})
+        else:
+            self._answer(201, payload)
+
+    def _answer(self, status: int, body: dict):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def stub_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubUserService)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/"
+    server.shutdown()
+
+
+@pytest.fixture
+def session_factory():
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+
+    @event.listens_for(engine, "connect")
+    def attach_schema(dbapi_connection, _):
+        dbapi_connection.execute("ATTACH DATABASE ':memory:' AS auth_service")
+
+    AuthUser.__table__.create(engine)
+    ProfileOutbox.__table__.create(engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+@pytest.fixture
+def dispatcher(stub_url, session_factory):
+    StubUserService.received = []
+    StubUserService.on_request = None
+    client = UserServiceClient(stub_url, retries=0, timeout=2, default_deadline=2)
+    return profile_outbox.OutboxDispatcher(max_attempts=2, client=client, session_factory=session_factory)
+
+
+def queue_profile(session_factory, dni: str) -> uuid.UUID:
+    user_id = uuid.uuid4()
+    with session_factory() as db:
+        db.add(AuthUser(id=user_id, email=f"{user_id.hex[:8]}@x.co", password_hash="x"))
+        db.add(ProfileOutbox(user_id=user_id, payload={
+            "id": str(user_id), "email": f"{user_id.hex[:8]}@x.co", "first_name": "A", "last_name": "B", "dni": dni,
+        }))
+        db.commit()
+    return user_id
+
+
+def outbox_row(session_factory, user_id):
+    with session_factory() as db:
+        return db.query(ProfileOutbox).filter(ProfileOutbox.user_id == user_id).first()
+
+
+def account_exists(session_factory, user_id) -> bool:
+    with session_factory() as db:
+        return db.query(AuthUser).filter(AuthUser.id == user_id).first() is not None
+
+
+def test_delivered_profile_leaves_the_outbox(dispatcher, session_factory):
+    user_id = queue_profile(session_factory, "12345678")
+
+    assert dispatcher.run_once() == 1
+    assert StubUserService.received == [(str(user_id), StubUserService.received[0][1])]
+    assert outbox_row(session_factory, user_id) is None
+    assert account_exists(session_factory, user_id)
+
+
+def test_unavailable_user_service_is_retried_with_backoff_then_given_up(dispatcher, session_factory):
+    user_id = queue_profile(session_factory, "down")
+
+    assert dispatcher.run_once() == 0
+    row = outbox_row(session_factory, user_id)
+    assert (row.status, row.attempts) == ("pending", 1)
+    assert row.next_attempt_at > datetime.utcnow()
+    assert dispatcher.run_once() == 0  # not due yet
+    assert len(StubUserService.received) == 1
+
+    with session_factory() as db:
+        db.query(ProfileOutbox).update({ProfileOutbox.next_attempt_at: datetime.utcnow() - timedelta(seconds=1)})
+        db.commit()
+    dispatcher.run_once()
+    row = outbox_row(session_factory, user_id)
+    assert (row.status, row.attempts, row.last_error) == ("failed", 2, "HTTP 503")
+    assert account_exists(session_factory, user_id)
+
+
+def test_rejected_profile_removes_the_account(dispatcher, session_factory):
+    user_id = queue_profile(session_factory, "dup")
+
+    assert dispatcher.run_once() == 0
+    row = outbox_row(session_factory, user_id)
+    assert (row.status, row.last_error) == ("failed", "DNI already registered")
+    assert not account_exists(session_factory, user_id)
+
+
+def test_row_is_leased_not_locked_while_user_service_is_called(dispatcher, session_factory):
+    user_id = queue_profile(session_factory, "12345678")
+    seen = []
+
+    def inspect_outbox(payload):
+        # Another dispatcher polling now must neither block nor see the row as due
+        with session_factory() as db:
+            row = db.query(ProfileOutbox).filter(ProfileOutbox.user_id == user_id).one()
+            seen.append(row.next_attempt_at > datetime.utcnow())
+
+    StubUserService.on_request = inspect_outbox
+    assert dispatcher.run_once() == 1
+    assert seen == [True]
@@ -0,0 +1,103 @@
+"""
+Unit tests for shared.query_profiler. No PostgreSQL needed: the engine
+tests use an in-memory SQLite database. The per-endpoint budgets
+themselves are checked against PostgreSQL by benchmarks/query_budgets.py.
+"""
+import pytest
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+
+from shared.query_profiler import (
+    QueryBudgetExceeded,
+    QueryProfile,
+    QueryProfilerMiddleware,
+    assert_max_queries,
+    normalize,
+    watch_engine,
+)
+
+
+@pytest.mark.parametrize("statement, shape", [
+    ("SELECT * FROM users WHERE id = 42", "SELECT * FROM users WHERE id = ?"),
+    ("SELECT * FROM users WHERE email = 'a@b.co'", "SELECT * FROM users WHERE email = ?"),
+    ("SELECT * FROM users WHERE name = 'O''Brien'", "SELECT * FROM users WHERE name = ?"),
+    ("SELECT * FROM users WHERE id = %(id_1)s", "SELECT * FROM users WHERE id = ?"),
+    ("SELECT * FROM users WHERE id = %s", "SELECT * FROM users WHERE id = ?"),
+    ("SELECT * FROM users WHERE id = $1", "SELECT * FROM users WHERE id = ?"),
+    ("SELECT * FROM users WHERE amount > 10.50", "SELECT * FROM users WHERE amount > ?"),
+    ("SELECT * FROM users WHERE id IN ($1, $2, $3)", "SELECT * FROM users WHERE id IN (...)"),
+    ("SELECT * FROM users WHERE id in (%(a)s,%(b)s)", "SELECT * FROM users WHERE id IN (...)"),
+    ("SELECT *\n  FROM users\n WHERE id = 1", "SELECT * FROM users WHERE id = ?"),
+])
+def test_normalize(statement, shape):
+    assert normalize(statement) == shape
+
+
+def test_normalize_keeps_digits_inside_identifiers():
+    assert normalize("SELECT users_1.id FROM users AS users_1") == "SELECT users_1.id FROM users AS users_1"
+
+
+def test_normalize_merges_in_lists_of_any_length():
+    assert normalize("SELECT 1 WHERE id IN ($1)") == normalize("SELECT 1 WHERE id IN ($1, $2, $3, $4)")
+
+
+def test_repeated_reports_shapes_over_threshold_most_common_first():
+    profile = QueryProfile()
+    for _ in range(7):
+        profile.record("SELECT * FROM doctors WHERE id = ?", 0.001)
+    for _ in range(6):
+        profile.record("SELECT * FROM specialties WHERE id = ?", 0.001)
+    for _ in range(5):
+        profile.record("SELECT * FROM users WHERE id = ?", 0.001)
+
+    assert profile.queries == 18
+    assert profile.repeated(threshold=5) == [
+        ("SELECT * FROM doctors WHERE id = ?", 7),
+        ("SELECT * FROM specialties WHERE id = ?", 6),
+    ]
+    assert profile.repeated(threshold=7) == []
+
+
+@pytest.fixture(scope="module")
+def engine():
+    engine = create_engine("sqlite://")
+    watch_engine(engine, "test")
+    yield engine
+    engine.dispose()
+
+
+def test_assert_max_queries_counts_direct_calls(engine):
+    with engine.connect() as connection:
+        with assert_max_queries(2):
+            connection.execute(text("SELECT 1"))
+            connection.execute(text("SELECT 2"))
+        with pytest.raises(QueryBudgetExceeded, match=r"3 x SELECT \?"):
+            with assert_max_queries(2):
+                for number in range(3):
+                    connection.execute(text(f"SELECT {number}"))
+
+
+def test_assert_max_queries_checks_each_request_of_a_route(engine):
+    app = FastAPI()
+    app.add_middleware(QueryProfilerMiddleware, service="test")
+
+    def connection():
+        with engine.connect() as connection:
+            yield connection
+
+    @app.get("/items")
+    def items(connection=Depends(connection)):
+        return [connection.execute(text(f"SELECT {number}")).scalar() for number in range(3)]
+
+    @app.get("/item")
+    def item(connection=Depends(connection)):
+        return connection.execute(text("SELECT 1")).scalar()
+
+    client = TestClient(app)
+    with assert_max_queries(1, route="/item"):
+        client.get("/item")
+        client.get("/items")
+    with pytest.raises(QueryBudgetExceeded, match="/items ran over its budget of 2"):
+        with assert_max_queries(2):
+            client.get("/items")
@@ -0,0 +1,135 @@
+"""Signed access tokens (shared/tokens.py): decoding and the revocation deny-list."""
+import base64
+import hashlib
+import hmac
+import json
+import time
+import uuid
+
+import pytest
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+
+from shared.tokens import InvalidToken, RevocationList, TokenVerifier, decode_access_token, issue_access_token
+
+SECRET = b"token-secret"
+
+
+def sign(payload, secret: bytes = SECRET) -> str:
+    """Build a token by hand, the way an older release or an attacker would."""
+    body = base64.urlsafe_b64encode(json.dumps(payload).encode("utf-8")).rstrip(b"=").decode("ascii")
+    signature = base64.urlsafe_b64encode(hmac.new(secret, body.encode("ascii"), hashlib.sha256).digest())
+    return f"{body}.{signature.rstrip(b'=').decode('ascii')}"
+
+
+def verifier() -> TokenVerifier:
+    return TokenVerifier(SECRET.decode("ascii"), revocations=RevocationList())
+
+
+def test_issued_token_round_trips():
+    user_id = uuid.uuid4()
+    token, claims = issue_access_token(user_id, SECRET, 900, now=1_000_000)
+    assert claims == (user_id, claims.jti, 1_000_900, 1_000_000)
+    assert decode_access_token(token, SECRET, now=1_000_899) == claims
+
+
+def test_expired_token_is_rejected():
+    token, _ = issue_access_token(uuid.uuid4(), SECRET, 900, now=1_000_000)
+    with pytest.raises(InvalidToken, match="expired"):
+        decode_access_token(token, SECRET, now=1_000_900)
+
+
+def test_token_signed_with_another_key_is_rejected():
+    token, _ = issue_access_token(uuid.uuid4(), b"another-secret", 900)
+    with pytest.raises(InvalidToken, match="Bad signature"):
+        decode_access_token(token, SECRET)
+
+
+def test_forged_payload_is_rejected():
+    # Someone else's user id with the signature of one's own token
+    token, _ = issue_access_token(uuid.uuid4(), SECRET, 900)
+    forged_body = sign({"sub": str(uuid.uuid4()), "exp": int(time.time()) + 900, "jti": "x"}).split(".")[0]
+    with pytest.raises(InvalidToken, match="Bad signature"):
+        decode_access_token(f"{forged_body}.{token.split('.')[1]}", SECRET)
+
+
+@pytest.mark.parametrize("payload", [
+    {"exp": 2_000_000_000, "jti": "x"},
+    {"sub": "not-a-uuid", "exp": 2_000_000_000, "jti": "x"},
+    {"sub": str(uuid.UUID(int=1)), "exp": "soon", "jti": "x"},
+    ["not", "an", "object"],
+])
+def test_signed_but_malformed_payload_is_rejected(payload):
+    with pytest.raises(InvalidToken, match="Malformed"):
+        decode_access_token(sign(payload), SECRET)
+
+
+@pytest.mark.parametrize("token", ["", "no-dot", "body.", ".signature", "!!!.!!!"])
+def test_garbage_is_rejected(token):
+    with pytest.raises(InvalidToken):
+        decode_access_token(token, SECRET)
+
+
+def test_revoked_jti_is_rejected():
+    token, claims = issue_access_token(uuid.uuid4(), SECRET, 900)
+    tokens = verifier()
+    tokens.revocations.add(claims.jti, claims.expires_at)
+    with pytest.raises(InvalidToken, match="revoked"):
+        tokens.verify(token)
+
+
+def test_dependency_rejects_a_bad_signed_token_but_passes_opaque_ones():
+    tokens = verifier()
+    bad, _ = issue_access_token(uuid.uuid4(), b"another-secret", 900)
+    with pytest.raises(HTTPException) as rejected:
+        tokens.dependency(HTTPAuthorizationCredentials(scheme="Bearer", credentials=bad))
+    assert rejected.value.status_code == 401
+    # Legacy opaque tokens are left to the service when tokens are not required
+    assert tokens.dependency(HTTPAuthorizationCredentials(scheme="Bearer", credentials="opaque-token")) is None
+
+    tokens.required = True
+    with pytest.raises(HTTPException):
+        tokens.dependency(HTTPAuthorizationCredentials(scheme="Bearer", credentials="opaque-token"))
+    with pytest.raises(HTTPException):
+        tokens.dependency(None)
+
+
+def test_logout_all_cutoff_rejects_tokens_issued_before_it():
+    user_id = uuid.uuid4()
+    now = int(time.time())
+    old, _ = issue_access_token(user_id, SECRET, 900, now=now - 10)
+    fresh, _ = issue_access_token(user_id, SECRET, 900, now=now)
+    other_user, _ = issue_access_token(uuid.uuid4(), SECRET, 900, now=now - 10)
+    tokens = verifier()
+    tokens.revocations.add_user(user_id, revoked_before=now, expires_at=now + 900)
+
+    with pytest.raises(InvalidToken, match="revoked"):
+        tokens.verify(old)
+    assert tokens.verify(fresh).user_id == user_id
+    assert tokens.verify(other_user).user_id != user_id
+
+
+def test_cutoffs_are_replaced_by_sync_and_pruned_once_expired():
+    user_id = uuid.uuid4()
+    now = int(time.time())
+    token, claims = issue_access_token(user_id, SECRET, 900, now=now - 10)
+    revocations = RevocationList()
+
+    revocations.replace({}, {user_id: (now, now + 60)})
+    assert revocations.is_revoked(claims)
+    revocations.prune(now=now + 61)
+    assert not revocations.is_revoked(claims)
+
+    revocations.replace({}, {user_id: (now, now - 1)})
+    assert not revocations.is_revoked(claims)
+
+
+def test_token_without_iat_is_older_than_any_cutoff():
+    user_id = uuid.uuid4()
+    legacy = sign({"sub": str(user_id), "exp": int(time.time()) + 900, "jti": "legacy"})
+    tokens = verifier()
+    assert tokens.verify(legacy).issued_at == 0
+
+    tokens.revocations.add_user(user_id, revoked_before=int(time.time()), expires_at=int(time.time()) + 900)
+    with pytest.raises(InvalidToken, match="revoked"):
+        tokens.verify(legacy)
@@ -0,0 +1,84 @@
+"""
+User Service routes that only other services may call: DELETE /{user_id}
+and POST /import must refuse every caller without SERVICE_TOKEN, including
+users holding a valid signed token.
+"""
+import uuid
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from conftest import import_service
+from shared.tokens import SERVICE_TOKEN_HEADER, issue_access_token
+
+(routers,) = import_service("user_service", "routers")
+
+SECRET = "internal-secret"
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(routers.service_credential, "secret", SECRET)
+    monkeypatch.setattr(routers.token_verifier, "secret", b"token-secret")
+    deleted = []
+
+    async def run_db(db, fn, *args):
+        deleted.append(args[0])
+        return True
+
+    monkeypatch.setattr(routers, "run_db", run_db)
+    app = FastAPI()
+    app.include_router(routers.user_router)
+    app.dependency_overrides[routers.get_db] = lambda: None
+    client = TestClient(app)
+    client.deleted = deleted
+    return client
+
+
+def test_anonymous_delete_is_forbidden(client):
+    response = client.delete(f"/{uuid.uuid4()}")
+    assert response.status_code == 403
+    assert client.deleted == []
+
+
+def test_users_own_signed_token_cannot_delete(client):
+    user_id = uuid.uuid4()
+    token, _ = issue_access_token(user_id, b"token-secret", 60)
+    response = client.delete(f"/{user_id}", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 403
+    assert client.deleted == []
+
+
+def test_wrong_service_token_is_forbidden(client):
+    response = client.delete(f"/{uuid.uuid4()}", headers={SERVICE_TOKEN_HEADER: "guess"})
+    assert response.status_code == 403
+    assert client.deleted == []
+
+
+def test_delete_is_closed_without_service_token_configured(client, monkeypatch):
+    monkeypatch.setattr(routers.service_credential, "secret", None)
+    response = client.delete(f"/{uuid.uuid4()}", headers={SERVICE_TOKEN_HEADER: ""})
+    assert response.status_code == 403
+
+
+def test_service_token_deletes(client):
+    user_id = uuid.uuid4()
+    response = client.delete(f"/{user_id}", headers={SERVICE_TOKEN_HEADER: SECRET})
+    assert response.status_code == 204
+    assert client.deleted == [user_id]
+
+
+def test_patient_token_cannot_import(client):
+    token, _ = issue_access_token(uuid.uuid4(), b"token-secret", 60)
+    roster = "first_name,last_name,dni,email,phone,birth_date\nA,B,12345678,a@b.co,,\n"
+    for headers in ({}, {"Authorization": f"Bearer {token}"}):
+        response = client.post("/import", content=roster, headers=headers)
+        assert response.status_code == 403
+
+
+def test_service_token_reaches_import(client):
+    # An empty roster is refused before the database is touched
+    response = client.post("/import", content=" ", headers={SERVICE_TOKEN_HEADER: SECRET})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Empty roster"